@@ -7,22 +7,139 @@ import time
 import requests
 from google.cloud import speech_v1 as speech
 import anthropic
-from datetime import datetime, timedelta
+from anthropic.types import TextBlock
+from datetime import timedelta
 import csv
 import ast
 from google.cloud import storage
-import pickle
+import struct
+from itertools import islice, permutations, product
+from operator import itemgetter
+import zlib
+import json
+import difflib
+import sys
+import hashlib
+import re
 import os
 import platform
 from werkzeug.datastructures import CallbackDict
 from flask.sessions import SessionInterface, SessionMixin
+from google.api_core.exceptions import NotFound, PreconditionFailed, DeadlineExceeded, ServiceUnavailable
+import grpc
+from collections import Counter, OrderedDict, deque
+import concurrent.futures
+from enum import IntEnum
+import threading
+import atexit
+import queue
+import io
+import wave
+import warnings
+with warnings.catch_warnings():
+    # audioop is deprecated from Python 3.13; without it audio is sent to Google untrimmed
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:
+        audioop = None
+try:
+    # PyAV decodes the Opus/WebM and AAC/MP4 recordings MediaRecorder makes
+    import av
+except ImportError:
+    av = None
 
 app = Flask(__name__)
 
+# Simple per-worker counters (cache hits, Claude calls, ...), served at /metrics
+metrics = Counter()
+metrics_lock = threading.Lock()
+
+def count(name, amount=1):
+    with metrics_lock:
+        metrics[name] += amount
+
+# API clients are made lazily in each worker process rather than at import: gunicorn forks
+# its workers after importing main.py, and gRPC channels and HTTP connection pools don't
+# survive a fork. A pool keeps up to `size` clients per process and hands them out in turn;
+# recycle() drops a client after a channel or connection error so the next get() builds a
+# fresh one. warm_clients() builds them ahead of the first request.
+class ClientPool:
+    def __init__(self, name, factory, size=1):
+        self.name = name
+        self.factory = factory
+        self.size = size
+        self.clients = []
+        self.next = 0
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def get(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.clients = []
+                self.pid = os.getpid()
+            if len(self.clients) < self.size:
+                client = self.factory()
+                self.clients.append(client)
+                count(f'{self.name}_clients_created')
+                return client
+            self.next = (self.next + 1) % len(self.clients)
+            return self.clients[self.next]
+
+    def recycle(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+                count(f'{self.name}_clients_recycled')
+
+    # Calls func, recycling `client` if it fails with one of `errors`
+    def guard(self, client, errors, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except errors:
+            self.recycle(client)
+            raise
+
+# The storage client talks HTTP through a requests session; these mean its connections are bad
+STORAGE_CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+# Stands in for a storage Bucket, fetching the real one from the calling process's client.
+# Blobs it hands out remember that client, and any call on them that fails with a connection
+# error recycles it, as transcribe_audio does for speech clients.
+class PooledBucket:
+    def __init__(self, clients, name):
+        self.clients = clients
+        self.name = name
+
+    def blob(self, *args, **kwargs):
+        client = self.clients.get()
+        return PooledBlob(self.clients, client, client.bucket(self.name).blob(*args, **kwargs))
+
+    def get_blob(self, *args, **kwargs):
+        client = self.clients.get()
+        blob = self.clients.guard(client, STORAGE_CONNECTION_ERRORS, client.bucket(self.name).get_blob, *args, **kwargs)
+        return blob and PooledBlob(self.clients, client, blob)
+
+    def __getattr__(self, attr):
+        return getattr(self.clients.get().bucket(self.name), attr)
+
+class PooledBlob:
+    def __init__(self, clients, client, blob):
+        self.clients = clients
+        self.client = client
+        self.blob = blob
+
+    def __getattr__(self, attr):
+        value = getattr(self.blob, attr)
+        if not callable(value):
+            return value
+        return lambda *args, **kwargs: self.clients.guard(self.client, STORAGE_CONNECTION_ERRORS, value, *args, **kwargs)
+
 # Initialize GCS client
-storage_client = storage.Client()
+storage_clients = ClientPool('storage', storage.Client)
 bucket_name = "GCS_BUCKET_NAME"
-bucket = storage_client.bucket(bucket_name)
+bucket = PooledBucket(storage_clients, bucket_name)
 
 def upload_to_gcs(local_file_path, gcs_file_path):
     blob = bucket.blob(gcs_file_path)
@@ -47,13 +164,530 @@ class GCSSession(CallbackDict, SessionMixin):
         CallbackDict.__init__(self, initial, on_update)
         self.sid = sid
         self.modified = False
+        self.seen = 0
+
+class Location(IntEnum):
+    bridge = 0
+    readyroom = 1
+    engineering = 2
+    escapepod = 3
+
+LOCATIONS = tuple(Location)
+LOCATION_NAMES = tuple(location.name for location in Location)
+INVENTORY_ITEMS = ('+ Miscellaneous cleansing tools and fluids', '+ A book -possibly about space rescues.',
+                   '+ A book: Pride and Prejudice by Jane Austen.', '+ DAVE')
+RESPONSE_TYPES = ('response', 'special', 'oscar', 'goodbye', 'load', 'default')
+RESPONSE_INDEX = {response_type: index for index, response_type in enumerate(RESPONSE_TYPES)}
+INVENTORY_INDEX = {item: index for index, item in enumerate(INVENTORY_ITEMS)}
+
+# Response logs longer than this many bytes are zlib-compressed when stored. Off (0) by default:
+# polling keeps logs short, and compressing costs more time than the bytes it saves.
+SESSION_COMPRESS_MIN = int(os.environ.get('SESSION_COMPRESS_MIN', 0))
+
+# GameState flags go to and from their int through one '?' byte per flag (FLAG_VALUES) and a
+# string of binary digits, a few C calls in place of a loop over the bits.
+FLAG_BYTES_TO_DIGITS = bytes.maketrans(b'\0\1', b'01')
+FLAG_DIGITS_TO_BYTES = bytes.maketrans(b'01', b'\0\1')
+
+# The RESPONSE_TYPES indexes and delays of a GameState log with `count` entries, as one
+# struct.Struct compiled the first time a log that long is seen
+LOG_STRUCTS = {}
+
+def log_struct(count):
+    packer = LOG_STRUCTS.get(count)
+    if packer is None:
+        packer = LOG_STRUCTS[count] = struct.Struct(f'<{count}B{count}H')
+    return packer
+
+# Typed game state stored in place of the pickled session dict. Booleans are
+# packed into a single int, locations are Location values, and the whole thing
+# serialises to a small versioned binary blob:
+#
+#   header:    magic 'CB', version, options, flags, 4 locations, actioncount, errorcount, next_seq,
+#              the length of the inventory and log that follow, item count, log entry count
+#   inventory: an INVENTORY_ITEMS index per item
+#              (0xff + length-prefixed UTF-8 for anything not in the table)
+#   log:       RESPONSE_TYPES index per entry, delays in whole seconds when options has
+#              OPT_SECONDS set and in centiseconds otherwise, then every text joined
+#              with NULs as one UTF-8 string. Compressed with zlib when options has
+#              OPT_ZLIB set.
+#
+# Log entries are only ever appended (with the next sequence number) or pruned from
+# the front, so their seqs always run contiguously up to next_seq - 1 and aren't stored.
+# Version 1 blobs (timestamped entries, no next_seq) and version 2 blobs (no length, counts
+# in the body) are still readable. A blob whose length doesn't match its header is rejected.
+class GameState:
+    FLAGS = ('hasbook', 'hasdave', 'seenerror', 'seenbridge', 'seenreadyroom', 'seenpanel', 'seenfire',
+             'seenengineering', 'seenescapepod', 'seenoscar', 'seendave', 'beenbridge', 'beenreadyroom',
+             'beenengineering', 'panelopen', 'hatchopen', 'klaxonopen', 'readbook', 'awareengineering',
+             'launch', 'goodbye_status')
+    FLAG_BITS = tuple((1 << bit, name) for bit, name in enumerate(FLAGS))
+    DEFAULT_FLAGS = 1 << FLAGS.index('beenbridge') | 1 << FLAGS.index('klaxonopen')
+
+    FLAG_VALUES = struct.Struct(f'<{len(FLAGS)}?')
+    FLAG_FORMAT = f'0{len(FLAGS)}b'
+
+    MAGIC = b'CB'
+    VERSION = 3
+    OPT_ZLIB = 1
+    OPT_SECONDS = 2
+    HEADER = struct.Struct('<2sBBIBBBBHHIIBH')
+    HEADER_V2 = struct.Struct('<2sBBIBBBBHHI')
+    HEADER_V1 = struct.Struct('<2sBBIBBBBHH')
+    HEADERS = {VERSION: HEADER, 2: HEADER_V2, 1: HEADER_V1}
+
+    __slots__ = ('flags', 'location', 'booklocation', 'davelocation', 'oscarlocation',
+                 'actioncount', 'errorcount', 'inventory', 'response_log', 'next_seq')
+
+    def __init__(self):
+        self.flags = self.DEFAULT_FLAGS
+        self.location = Location.bridge
+        self.booklocation = Location.readyroom
+        self.davelocation = Location.engineering
+        self.oscarlocation = Location.engineering
+        self.actioncount = 0
+        self.errorcount = 0
+        self.inventory = [INVENTORY_ITEMS[0]]
+        self.response_log = []
+        self.next_seq = 1
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls.__new__(cls)
+        state.flags = cls.pack_flags([data.get(name, default) for name, default in cls.FLAG_DEFAULTS])
+        state.location = Location[data.get('location', 'bridge')]
+        state.booklocation = Location[data.get('booklocation', 'readyroom')]
+        state.davelocation = Location[data.get('davelocation', 'engineering')]
+        state.oscarlocation = Location[data.get('oscarlocation', 'engineering')]
+        state.actioncount = data.get('actioncount', 0)
+        state.errorcount = data.get('errorcount', 0)
+        state.inventory = list(data.get('inventory', INVENTORY_ITEMS[:1]))
+        state.response_log = list(data.get('response_log', ()))
+        state.next_seq = data.get('next_seq') or (state.response_log[-1]['seq'] + 1 if state.response_log else 1)
+        return state
+
+    def to_dict(self):
+        data = dict(zip(self.FLAGS, self.unpack_flags(self.flags)))
+        data['location'] = LOCATION_NAMES[self.location]
+        data['booklocation'] = LOCATION_NAMES[self.booklocation]
+        data['davelocation'] = LOCATION_NAMES[self.davelocation]
+        data['oscarlocation'] = LOCATION_NAMES[self.oscarlocation]
+        data['actioncount'] = self.actioncount
+        data['errorcount'] = self.errorcount
+        data['inventory'] = self.inventory
+        data['response_log'] = self.response_log
+        data['next_seq'] = self.next_seq
+        return data
+
+    @classmethod
+    def pack_flags(cls, values):
+        return int(cls.FLAG_VALUES.pack(*values).translate(FLAG_BYTES_TO_DIGITS)[::-1], 2)
+
+    @classmethod
+    def unpack_flags(cls, flags):
+        return cls.FLAG_VALUES.unpack(format(flags, cls.FLAG_FORMAT)[::-1].encode().translate(FLAG_DIGITS_TO_BYTES))
+
+    def dumps(self, compress_min=SESSION_COMPRESS_MIN):
+        try:
+            inventory = bytes([INVENTORY_INDEX[item] for item in self.inventory])
+        except KeyError:
+            inventory = bytearray()
+            for item in self.inventory:
+                if item in INVENTORY_INDEX:
+                    inventory.append(INVENTORY_INDEX[item])
+                else:
+                    item = item.encode('utf-8')
+                    inventory += b'\xff' + len(item).to_bytes(2, 'little') + item
+
+        response_log = self.response_log
+        count = len(response_log)
+        options = 0
+        log = b''
+        if count:
+            types = bytearray()
+            delays = []
+            texts = []
+            for entry in response_log:
+                types.append(RESPONSE_INDEX[entry['id']])
+                delays.append(entry['delay'])
+                texts.append(entry['text'])
+            try:
+                log = log_struct(count).pack(*types, *delays)
+                options = self.OPT_SECONDS
+            except struct.error:
+                # Some delays are fractions of a second
+                log = log_struct(count).pack(*types, *[round(delay * 100) for delay in delays])
+            log += '\0'.join(texts).encode('utf-8')
+            if compress_min and len(log) > compress_min:
+                options |= self.OPT_ZLIB
+                log = zlib.compress(log, 1)
+        return self.HEADER.pack(self.MAGIC, self.VERSION, options, self.flags, self.location, self.booklocation,
+                                self.davelocation, self.oscarlocation, min(self.actioncount, 0xffff),
+                                min(self.errorcount, 0xffff), self.next_seq, len(inventory) + len(log),
+                                len(self.inventory), count) + inventory + log
+
+    @classmethod
+    def loads(cls, data):
+        if len(data) < 3 or data[:2] != cls.MAGIC:
+            raise ValueError('not a saved GameState')
+        version = data[2]
+        header = cls.HEADERS.get(version)
+        if header is None:
+            raise ValueError(f'unsupported GameState version {version}')
+        if len(data) < header.size:
+            raise ValueError('truncated GameState')
+        offset = header.size
+        if version == cls.VERSION:
+            (_, _, options, flags, location, booklocation, davelocation, oscarlocation,
+             actioncount, errorcount, next_seq, length, item_count, count) = header.unpack_from(data)
+            if len(data) != offset + length:
+                raise ValueError(f'GameState is {len(data)} bytes but its header says {offset + length}')
+        else:
+            if version == 2:
+                (_, _, options, flags, location, booklocation, davelocation, oscarlocation,
+                 actioncount, errorcount, next_seq) = header.unpack_from(data)
+            else:
+                (_, _, options, flags, location, booklocation, davelocation, oscarlocation,
+                 actioncount, errorcount) = header.unpack_from(data)
+                next_seq = None
+            # Versions 1 and 2 keep the counts in the body
+            if len(data) == offset:
+                raise ValueError('truncated GameState')
+            item_count = data[offset]
+            offset += 1
+            count = None
+
+        state = cls.__new__(cls)
+        state.flags = flags
+        state.location = LOCATIONS[location]
+        state.booklocation = LOCATIONS[booklocation]
+        state.davelocation = LOCATIONS[davelocation]
+        state.oscarlocation = LOCATIONS[oscarlocation]
+        state.actioncount = actioncount
+        state.errorcount = errorcount
+
+        items = data[offset:offset + item_count]
+        if 0xff not in items:
+            inventory = [INVENTORY_ITEMS[item] for item in items]
+            offset += len(items)
+        else:
+            inventory = []
+            for _ in range(item_count):
+                if data[offset] == 0xff:
+                    length = int.from_bytes(data[offset + 1:offset + 3], 'little')
+                    inventory.append(data[offset + 3:offset + 3 + length].decode('utf-8'))
+                    offset += 3 + length
+                else:
+                    inventory.append(INVENTORY_ITEMS[data[offset]])
+                    offset += 1
+        state.inventory = inventory
+
+        log = data[offset:]
+        if options & cls.OPT_ZLIB:
+            log = zlib.decompress(log)
+        if count is None:
+            count = int.from_bytes(log[:2], 'little')
+            log = log[2:]
+        if len(log) < 3 * count:
+            raise ValueError('truncated GameState response log')
+        values = log_struct(count).unpack_from(log)
+        types = values[:count]
+        delays = values[count:]
+        if not options & cls.OPT_SECONDS:
+            delays = [delay // 100 if delay % 100 == 0 else delay / 100 for delay in delays]
+        texts = log[3 * count:].decode('utf-8').split('\0') if count else ()
+        if next_seq is None:
+            # Version 1 stored a timestamp after each text; number the entries from 1
+            texts = texts[::2]
+            next_seq = count + 1
+        if len(texts) != count:
+            raise ValueError('truncated GameState response log')
+        state.next_seq = next_seq
+        state.response_log = [{
+            'seq': seq,
+            'text': text,
+            'delay': delay,
+            'id': RESPONSE_TYPES[response_type]
+        } for seq, text, delay, response_type in zip(range(next_seq - count, next_seq), texts, delays, types)]
+        return state
+
+    # Three-way merge used when two requests saved the same session concurrently.
+    # Fields we changed since `base` win over `theirs`, counters add up, and the
+    # response log keeps their entries minus the ones we pruned, plus the ones we added
+    # renumbered to follow theirs. A counter that went down on either side was reset
+    # (a new game from index()), so that side's value is kept instead of adding up.
+    @classmethod
+    def merge(cls, base, ours, theirs):
+        merged = cls.__new__(cls)
+        changed = ours.flags ^ base.flags
+        merged.flags = theirs.flags & ~changed | ours.flags & changed
+        for name in ('location', 'booklocation', 'davelocation', 'oscarlocation', 'inventory'):
+            setattr(merged, name, getattr(ours if getattr(ours, name) != getattr(base, name) else theirs, name))
+        merged.actioncount = cls.merge_counter(base.actioncount, ours.actioncount, theirs.actioncount)
+        merged.errorcount = cls.merge_counter(base.errorcount, ours.errorcount, theirs.errorcount)
+
+        first_seq = ours.next_seq - len(ours.response_log)
+        merged.response_log = [entry for entry in theirs.response_log if entry['seq'] >= first_seq]
+        merged.next_seq = theirs.next_seq
+        for entry in ours.response_log:
+            if entry['seq'] >= base.next_seq:
+                merged.response_log.append(dict(entry, seq=merged.next_seq))
+                merged.next_seq += 1
+        return merged
+
+    @staticmethod
+    def merge_counter(base, ours, theirs):
+        if ours < base:
+            return ours
+        if theirs < base:
+            return theirs
+        return max(0, theirs + ours - base)
+
+def merge_session_data(base, ours, theirs):
+    base = GameState.loads(base) if base is not None else GameState()
+    return GameState.merge(base, GameState.loads(ours), GameState.loads(theirs)).dumps()
+
+def _flag_property(bit):
+    def get(self):
+        return bool(self.flags & bit)
+    def set(self, value):
+        self.flags = self.flags | bit if value else self.flags & ~bit
+    return property(get, set)
+
+for _bit, _name in GameState.FLAG_BITS:
+    setattr(GameState, _name, _flag_property(_bit))
+GameState.FLAG_DEFAULTS = tuple(zip(GameState.FLAGS, GameState.unpack_flags(GameState.DEFAULT_FLAGS)))
+
+# Per-worker session cache settings. Warm sessions are served from memory, and changed
+# sessions are written through to GCS before the request or job that changed them finishes,
+# so the cache only saves reads. Every response hands the browser the newest GCS generation
+# of its session in the SESSION_GENERATION_COOKIE cookie; a worker whose cached copy is older
+# than that reloads it, and otherwise serves it without asking GCS. Sessions left unused for
+# SESSION_CACHE_TTL seconds are dropped.
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 1000))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 300))
+SESSION_WRITE_RETRIES = int(os.environ.get('SESSION_WRITE_RETRIES', 5))
+SESSION_GENERATION_COOKIE = 'session_generation'
+
+# /new_responses?wait=<seconds> holds the request open (up to LONG_POLL_TIMEOUT) until the
+# session gains new responses. It's woken by saves and reloads of the session in the same
+# worker and never polls GCS, so a waiting player costs no GCS calls. A turn finished by
+# another worker reaches the page through its /jobs poll, and the /new_responses request that
+# follows carries the new session generation, so it reloads the session wherever it lands.
+# Each held poll ties up a gunicorn thread, so at most LONG_POLL_MAX are held per worker; past
+# that, polls are answered straight away with a retry_after the page waits out before asking
+# again, which leaves the remaining threads for /record, /jobs and page loads.
+LONG_POLL_TIMEOUT = float(os.environ.get('LONG_POLL_TIMEOUT', 25))
+LONG_POLL_MAX = int(os.environ.get('LONG_POLL_MAX', 16))
+LONG_POLL_BUSY_RETRY = 3
+long_poll_slots = threading.BoundedSemaphore(LONG_POLL_MAX)
+
+class CacheEntry:
+    __slots__ = ('data', 'base', 'generation', 'version', 'used', 'dirty', 'write_lock')
+
+    def __init__(self, data, generation, used):
+        self.data = data
+        self.base = data
+        self.generation = generation
+        self.version = 0
+        self.used = used
+        self.dirty = False
+        self.write_lock = threading.Lock()
+
+# Bounded LRU/TTL write-through cache of serialised sessions, keyed by GCS path.
+# Clean entries left unused for `ttl` seconds are dropped. A cached entry is used without
+# asking GCS unless the caller has seen a newer generation of it, which is how a worker
+# learns of writes made elsewhere (see GCSSessionInterface.open_session). put() uploads before it returns, so requests for one session can move between
+# workers and instances freely. An entry stays dirty only when its upload failed; it's
+# written again by the next put(), when it's evicted, or at exit.
+#
+# Writes are optimistic: every entry remembers the GCS generation its `base` came
+# from and uploads with if_generation_match. When someone else got there first the
+# remote copy is merged in with `merge(base, ours, theirs)` and the write retried.
+# Sessions saved in-process are checked the same way against the entry's version.
+class SessionCache:
+    def __init__(self, bucket, merge, maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL,
+                 retries=SESSION_WRITE_RETRIES):
+        self.bucket = bucket
+        self.merge = merge
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.retries = retries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.waiters = {}
+
+    # Returns (data, generation, version); data is None for a session that isn't stored yet.
+    # `seen` is the newest GCS generation the caller knows of; a cached copy older than that
+    # is reloaded.
+    def get(self, path, seen=0):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and (entry.dirty or entry.generation >= seen and now - entry.used < self.ttl):
+                entry.used = now
+                self.entries.move_to_end(path)
+                return entry.data, entry.generation, entry.version
+
+        blob = self.bucket.blob(path)
+        try:
+            data = blob.download_as_bytes()
+            generation = blob.generation
+        except NotFound:
+            data, generation = None, 0
+
+        with self.lock:
+            current = self.entries.get(path)
+            if current is not None and (current.dirty or current is not entry or current.generation > generation):
+                # Another thread refreshed or wrote it while we were downloading
+                return current.data, current.generation, current.version
+            if current is not None and current.data != data:
+                current.version += 1
+                self._notify(path)
+            if current is None:
+                current = self.entries[path] = CacheEntry(data, generation, 0)
+            current.data = current.base = data
+            current.generation = generation
+            current.used = time.monotonic()
+            self.entries.move_to_end(path)
+            evicted = self._evict()
+        self._write_all(evicted)
+        return current.data, current.generation, current.version
+
+    # `base`, `generation` and `version` are what get() returned when the session was opened.
+    # Returns the GCS generation the session was written as once it's in GCS; raises if it
+    # couldn't be written.
+    def put(self, path, data, base, generation, version):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                entry = self.entries[path] = CacheEntry(base, generation, now)
+                entry.version = version
+            if entry.version != version and data != entry.data:
+                data = self.merge(base, data, entry.data)
+            if data != entry.data:
+                entry.data = data
+                entry.version += 1
+                entry.dirty = True
+                self._notify(path)
+            entry.used = now
+            self.entries.move_to_end(path)
+            evicted = self._evict()
+        self._write_all(evicted)
+        self._write(path, entry)
+        return entry.generation
+
+    def delete(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
+        try:
+            self.bucket.blob(path).delete()
+        except NotFound:
+            pass
+
+    # Blocks until the cached copy of `path` moves past `version`, or `timeout` seconds pass.
+    # Returns True if it moved.
+    def wait(self, path, version, timeout):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.version != version:
+                return True
+            waiter = self.waiters.get(path)
+            if waiter is None:
+                waiter = self.waiters[path] = [threading.Condition(self.lock), 0]
+            waiter[1] += 1
+            try:
+                waiter[0].wait(timeout)
+            finally:
+                waiter[1] -= 1
+                if not waiter[1]:
+                    del self.waiters[path]
+            entry = self.entries.get(path)
+            return entry is not None and entry.version != version
+
+    def _notify(self, path):
+        # Called with the lock held
+        waiter = self.waiters.get(path)
+        if waiter is not None:
+            waiter[0].notify_all()
+
+    # Retries the writes that failed
+    def flush(self):
+        with self.lock:
+            dirty = [(path, entry) for path, entry in self.entries.items() if entry.dirty]
+        self._write_all(dirty)
+
+    def _evict(self):
+        # Called with the lock held. Dirty entries pushed out of the cache are
+        # returned so the caller can write them back outside the lock.
+        evicted = []
+        while len(self.entries) > self.maxsize:
+            path, entry = self.entries.popitem(last=False)
+            if entry.dirty:
+                evicted.append((path, entry))
+        return evicted
+
+    def _write_all(self, items):
+        for path, entry in items:
+            try:
+                self._write(path, entry)
+            except Exception as e:
+                print(f"Error writing session {path}: {e}")
+
+    # One write of an entry at a time; a put() made while another is uploading waits for it,
+    # then uploads whatever the upload didn't include
+    def _write(self, path, entry):
+        with entry.write_lock:
+            self._upload(path, entry)
+
+    def _upload(self, path, entry):
+        with self.lock:
+            if not entry.dirty:
+                return
+            snapshot, base, generation = entry.data, entry.base, entry.generation
+
+        blob = self.bucket.blob(path)
+        data = snapshot
+        for attempt in range(self.retries):
+            try:
+                blob.upload_from_string(data, if_generation_match=generation)
+                break
+            except PreconditionFailed:
+                try:
+                    theirs = blob.download_as_bytes()
+                    generation = blob.generation
+                except NotFound:
+                    theirs, generation = None, 0
+                if theirs is not None:
+                    data = self.merge(base, data, theirs)
+                base = theirs
+        else:
+            raise RuntimeError(f'still conflicting after {self.retries} attempts')
+
+        with self.lock:
+            entry.base = data
+            entry.generation = blob.generation
+            if entry.data is snapshot:
+                entry.dirty = False
+                if data != snapshot:
+                    entry.data = data
+                    entry.version += 1
+                    self._notify(path)
+            elif data != snapshot:
+                # Saved again while we were uploading; fold the remote changes in
+                entry.data = self.merge(snapshot, entry.data, data)
+                entry.version += 1
+                self._notify(path)
 
 class GCSSessionInterface(SessionInterface):
     session_class = GCSSession
 
     def __init__(self, bucket_name, prefix='session:'):
-        self.bucket = storage_client.bucket(bucket_name)
+        self.bucket = PooledBucket(storage_clients, bucket_name)
         self.prefix = prefix
+        self.cache = SessionCache(self.bucket, merge_session_data)
+        atexit.register(self.cache.flush)
 
     def generate_sid(self):
         return os.urandom(24).hex()
@@ -62,66 +696,70 @@ class GCSSessionInterface(SessionInterface):
         return f'{self.prefix}{sid}'
 
     def open_session(self, app, request):
+        # A job's session is opened before its request context exists; see run_in_session
+        if JOB_SESSION_KEY in request.environ:
+            return request.environ[JOB_SESSION_KEY]
         sid = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
         if not sid:
             sid = self.generate_sid()
-            session = self.session_class(sid=sid)
+            session = self.session_class(GameState().to_dict(), sid=sid)
+            session.base, session.generation, session.version = None, 0, 0
             print('Oops - new session generated. Tell dad.')
         else:
-            try:
-                blob = self.bucket.blob(self.get_gcs_path(sid))
-                if blob.exists():
-                    data = blob.download_as_bytes()
-                    data = pickle.loads(data)
-                    session = self.session_class(data, sid=sid)
-                else:
-                    session = self.session_class(sid=sid)
-            except Exception as e:
-                print(f"Error opening session: {e}")
-                session = self.session_class(sid=sid)
-
-        # Initialize session variables with default values if they are not already set
-        session.setdefault('location', "bridge")
-        session.setdefault('inventory', ['+ Miscellaneous cleansing tools and fluids'])
-        session.setdefault('hasbook', False)
-        session.setdefault('hasdave', False)
-        session.setdefault('booklocation', "readyroom")
-        session.setdefault('davelocation', "engineering")
-        session.setdefault('oscarlocation', "engineering")
-        session.setdefault('seenerror', False)
-        session.setdefault('seenbridge', False)
-        session.setdefault('seenreadyroom', False)
-        session.setdefault('seenpanel', False)
-        session.setdefault('seenfire', False)
-        session.setdefault('seenengineering', False)
-        session.setdefault('seenescapepod', False)
-        session.setdefault('seenoscar', False)
-        session.setdefault('seendave', False)
-        session.setdefault('beenbridge', True)
-        session.setdefault('beenreadyroom', False)
-        session.setdefault('beenengineering', False)
-        session.setdefault('panelopen', False)
-        session.setdefault('hatchopen', False)
-        session.setdefault('klaxonopen', True)
-        session.setdefault('readbook', False)
-        session.setdefault('awareengineering', False)
-        session.setdefault('launch', False)
-        session.setdefault('actioncount', 0)
-        session.setdefault('errorcount', 0)
+            session = self.open_sid(sid, request.cookies.get(SESSION_GENERATION_COOKIE, type=int, default=0))
+
+        return session
 
+    # `seen` is the newest generation of the session the browser has been told about
+    def open_sid(self, sid, seen=0):
+        try:
+            data, generation, version = self.cache.get(self.get_gcs_path(sid), seen)
+            if data is not None:
+                session = self.session_class(GameState.loads(data).to_dict(), sid=sid)
+            else:
+                session = self.session_class(GameState().to_dict(), sid=sid)
+            session.base, session.generation, session.version = data, generation, version
+        except Exception as e:
+            print(f"Error opening session: {e}")
+            session = self.session_class(GameState().to_dict(), sid=sid)
+            session.base, session.generation, session.version = None, 0, 0
+        session.seen = max(seen, session.generation)
         return session
 
+    # Waits up to `timeout` seconds for another request or job in this worker to change this
+    # session and reloads it in place. Returns False if nothing changed. Only the cache is
+    # watched, so waiting costs no GCS calls.
+    def wait_for_update(self, session, timeout):
+        path = self.get_gcs_path(session.sid)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.cache.wait(path, session.version, remaining):
+                return False
+            data, generation, version = self.cache.get(path)
+            if data is not None and (version != session.version or data != session.base):
+                session.clear()
+                session.update(GameState.loads(data).to_dict())
+                session.base, session.generation, session.version = data, generation, version
+                session.modified = False
+                return True
+
     def save_session(self, app, session, response):
         if not session:
-            blob = self.bucket.blob(self.get_gcs_path(session.sid))
-            blob.delete()
+            self.cache.delete(self.get_gcs_path(session.sid))
             if session.modified:
                 response.delete_cookie(app.config['SESSION_COOKIE_NAME'])
             return
-        data = pickle.dumps(dict(session))
-        blob = self.bucket.blob(self.get_gcs_path(session.sid))
-        blob.upload_from_string(data)
+        self.store(session)
         response.set_cookie(app.config['SESSION_COOKIE_NAME'], session.sid, httponly=True, secure=app.config.get('SESSION_COOKIE_SECURE', True))
+        response.set_cookie(SESSION_GENERATION_COOKIE, str(session.seen), httponly=True, secure=app.config.get('SESSION_COOKIE_SECURE', True))
+
+    def store(self, session):
+        # Unmodified sessions are never re-serialised or re-uploaded
+        if session.modified:
+            written = self.cache.put(self.get_gcs_path(session.sid), GameState.from_dict(session).dumps(),
+                                     session.base, session.generation, session.version)
+            session.seen = max(session.seen, written)
 
 # Configure GCS session interface
 app.session_interface = GCSSessionInterface(bucket_name=bucket_name)
@@ -129,34 +767,191 @@ app.config['SESSION_PERMANENT'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 app.config['SESSION_USE_SIGNER'] = True
 
+# /record and /load_game hand their speech-to-text, Claude and game logic work to a pool of
+# JOB_WORKERS threads and return 202 straight away. At most JOB_QUEUE_DEPTH jobs wait for a
+# thread; beyond that requests are turned away with a 503. Finished jobs can be looked up
+# at /jobs/<id> for JOB_RESULT_TTL seconds. The job only lives in the worker that took the
+# upload, so its result is also written to GCS under JOBS_PREFIX, where /jobs/<id> finds it
+# when the poll reaches another worker. (Like session files, these want a lifecycle rule to
+# clear them out.) A job id starts with the time it was submitted, so a worker that has
+# neither the job nor its result can tell a job that may still be running elsewhere (under
+# JOB_PENDING_MAX seconds old) from one that's gone or never existed, and answer 404 straight
+# away. Waiting /jobs/<id> polls are held under the same LONG_POLL_MAX limit as
+# /new_responses; one waiting on a job in another worker checks GCS for its result every
+# LONG_POLL_RECHECK seconds. A finished job's reply carries the generation its session was
+# written as (see SESSION_GENERATION_COOKIE).
+JOBS_PREFIX = 'jobs/'
+JOB_PENDING_MAX = 60
+LONG_POLL_RECHECK = float(os.environ.get('LONG_POLL_RECHECK', 2))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_QUEUE_DEPTH = int(os.environ.get('JOB_QUEUE_DEPTH', 32))
+JOB_RESULT_TTL = float(os.environ.get('JOB_RESULT_TTL', 300))
+
+class Job:
+    __slots__ = ('id', 'sid', 'func', 'args', 'status', 'result', 'generation', 'finished', 'done')
+
+    def __init__(self, sid, func, args):
+        self.id = f'{int(time.time()):08x}{os.urandom(8).hex()}'
+        self.sid = sid
+        self.func = func
+        self.args = args
+        self.status = 'queued'
+        self.result = None
+        self.generation = 0
+        self.finished = None
+        self.done = threading.Event()
+
+class JobPool:
+    def __init__(self, workers=JOB_WORKERS, depth=JOB_QUEUE_DEPTH, result_ttl=JOB_RESULT_TTL):
+        self.workers = workers
+        self.queue = queue.Queue(depth)
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.pid = None
+
+    # Raises queue.Full when JOB_QUEUE_DEPTH jobs are already waiting
+    def submit(self, sid, func, *args):
+        self._start_workers()
+        job = Job(sid, func, args)
+        self.queue.put_nowait(job)
+        with self.lock:
+            self._expire()
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _expire(self):
+        # Called with the lock held
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished is not None and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def _start_workers(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own.
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = 'running'
+            try:
+                job.result, job.generation = run_in_session(job.sid, job.func, *job.args)
+            except Exception as e:
+                print(f"Error running job {job.id}: {e}")
+                job.result = {'status': 'error', 'message': str(e)}
+            job.status = 'done'
+            job.finished = time.monotonic()
+            job.done.set()
+            try:
+                bucket.blob(f'{JOBS_PREFIX}{job.id}').upload_from_string(json.dumps({'sid': job.sid, 'result': job.result, 'generation': job.generation}),
+                                                                      content_type='application/json')
+            except Exception as e:
+                print(f"Error sharing result of job {job.id}: {e}")
+
+# Seconds since the job with this id was submitted, or None if it isn't a job id
+def job_age(job_id):
+    try:
+        return time.time() - int(job_id[:8], 16) if len(job_id) == 24 else None
+    except ValueError:
+        return None
+
+# The result and session generation of a job another worker ran for session `sid`, or None
+# if it hasn't finished
+def shared_job(job_id, sid):
+    try:
+        data = json.loads(bucket.blob(f'{JOBS_PREFIX}{job_id}').download_as_text())
+    except NotFound:
+        return None
+    return data if data.get('sid') == sid else None
+
+# Runs func for session `sid` with that session opened as `session`, so game logic works as
+# it does in a request, then stores the session. Returns func's result and the generation
+# the session was written as. As with every session write, it's in GCS before
+# the job's result is published, so whichever worker the page asks next sees the finished
+# turn rather than the state from before it. Jobs have no request of their own, so they
+# get a request context for an empty POST to /jobs, which carries the opened session to
+# open_session under JOB_SESSION_KEY.
+JOB_SESSION_KEY = 'adventure.job_session'
+JOB_ENVIRON = {'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '', 'PATH_INFO': '/jobs', 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'https'}
+
+def run_in_session(sid, func, *args):
+    job_session = app.session_interface.open_sid(sid)
+    with app.request_context(dict(JOB_ENVIRON, **{'wsgi.input': io.BytesIO(), JOB_SESSION_KEY: job_session})):
+        result = func(*args)
+    app.session_interface.store(job_session)
+    return result, job_session.seen
+
+job_pool = JobPool()
+
+def submit_job(func, *args):
+    # Make sure the session exists before the job opens it again
+    session.modified = True
+    try:
+        job = job_pool.submit(session.sid, func, *args)
+    except queue.Full:
+        return jsonify({'status': 'error', 'message': 'Cleanerbot is busy. Try again in a moment.'}), 503, {'Retry-After': '2'}
+    return jsonify({'status': 'accepted', 'job_id': job.id}), 202
+
 
 # Claude and Google Cloud API keys
-client = anthropic.Anthropic(
+claude_clients = ClientPool('claude', lambda: anthropic.Anthropic(
     api_key="your_anthropic_api_key",
-)
+))
 GOOGLE_CLOUD_API_KEY = 'GOOGLE_APPLICATION_CREDENTIALS'
 
+# One gRPC channel multiplexes many calls, so a couple of clients cover all of a worker's threads
+speech_clients = ClientPool('speech', speech.SpeechClient, size=2)
+
+# Builds this process's clients and opens the speech channels, so the first command doesn't
+# pay for credentials and TLS handshakes. Runs in the background as each worker starts, and
+# again for App Engine's /_ah/warmup request.
+def warm_clients():
+    storage_clients.get()
+    claude_clients.get()
+    for _ in range(speech_clients.size):
+        try:
+            grpc.channel_ready_future(speech_clients.get().transport.grpc_channel).result(timeout=10)
+        except Exception as e:
+            print(f"Error warming speech client: {e}")
+
+threading.Thread(target=warm_clients, daemon=True).start()
+
+@app.route('/_ah/warmup')
+def warmup():
+    warm_clients()
+    return '', 200
+
 response_log = []
 
 initial_responses = [
-    {'delay': 0.3, 'id': 'special', 'text': '>> INCOMING DISTRESS SIGNAL', 'timestamp': (datetime.now() - timedelta(seconds=30)).isoformat()},
-    {'delay': 0.3, 'id': 'special', 'text': '>> HELLO? CAN YOU HEAR ME? This is CLEANERBOT27 of the shuttle craft ORION.', 'timestamp': (datetime.now() - timedelta(seconds=27)).isoformat()},
-    {'delay': 0.5, 'id': 'special', 'text': '>> There are klaxons and flashing lights which suggest that there is a severe problem. The smoke is a bit of a give away too.', 'timestamp': (datetime.now() - timedelta(seconds=22)).isoformat()},
-    {'delay': 0.3, 'id': 'special', 'text': '>> We have one lifesign onboard but I cannot get a response on the local intercom.', 'timestamp': (datetime.now() - timedelta(seconds=19)).isoformat()},
-    {'delay': 0.3, 'id': 'special', 'text': '>> I am not programmed for search and rescue. Please tell me what to do.\n', 'timestamp': (datetime.now() - timedelta(seconds=16)).isoformat()},
-    {'delay': 0.1, 'id': 'special', 'text': '>> Tap the [SEND COMMAND] button to record and send a brief (max. 5 second) voice command.\n\n', 'timestamp': (datetime.now() - timedelta(seconds=15)).isoformat()}
+    {'seq': 1, 'delay': 0.3, 'id': 'special', 'text': '>> INCOMING DISTRESS SIGNAL'},
+    {'seq': 2, 'delay': 0.3, 'id': 'special', 'text': '>> HELLO? CAN YOU HEAR ME? This is CLEANERBOT27 of the shuttle craft ORION.'},
+    {'seq': 3, 'delay': 0.5, 'id': 'special', 'text': '>> There are klaxons and flashing lights which suggest that there is a severe problem. The smoke is a bit of a give away too.'},
+    {'seq': 4, 'delay': 0.3, 'id': 'special', 'text': '>> We have one lifesign onboard but I cannot get a response on the local intercom.'},
+    {'seq': 5, 'delay': 0.3, 'id': 'special', 'text': '>> I am not programmed for search and rescue. Please tell me what to do.\n'},
+    {'seq': 6, 'delay': 0.1, 'id': 'special', 'text': '>> Tap the [SEND COMMAND] button to record and send a brief (max. 5 second) voice command.\n\n'}
 ]
 
 response_log.extend(initial_responses)
 
+# Every log entry gets the session's next sequence number, which the client uses
+# as its cursor for /new_responses?after=<seq>.
 def add_response_to_log(delay, text, response_type):
-    response_entry = {
-        'delay': delay,
-        'id': response_type,
-        'text': text,
-        'timestamp': datetime.now().isoformat()
-    }
-    session['response_log'].append(response_entry)
+    if isinstance(delay, str):
+        delay = int(delay)
+    seq = session.get('next_seq', 1)
+    session['response_log'].append({'seq': seq, 'text': text, 'delay': delay, 'id': response_type})
+    session['next_seq'] = seq + 1
     session.modified = True
 
 # Initialize global variables
@@ -197,49 +992,62 @@ errorcount = 0
 actionav = 0
 errorav = 0
 
-BASE_PROMPT = read_from_gcs('base_prompt.txt')
+# base_prompt.txt is re-read when its GCS generation changes, checked at most every
+# PROMPT_RELOAD_INTERVAL seconds, so prompt edits take effect without a redeploy.
+PROMPT_RELOAD_INTERVAL = float(os.environ.get('PROMPT_RELOAD_INTERVAL', 60))
+
+def load_base_prompt():
+    blob = bucket.blob('base_prompt.txt')
+    text = blob.download_as_text()
+    return text, blob.generation
+
+BASE_PROMPT, base_prompt_generation = load_base_prompt()
+BASE_PROMPT_HASH = hashlib.sha1(BASE_PROMPT.encode('utf-8')).hexdigest()[:12]
+base_prompt_checked = time.monotonic()
+base_prompt_lock = threading.Lock()
+
+def refresh_base_prompt():
+    global BASE_PROMPT, BASE_PROMPT_HASH, base_prompt_generation, base_prompt_checked, local_classifier
+    if time.monotonic() - base_prompt_checked < PROMPT_RELOAD_INTERVAL:
+        return
+    with base_prompt_lock:
+        if time.monotonic() - base_prompt_checked < PROMPT_RELOAD_INTERVAL:
+            return
+        base_prompt_checked = time.monotonic()
+        try:
+            blob = bucket.get_blob('base_prompt.txt')
+            if blob is None or blob.generation == base_prompt_generation:
+                return
+            text, base_prompt_generation = load_base_prompt()
+        except Exception as e:
+            print(f"Error reloading base prompt: {e}")
+            return
+        prompt_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        if prompt_hash != BASE_PROMPT_HASH:
+            print(f"Base prompt changed ({BASE_PROMPT_HASH} -> {prompt_hash})")
+            BASE_PROMPT, BASE_PROMPT_HASH = text, prompt_hash
+            reply_cache.clear()
+            prompt_slices.clear()
+            local_classifier = LocalClassifier(text)
+            count('base_prompt_reloads')
 
 def add_response(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "response", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'response')
 
 def add_response_special(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "special", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'special')
 
 def add_response_oscar(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "oscar", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'oscar')
 
 def add_response_goodbye(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "goodbye", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'goodbye')
 
 def add_response_load(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "load", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'load')
 
 def add_response_default(text, delay=0):
-    if isinstance(delay, str):
-        delay = int(delay)
-    time.sleep(0.05)
-    session['response_log'].append({"text": text, "delay": delay, "id": "default", "timestamp": datetime.now().isoformat()})
-    session.modified = True
+    add_response_to_log(delay, text, 'default')
 
 def errorlog():
     global errorcount
@@ -291,35 +1099,357 @@ def erroraverage():
     except Exception as e:
         add_response(f'An error occurred: {e}')
 
-def append_new_row(s1, s2, s3, save_state):
-    existing_data = []
+# Each save is its own object, saves/<hash prefix>/<word1>-<word2>-<word3>, holding the same
+# fields gamesaves.txt has after the phrase. Creating one uploads with if_generation_match=0,
+# so a phrase that's already taken fails instead of overwriting it and another is tried, and
+# loading is a single read however many games have been saved. The two character hash prefix
+# spreads the names across the bucket's key range.
+# Until migrate_saves() has copied gamesaves.txt across and written SAVES_MIGRATED, a phrase
+# that isn't in the store is also looked up in gamesaves.txt (read once per process), and new
+# saves never take a phrase from it.
+SAVES_PREFIX = 'saves/'
+SAVES_MIGRATED = f'{SAVES_PREFIX}migrated'
+LEGACY_SAVES = 'gamesaves.txt'
+SAVE_PHRASE_ATTEMPTS = 20
+legacy_saves_cache = {}
+legacy_saves_lock = threading.Lock()
+
+def phrase_key(trio):
+    return tuple(word.strip().lower() for word in trio)
+
+# Phrase key -> saved fields for the rows of gamesaves.txt, or empty once migration is done
+def legacy_saves():
+    with legacy_saves_lock:
+        if 'saves' not in legacy_saves_cache:
+            try:
+                if bucket.blob(SAVES_MIGRATED).exists():
+                    saves = {}
+                else:
+                    rows = [line.split(',', 3) for line in read_from_gcs(LEGACY_SAVES).splitlines() if line.strip()]
+                    saves = {phrase_key(row[:3]): next(csv.reader([row[3]])) for row in rows if len(row) == 4}
+            except NotFound:
+                saves = {}
+            except Exception as e:
+                print(f"Error reading legacy saves: {e}")
+                return {}
+            legacy_saves_cache['saves'] = saves
+        return legacy_saves_cache['saves']
+
+def save_path(trio):
+    phrase = '-'.join(word.strip().lower() for word in trio)
+    return f"{SAVES_PREFIX}{hashlib.sha1(phrase.encode('utf-8')).hexdigest()[:2]}/{phrase}"
+
+# True if the save was stored, False if the phrase is already taken
+def create_save(trio, save_state):
+    try:
+        bucket.blob(save_path(trio)).upload_from_string(save_state, content_type='text/plain', if_generation_match=0)
+    except PreconditionFailed:
+        return False
+    return True
+
+# The saved fields for a phrase, or None when nothing was saved under it
+def load_save(trio):
+    try:
+        content = bucket.blob(save_path(trio)).download_as_text()
+    except NotFound:
+        saved = legacy_saves().get(phrase_key(trio))
+        if saved is not None:
+            count('legacy_save_loads')
+        return saved
+    return next(csv.reader([content]))
+
+# Speech recognition often gets the rarer words in a load phrase slightly wrong ("variability"
+# heard as "variable ity" is beyond help, but "intelligably" isn't). Each word list gets a
+# PhraseMatcher that snaps a heard word to the nearest word in the list: an exact match wins,
+# otherwise the candidates are the list words with the same Soundex code plus those within one
+# edit by the SymSpell trick (every word is indexed under itself and each single-letter
+# deletion of it, so looking up the heard word and its own deletions finds every word one
+# insertion, deletion or substitution away, and some two away). Candidates are ranked by edit
+# distance, with a half point off for sounding the same, and everything tied for best is
+# returned. Lookups cost a few dictionary probes and a handful of short edit distances.
+SOUNDEX_CODES = {letter: digit for letters, digit in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6'))
+                 for letter in letters}
+
+def soundex(word):
+    word = re.sub('[^a-z]', '', word.lower())
+    if not word:
+        return ''
+    code = word[0]
+    last = SOUNDEX_CODES.get(word[0])
+    for letter in word[1:]:
+        digit = SOUNDEX_CODES.get(letter)
+        if digit and digit != last:
+            code += digit
+        if letter not in 'hw':
+            last = digit
+    return (code + '000')[:4]
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, letter_a in enumerate(a, 1):
+        current = [i]
+        for j, letter_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (letter_a != letter_b)))
+        previous = current
+    return previous[-1]
+
+def single_deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+class PhraseMatcher:
+    def __init__(self, words):
+        self.index = {}
+        self.sounds = {}
+        self.deletions = {}
+        for position, word in enumerate(words):
+            word = word.lower()
+            self.index.setdefault(word, position)
+            self.sounds.setdefault(soundex(word), set()).add(word)
+            for variant in single_deletions(word) | {word}:
+                self.deletions.setdefault(variant, set()).add(word)
+
+    # The list words closest to `word`, best first and all equally close; empty if none is close
+    def match(self, word):
+        word = re.sub("[^a-z']", '', word.lower())
+        if word in self.index:
+            return [word]
+        sound = soundex(word)
+        candidates = set(self.sounds.get(sound, ()))
+        for variant in single_deletions(word) | {word}:
+            candidates |= self.deletions.get(variant, set())
+        limit = max(2, len(word) // 3)
+        scored = []
+        for candidate in candidates:
+            distance = edit_distance(word, candidate)
+            if distance <= limit:
+                scored.append((distance - 0.5 * (soundex(candidate) == sound), candidate))
+        if not scored:
+            return []
+        best = min(scored)[0]
+        return sorted(candidate for score, candidate in scored if score == best)
+
+# Hands out free save phrases. The word lists are read from GCS once per process, and each
+# candidate is a random (s1, s2, s3) index triple packed into one int. Triples this worker has
+# handed out or found taken are remembered in `used`, so they're never tried twice; with
+# 500-odd words per list there are well over 100 million phrases, so a random pick is almost
+# always free and a save costs one conditional write. The write itself is what reserves the
+# phrase across workers and instances: if another one got there first it fails and the next
+# candidate is tried.
+class PhraseAllocator:
+    def __init__(self, paths=('s1.txt', 's2.txt', 's3.txt'), attempts=SAVE_PHRASE_ATTEMPTS):
+        self.paths = paths
+        self.attempts = attempts
+        self.words = None
+        self.phrase_matchers = None
+        self.code_matchers = None
+        self.used = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.words is None:
+                self.words = tuple([word.strip() for word in read_from_gcs(path).splitlines() if word.strip()] for path in self.paths)
+            return self.words
+
+    # PhraseMatchers for the whole of each list, and for the first 512 words that save codes use
+    def matchers(self, code=False):
+        words = self.load()
+        with self.lock:
+            if self.phrase_matchers is None:
+                self.phrase_matchers = tuple(PhraseMatcher(wordlist) for wordlist in words)
+                self.code_matchers = tuple(PhraseMatcher(wordlist[:512]) for wordlist in words)
+            return self.code_matchers if code else self.phrase_matchers
+
+    def trio(self, index):
+        s1, s2, s3 = self.words
+        i, rest = divmod(index, len(s2) * len(s3))
+        j, k = divmod(rest, len(s3))
+        return (s1[i], s2[j], s3[k])
+
+    # Stores save_state under a free phrase and returns the phrase's three words
+    def allocate(self, save_state):
+        s1, s2, s3 = self.load()
+        total = len(s1) * len(s2) * len(s3)
+        for _ in range(self.attempts):
+            index = random.randrange(total)
+            with self.lock:
+                if index in self.used:
+                    continue
+                self.used.add(index)
+            trio = self.trio(index)
+            if phrase_key(trio) not in legacy_saves() and create_save(trio, save_state):
+                return trio
+            count('save_phrase_collisions')
+        raise RuntimeError(f'no free save phrase after {self.attempts} attempts')
+
+phrase_allocator = PhraseAllocator()
+
+# Builds the word lists' PhraseMatchers ahead of the first load
+def warm_phrase_matchers():
     try:
-        existing_data = read_from_gcs('gamesaves.txt').splitlines()
+        phrase_allocator.matchers()
     except Exception as e:
-        print(f"Error reading gamesaves.txt from GCS: {e}")
-        pass
+        print(f"Error loading save phrase words: {e}")
 
-    save_state_list = save_state.split(',')
+threading.Thread(target=warm_phrase_matchers, daemon=True).start()
 
-    def check_duplicates(trio, existing_data):
-        for line in existing_data:
-            existing_trio = line.split(',')[:3]
-            if existing_trio == trio:
-                return True
-        return False
+# Candidate readings of a heard load phrase, most likely first. The phrase as heard always
+# comes first, since older saves can hold words that are no longer in the lists. Then each
+# word is snapped to its list with PhraseMatcher (a word that matches nothing is kept as it
+# is), and where several words are equally close every combination is tried, up to
+# SNAP_MAX_PHRASES in all; the save lookup picks the right one (for save codes, see only_match).
+SNAP_MAX_PHRASES = 8
 
-    while True:
-        trio = (random.choice(s1), random.choice(s2), random.choice(s3))
-        if not check_duplicates(trio, existing_data):
-            word1, word2, word3 = trio
-            new_entry = ','.join(list(trio) + save_state_list) + '\n'
-            existing_data.append(new_entry)
-            write_to_gcs('gamesaves.txt', '\n'.join(existing_data))
-            add_response(f'Game saved.\n\nWhen you want to recover it, use the LOAD command, after which you\'ll be asked to say this three word phrase:\n\n{word1.upper()}   {word2.upper()}   {word3.upper()}\n')
-            break
+def snap_phrase(heard_words):
+    code = len(heard_words) == SAVE_CODE_WORDS
+    matchers = phrase_allocator.matchers(code)
+    choices = []
+    for position, word in enumerate(heard_words):
+        matches = matchers[position % 3].match(word)
+        if not matches:
+            count('load_words_unmatched')
+            print(f"Load phrase word {word!r} matches nothing")
+            matches = [word]
+        elif matches != [word]:
+            count('load_words_snapped')
+            if len(matches) > 1:
+                count('load_words_ambiguous')
+            print(f"Load phrase word {word!r} snapped to {' / '.join(matches)}")
+        choices.append(matches)
+    heard = tuple(heard_words)
+    return [heard] + [phrase for phrase in islice(product(*choices), SNAP_MAX_PHRASES) if phrase != heard][:SNAP_MAX_PHRASES - 1]
+
+# The first candidate phrase that `lookup` finds a game for, and that game
+def first_match(phrases, lookup):
+    for phrase in phrases:
+        found = lookup(phrase)
+        if found is not None:
+            return phrase, found
+    return None, None
+
+# For save codes, where the only check on a snapped reading is an 11 bit checksum: the code as
+# heard if it decodes, otherwise a snapped reading only if it's the one reading that decodes.
+# Trying several readings against the checksum would otherwise load the wrong game for about
+# one misheard code in 300.
+def only_match(phrases, lookup):
+    heard, snapped = phrases[0], phrases[1:]
+    found = lookup(heard)
+    if found is not None:
+        return heard, found
+    matches = [(phrase, found) for phrase, found in ((phrase, lookup(phrase)) for phrase in snapped) if found is not None]
+    if len(matches) > 1:
+        count('save_codes_ambiguous')
+        print(f"Save code {' '.join(heard)!r} has {len(matches)} readings that decode")
+    return matches[0] if len(matches) == 1 else (None, None)
+
+# With SAVE_CODES on, a save is a seven word code that holds the game state itself, so saving
+# and loading need no storage at all (beyond the word lists, read once). The state is packed
+# into 63 bits, most significant first:
+#
+#   19 bits  SAVE_CODE_FLAGS
+#    8 bits  location, booklocation, davelocation, oscarlocation (2 bits each)
+#    7 bits  index of the inventory, in order, in INVENTORY_ORDERS
+#    9 bits  actioncount
+#    9 bits  errorcount
+#   11 bits  CRC-32 of the above, so a misheard code is almost always rejected
+#
+# and written as seven 9 bit words taken in turn from the first 512 words of s1, s2 and s3.
+# Changing the start of those lists invalidates existing codes. Games the code can't hold
+# (more than 511 actions, or an unknown item) are saved under a three word phrase as usual.
+# Codes are accepted by restore_game whatever SAVE_CODES is set to.
+SAVE_CODES = os.environ.get('SAVE_CODES', '0') == '1'
+SAVE_CODE_WORDS = 7
+SAVE_CODE_FLAGS = ('hasbook', 'hasdave', 'seenerror', 'seenbridge', 'seenreadyroom', 'seenengineering', 'seenpanel',
+                   'seenfire', 'seenoscar', 'seenescapepod', 'seendave', 'beenbridge', 'beenreadyroom', 'beenengineering',
+                   'panelopen', 'hatchopen', 'klaxonopen', 'readbook', 'awareengineering')
+SAVE_CODE_LOCATIONS = ('location', 'booklocation', 'davelocation', 'oscarlocation')
+INVENTORY_ORDERS = tuple(order for size in range(len(INVENTORY_ITEMS) + 1) for order in permutations(range(len(INVENTORY_ITEMS)), size))
+INVENTORY_ORDER_INDEX = {order: index for index, order in enumerate(INVENTORY_ORDERS)}
+SAVE_CODE_COUNT_MAX = 511
+
+def save_code_checksum(payload):
+    return zlib.crc32(payload.to_bytes(7, 'big')) & 0x7ff
+
+# The save code for the current session, or None if the game doesn't fit in one
+def encode_save_code():
+    if session['actioncount'] > SAVE_CODE_COUNT_MAX or session['errorcount'] > SAVE_CODE_COUNT_MAX:
+        return None
+    if any(item not in INVENTORY_ITEMS for item in session['inventory']):
+        return None
+    order = INVENTORY_ORDER_INDEX.get(tuple(INVENTORY_ITEMS.index(item) for item in session['inventory']))
+    if order is None:
+        return None
+
+    payload = 0
+    for name in SAVE_CODE_FLAGS:
+        payload = payload << 1 | bool(session[name])
+    for name in SAVE_CODE_LOCATIONS:
+        payload = payload << 2 | Location[session[name]]
+    payload = payload << 7 | order
+    payload = payload << 9 | session['actioncount']
+    payload = payload << 9 | session['errorcount']
+    value = payload << 11 | save_code_checksum(payload)
+
+    words = phrase_allocator.load()
+    return [words[position % 3][value >> 9 * (SAVE_CODE_WORDS - 1 - position) & 0x1ff] for position in range(SAVE_CODE_WORDS)]
+
+# The session fields stored in a save code, or None if the words aren't a valid code
+def decode_save_code(code_words):
+    if len(code_words) != SAVE_CODE_WORDS:
+        return None
+    matchers = phrase_allocator.matchers(code=True)
+    value = 0
+    for position, word in enumerate(code_words):
+        index = matchers[position % 3].index.get(word.lower())
+        if index is None:
+            return None
+        value = value << 9 | index
+
+    payload = value >> 11
+    if save_code_checksum(payload) != value & 0x7ff:
+        return None
+    errorcount = payload & 0x1ff
+    actioncount = payload >> 9 & 0x1ff
+    order = payload >> 18 & 0x7f
+    if order >= len(INVENTORY_ORDERS) or errorcount > actioncount:
+        return None
+
+    saved = {'actioncount': actioncount, 'errorcount': errorcount,
+             'inventory': [INVENTORY_ITEMS[item] for item in INVENTORY_ORDERS[order]]}
+    payload >>= 25
+    for name in reversed(SAVE_CODE_LOCATIONS):
+        saved[name] = LOCATION_NAMES[payload & 3]
+        payload >>= 2
+    for name in reversed(SAVE_CODE_FLAGS):
+        saved[name] = bool(payload & 1)
+        payload >>= 1
+    return saved
+
+def append_new_row(save_state):
+    code_words = encode_save_code() if SAVE_CODES else None
+    if code_words is not None:
+        count('save_codes')
+    else:
+        code_words = phrase_allocator.allocate(save_state)
+    length = 'three' if len(code_words) == 3 else 'seven'
+    add_response(f'Game saved.\n\nWhen you want to recover it, use the LOAD command, after which you\'ll be asked to say this {length} word phrase:\n\n{"   ".join(word.upper() for word in code_words)}\n')
+
+# A load phrase is a three word save phrase or a seven word save code
+CODE_PHRASE_LENGTHS = (3, SAVE_CODE_WORDS)
+CODE_PHRASE_LENGTH_ERROR = 'CODE PHRASE MUST CONTAIN 3 OR 7 WORDS' if SAVE_CODES else 'CODE PHRASE MUST CONTAIN EXACTLY 3 WORDS'
+
+# One-off copy of the rows in gamesaves.txt into the keyed store. Phrases that are already
+# stored are left alone, so it's safe to run again. Once every row is across it writes
+# SAVES_MIGRATED, after which workers stop reading gamesaves.txt.
+def migrate_saves(source=LEGACY_SAVES, workers=16):
+    rows = [line.split(',', 3) for line in read_from_gcs(source).splitlines() if line.strip()]
+    rows = [row for row in rows if len(row) == 4]
+    created = list(thread_pool('migrate', workers).map(lambda row: create_save(row[:3], row[3]), rows))
+    print(f"Migrated {sum(created)} saves, {len(created) - sum(created)} already present")
+    bucket.blob(SAVES_MIGRATED).upload_from_string(f'{len(rows)} rows from {source}\n', content_type='text/plain')
 
 def savegame():
-    inventory_str = f'"[{", ".join([f"\\\'{item}\\\'" for item in session['inventory']])}]"'
+    inventory_str = '"[' + ', '.join(f"\\'{item}\\'" for item in session['inventory']) + ']"'
 
     save_state = (f"{session['location']},{session['hasbook']},{session['hasdave']},{session['seenerror']},{session['seenbridge']},{session['seenreadyroom']},"
                   f"{session['seenengineering']},{session['seenpanel']},{session['seenfire']},{session['seenoscar']},{session['seenescapepod']},{session['seendave']},"
@@ -327,27 +1457,43 @@ def savegame():
                   f"{session['readbook']},{session['awareengineering']},{session['booklocation']},{session['davelocation']},{session['oscarlocation']},"
                   f"{session['actioncount']},{session['errorcount']},{inventory_str}")
 
-    def main(save_state):
-        s1 = read_from_gcs('s1.txt').splitlines()
-        s2 = read_from_gcs('s2.txt').splitlines()
-        s3 = read_from_gcs('s3.txt').splitlines()
-        append_new_row(s1, s2, s3, save_state)
-
-    main(save_state)
+    append_new_row(save_state)
 
+# Returns True once the saved game is loaded
 def restore_game(restore_string):
     restore_array = restore_string.split(' ')
 
-    if len(restore_array) != 3:
+    if len(restore_array) not in CODE_PHRASE_LENGTHS:
         add_response_default('reset', delay=0.05)
-        add_response_special(">> ERROR << CODE PHRASE MUST CONTAIN EXACTLY 3 WORDS\n")
+        add_response_special(f">> ERROR << {CODE_PHRASE_LENGTH_ERROR}\n")
         add_response_special('Use the LOAD command to try again, or just continue the rescue from here.\n')
         nextaction()
         return
 
     try:
-        file_content = read_from_gcs('gamesaves.txt')
-        lines = list(csv.reader(file_content.splitlines()))
+        phrases = snap_phrase(restore_array)
+    except Exception as e:
+        print(f"Error matching load phrase: {e}")
+        phrases = [restore_array]
+
+    if len(restore_array) == SAVE_CODE_WORDS:
+        phrase, saved = only_match(phrases, decode_save_code)
+        if saved is None:
+            add_response_default('reset', delay=0.05)
+            add_response_special(">> ERROR << NO GAME MATCHES THIS PHRASE\n")
+            add_response_special('Use the LOAD command to try again, or just continue the rescue from here.\n')
+            nextaction()
+            return
+        if list(phrase) != restore_array:
+            add_response_special(f'>> CODE PHRASE MATCHED TO: "{" ".join(phrase)}"\n')
+        session.update(saved)
+        add_response_default('reset', delay=0.05)
+        add_response("Did you just feel that? I mean, like, deja vu or what?\n", delay=1)
+        nextaction()
+        return True
+
+    try:
+        phrase, load_array = first_match(phrases, load_save)
     except Exception as e:
         add_response_default('reset', delay=0.05)
         add_response_special(f">> ERROR << COULD NOT READ GAMESAVES: {e}\n")
@@ -355,18 +1501,14 @@ def restore_game(restore_string):
         nextaction()
         return
 
-    load_array = None
-    for row in lines:
-        if row[:3] == restore_array:
-            load_array = row[3:]
-            break
-
     if load_array is None:
         add_response_default('reset', delay=0.05)
         add_response_special(">> ERROR << NO GAME MATCHES THIS PHRASE\n")
         add_response_special('Use the LOAD command to try again, or just continue the rescue from here.\n')
         nextaction()
         return
+    if list(phrase) != restore_array:
+        add_response_special(f'>> CODE PHRASE MATCHED TO: "{" ".join(phrase)}"\n')
 
     str_to_bool = {'True': True, 'False': False}
     (session['location'], session['hasbook'], session['hasdave'], session['seenerror'], session['seenbridge'], session['seenreadyroom'], 
@@ -390,6 +1532,7 @@ def restore_game(restore_string):
     add_response_default('reset', delay=0.05)
     add_response("Did you just feel that? I mean, like, deja vu or what?\n", delay=1)
     nextaction()
+    return True
 
 def endgame():
     if session['launch'] == False:
@@ -442,8 +1585,360 @@ def endgame():
             add_response('The average number of actions in a succesful mission is currently ' + str(round(actionav)) + ', with an average of '+ str(round(actionav - errorav)) + ' messages understood.\n', delay=3)
             add_response_goodbye('Thanks for playing. Tell a friend.', delay=3)
 
-def transcribe_audio(audio, encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16, sample_rate=48000):
-    client = speech.SpeechClient()
+# Every voice command has TURN_DEADLINE seconds end to end. Speech to text may use up to
+# STT_BUDGET_SHARE of it and Claude gets whatever is left, so a slow upstream can't hold a job
+# worker forever. Each upstream (speech, and each Claude model) is called through an Upstream:
+#  - the call is given the time left as its own timeout, and timeouts are counted at /metrics
+#  - with HEDGE_REQUESTS=1, a call still running after the upstream's recent p95 latency is
+#    sent a second time and whichever answers first is used
+#  - after BREAKER_FAILURES failures in a row the upstream's circuit opens and calls fail fast
+#    with UpstreamUnavailable for BREAKER_RESET seconds, after which it is half open: exactly
+#    one call is let through to see if it has recovered, and the rest keep failing fast until
+#    that probe succeeds (closing the circuit) or fails (opening it again)
+# When Claude is unavailable classify_command() falls back to the local classifier with a
+# looser threshold; when that can't help either, the player is told the link is down instead
+# of having the turn counted as not understood.
+TURN_DEADLINE = float(os.environ.get('TURN_DEADLINE', 20))
+STT_BUDGET_SHARE = float(os.environ.get('STT_BUDGET_SHARE', 0.4))
+HEDGE_REQUESTS = os.environ.get('HEDGE_REQUESTS', '0') == '1'
+HEDGE_MIN_SAMPLES = 20
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 30))
+TIMEOUT_ERRORS = (anthropic.APITimeoutError, DeadlineExceeded, concurrent.futures.TimeoutError)
+
+LINK_DOWN_MESSAGE = '>> SIGNAL LOST << The link to the Cleanerbot is breaking up. Try again in a moment.\n'
+
+class UpstreamUnavailable(Exception):
+    pass
+
+class Deadline:
+    def __init__(self, seconds=TURN_DEADLINE):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+# Like JobPool's threads, thread pools don't survive a fork, so each worker process makes its own
+thread_pools = {}
+thread_pools_lock = threading.Lock()
+
+def thread_pool(name, workers):
+    with thread_pools_lock:
+        pool, pid = thread_pools.get(name, (None, None))
+        if pool is None or pid != os.getpid():
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+            thread_pools[name] = (pool, os.getpid())
+        return pool
+
+class Upstream:
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.name = name
+        self.max_failures = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+        self.latencies = deque(maxlen=200)
+        self.lock = threading.Lock()
+
+    # func is called with the number of seconds it may take. Calls that can't be repeated
+    # (like a speech stream being fed as it arrives) pass hedge=False.
+    def call(self, func, timeout, hedge=True):
+        if timeout <= 0:
+            count(f'{self.name}_timeouts')
+            raise UpstreamUnavailable(f'{self.name} is out of time')
+        with self.lock:
+            if self.opened is not None:
+                if self.probing or time.monotonic() - self.opened < self.reset:
+                    count(f'{self.name}_breaker_rejections')
+                    raise UpstreamUnavailable(f'{self.name} is unavailable')
+                self.probing = True
+                count(f'{self.name}_breaker_probes')
+
+        started = time.monotonic()
+        try:
+            result = self._run(func, timeout, hedge)
+        except Exception as e:
+            count(f'{self.name}_timeouts' if isinstance(e, TIMEOUT_ERRORS) else f'{self.name}_failures')
+            self._failed()
+            raise UpstreamUnavailable(f'{self.name} failed: {e}') from e
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.probing = False
+            self.latencies.append(time.monotonic() - started)
+        return result
+
+    def _failed(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.max_failures:
+                if self.opened is None:
+                    print(f"{self.name} circuit opened after {self.failures} failures")
+                    count(f'{self.name}_breaker_opened')
+                self.opened = time.monotonic()
+
+    def hedge_after(self):
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95)]
+
+    def _run(self, func, timeout, hedge):
+        hedge_after = self.hedge_after() if HEDGE_REQUESTS and hedge else None
+        if hedge_after is None or hedge_after >= timeout:
+            return func(timeout)
+
+        pool = thread_pool('hedge', 8)
+        first = pool.submit(func, timeout)
+        try:
+            return first.result(hedge_after)
+        except concurrent.futures.TimeoutError:
+            pass
+        count(f'{self.name}_hedges')
+        second = pool.submit(func, timeout - hedge_after)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=timeout - hedge_after, return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                raise concurrent.futures.TimeoutError()
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        count(f'{self.name}_hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+speech_upstream = Upstream('stt')
+claude_upstreams = {}
+
+def claude_upstream(model):
+    upstream = claude_upstreams.get(model)
+    if upstream is None:
+        upstream = claude_upstreams.setdefault(model, Upstream(f'claude_{model}'))
+    return upstream
+
+# Uploaded audio is identified by its header rather than its MIME type. WAV is decoded with the
+# standard library, and Opus/WebM, Ogg and AAC/MP4 (what MediaRecorder produces) with PyAV when
+# it's installed. Decoded audio is downmixed to mono, resampled to 16kHz and trimmed of leading
+# and trailing silence before it goes to Google, which bills by duration. Without PyAV, WebM and
+# Ogg Opus are sent to Google undecoded and MP4 is refused, so the page falls back to WAV.
+STT_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+VAD_PADDING_MS = 200
+VAD_MIN_RMS = 300
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# Uploads are capped at MAX_AUDIO_UPLOAD_BYTES (Flask answers anything bigger with a 413 before
+# the body is read) and at MAX_AUDIO_SECONDS of audio. Werkzeug spools multipart files past
+# 500KB to a temporary file, so a recording is only held in memory once it has passed the
+# header checks, and at most JOB_QUEUE_DEPTH + JOB_WORKERS of them are held at a time.
+MAX_AUDIO_UPLOAD_BYTES = int(os.environ.get('MAX_AUDIO_UPLOAD_BYTES', 2 * 1024 * 1024))
+MAX_AUDIO_SECONDS = float(os.environ.get('MAX_AUDIO_SECONDS', 10))
+AUDIO_HEADER_BYTES = 512
+app.config['MAX_CONTENT_LENGTH'] = MAX_AUDIO_UPLOAD_BYTES
+
+class AudioRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# Returns the uploaded recording and its format, or raises AudioRejected. The format and, for
+# WAV, the header are checked from the first few bytes before the rest is read.
+def read_audio_upload(audio_file):
+    stream = audio_file.stream
+    header = stream.read(AUDIO_HEADER_BYTES)
+    audio_format = sniff_audio(header)
+    if not supported_audio(audio_format):
+        raise AudioRejected('Unsupported audio format', 415)
+    if audio_format == 'wav':
+        check_wav_header(header)
+    stream.seek(0)
+    audio_content = stream.read(MAX_AUDIO_UPLOAD_BYTES + 1)
+    if len(audio_content) > MAX_AUDIO_UPLOAD_BYTES:
+        raise AudioRejected('Recording too large', 413)
+    return audio_content, audio_format
+
+def check_wav_header(header):
+    position = 12
+    fmt = None
+    while position + 8 <= len(header):
+        chunk_id, size = struct.unpack_from('<4sI', header, position)
+        if chunk_id == b'fmt ':
+            if size < 16 or position + 24 > len(header):
+                break
+            fmt = struct.unpack_from('<HHIIHH', header, position + 8)
+        elif chunk_id == b'data':
+            break
+        position += 8 + size + (size & 1)
+    if fmt is None:
+        raise AudioRejected('Corrupt WAV header')
+    format_tag, channels, sample_rate, _, _, bits = fmt
+    # 1 is plain PCM and 0xFFFE the extensible header some recorders write for it
+    if format_tag not in (1, 0xFFFE) or channels not in (1, 2) or bits not in (8, 16, 24, 32) or not 8000 <= sample_rate <= 48000:
+        raise AudioRejected('Unsupported audio format', 415)
+    # Writers that don't know the length up front leave it as 0 or 0xFFFFFFFF
+    if position + 8 <= len(header) and chunk_id == b'data' and size not in (0, 0xFFFFFFFF):
+        if size / (sample_rate * channels * bits // 8) > MAX_AUDIO_SECONDS:
+            raise AudioRejected('Recording too long', 413)
+
+def sniff_audio(audio_content):
+    if audio_content[:4] == b'RIFF' and audio_content[8:12] == b'WAVE':
+        return 'wav'
+    if audio_content[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if audio_content[:4] == b'OggS':
+        return 'ogg'
+    if audio_content[4:8] == b'ftyp':
+        return 'mp4'
+    return None
+
+def supported_audio(audio_format):
+    return audio_format in ('wav', 'webm', 'ogg') or (audio_format == 'mp4' and av is not None)
+
+# Returns the audio to send for recognition, with its encoding and sample rate
+def prepare_audio(audio_content, audio_format):
+    count('audio_upload_bytes', len(audio_content))
+    pcm = None
+    if audio_format == 'wav' and audioop is not None:
+        pcm, sample_rate = wav_to_pcm(audio_content)
+    elif audio_format != 'wav' and av is not None:
+        pcm, sample_rate = decode_audio(audio_content), STT_SAMPLE_RATE
+
+    if pcm is None:
+        if audio_format == 'wav':
+            return audio_content, speech.RecognitionConfig.AudioEncoding.LINEAR16, wav_sample_rate(audio_content)
+        encoding = speech.RecognitionConfig.AudioEncoding.WEBM_OPUS if audio_format == 'webm' else speech.RecognitionConfig.AudioEncoding.OGG_OPUS
+        return audio_content, encoding, opus_sample_rate(audio_content)
+
+    if sample_rate != STT_SAMPLE_RATE and audioop is not None:
+        pcm, _ = audioop.ratecv(pcm, 2, 1, sample_rate, STT_SAMPLE_RATE, None)
+        sample_rate = STT_SAMPLE_RATE
+    trimmed = trim_silence(pcm, sample_rate)
+    count('audio_trimmed_seconds', (len(pcm) - len(trimmed)) / (2 * sample_rate))
+    count('stt_audio_seconds', len(trimmed) / (2 * sample_rate))
+    return trimmed, speech.RecognitionConfig.AudioEncoding.LINEAR16, sample_rate
+
+# 16 bit mono PCM and its sample rate, from a WAV file of any sample width and channel count
+def wav_to_pcm(audio_content):
+    with wave.open(io.BytesIO(audio_content)) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        sample_rate = wav.getframerate()
+        frames = wav.readframes(min(wav.getnframes(), int(MAX_AUDIO_SECONDS * sample_rate)))
+    if width == 1:
+        # 8 bit WAV samples are unsigned
+        frames = audioop.bias(frames, 1, -128)
+    if width != 2:
+        frames = audioop.lin2lin(frames, width, 2)
+    if channels == 2:
+        frames = audioop.tomono(frames, 2, 0.5, 0.5)
+    elif channels > 2:
+        raise ValueError(f'Unsupported number of audio channels: {channels}')
+    return frames, sample_rate
+
+# 16 bit mono PCM at STT_SAMPLE_RATE, from anything PyAV can read. Anything past
+# MAX_AUDIO_SECONDS is dropped.
+def decode_audio(audio_content):
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=STT_SAMPLE_RATE)
+    max_bytes = int(MAX_AUDIO_SECONDS * STT_SAMPLE_RATE) * 2
+    pcm = bytearray()
+    with av.open(io.BytesIO(audio_content)) as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                pcm += memoryview(resampled.planes[0])[:resampled.samples * 2]
+            if len(pcm) >= max_bytes:
+                break
+    if len(pcm) < max_bytes:
+        for resampled in resampler.resample(None):
+            pcm += memoryview(resampled.planes[0])[:resampled.samples * 2]
+    return bytes(pcm[:max_bytes])
+
+# WebM stores its sampling frequency as an 8 byte float (element 0xB5); Opus otherwise runs at 48kHz
+def opus_sample_rate(audio_content):
+    position = audio_content.find(b'\xb5\x88')
+    if position != -1 and len(audio_content) >= position + 10:
+        sample_rate = int(struct.unpack_from('>d', audio_content, position + 2)[0])
+        if sample_rate in OPUS_SAMPLE_RATES:
+            return sample_rate
+    return 48000
+
+# Cuts leading and trailing silence, keeping VAD_PADDING_MS either side of the first and last
+# frames loud enough to be speech. Audio with no such frame is left alone.
+def trim_silence(pcm, sample_rate):
+    if audioop is None:
+        return pcm
+    frame = int(sample_rate * VAD_FRAME_MS / 1000) * 2
+    levels = [audioop.rms(pcm[i:i + frame], 2) for i in range(0, len(pcm), frame)]
+    if not levels:
+        return pcm
+    threshold = max(VAD_MIN_RMS, max(levels) // 10)
+    voiced = [i for i, level in enumerate(levels) if level >= threshold]
+    if not voiced:
+        return pcm
+    padding = VAD_PADDING_MS // VAD_FRAME_MS
+    start = max(0, voiced[0] - padding) * frame
+    end = min(len(levels), voiced[-1] + 1 + padding) * frame
+    if start == 0 and end >= len(pcm):
+        return pcm
+    return pcm[start:end]
+
+# Recognition requests carry phrase hints so Google favours the game's own vocabulary:
+# commands get the names and command phrases from base_prompt.txt (as the LocalClassifier
+# reads them), loads get the save phrase word lists. The hints are built once per mode and
+# rebuilt when the base prompt changes. To measure what they're worth, STT_HINT_SHARE of
+# sessions (picked by session id) get them and the rest are a control group; turns, turns
+# that weren't understood and turns repeating the previous transcript are counted for each
+# group as stt_hinted_* and stt_unhinted_* in /metrics.
+STT_HINTS = os.environ.get('STT_HINTS', '1') == '1'
+STT_HINT_SHARE = float(os.environ.get('STT_HINT_SHARE', 1))
+STT_HINT_BOOST = float(os.environ.get('STT_HINT_BOOST', 10))
+# Google's limits on one request's phrase hints
+STT_HINT_MAX_PHRASES = 5000
+STT_HINT_MAX_LENGTH = 100
+
+speech_context_cache = {}
+
+def stt_hint_group():
+    if not STT_HINTS:
+        return 'unhinted'
+    share = int(hashlib.sha1(session.sid.encode('utf-8')).hexdigest()[:8], 16) / 0x100000000
+    return 'hinted' if share < STT_HINT_SHARE else 'unhinted'
+
+def command_hints(classifier):
+    hints = {' '.join(name) for name in classifier.synonyms}
+    for phrases in classifier.phrase_lists.values():
+        hints.update(phrases)
+    return sorted(hints)
+
+def load_hints():
+    return sorted({word.lower() for words in phrase_allocator.load() for word in words})
+
+# The SpeechContexts for a recognition request in `mode` ('command' or 'load')
+def speech_contexts(mode):
+    if stt_hint_group() != 'hinted':
+        return []
+    key = BASE_PROMPT_HASH if mode == 'command' else None
+    cached = speech_context_cache.get(mode)
+    if cached is None or cached[0] != key:
+        try:
+            hints = command_hints(local_classifier) if mode == 'command' else load_hints()
+        except Exception as e:
+            print(f"Error building {mode} speech hints: {e}")
+            return []
+        hints = [hint for hint in hints if len(hint) <= STT_HINT_MAX_LENGTH][:STT_HINT_MAX_PHRASES]
+        cached = (key, [speech.SpeechContext(phrases=hints, boost=STT_HINT_BOOST)])
+        speech_context_cache[mode] = cached
+        count(f'stt_{mode}_hints', len(hints))
+    return cached[1]
+
+def transcribe_audio(audio, encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16, sample_rate=48000, deadline=None, mode='command'):
+    deadline = deadline or Deadline()
+    client = speech_clients.get()
     audio = speech.RecognitionAudio(content=audio)
     config = speech.RecognitionConfig(
         encoding=encoding,
@@ -451,24 +1946,201 @@ def transcribe_audio(audio, encoding=speech.RecognitionConfig.AudioEncoding.LINE
         language_code='en-US',
         use_enhanced=True,
         profanity_filter=False,
-        model='latest_short'
+        model='latest_short',
+        speech_contexts=speech_contexts(mode)
     )
 
-    response = client.recognize(config=config, audio=audio)
-    if not response.results:
+    timeout = min(deadline.remaining(), TURN_DEADLINE * STT_BUDGET_SHARE)
+    try:
+        response = speech_upstream.call(lambda timeout: client.recognize(config=config, audio=audio, timeout=timeout), timeout)
+    except UpstreamUnavailable as e:
+        if isinstance(e.__cause__, ServiceUnavailable):
+            speech_clients.recycle(client)
+        raise
+    return transcript_text(response.results)
+
+def transcript_text(results):
+    if not results:
         audioerrorlist = ["pfffft WEEE WAH WEE WAH", "zzzzzzzzz", "hisssssss"]
         user_text = random.choice(audioerrorlist)
     else:
-        user_text = response.results[0].alternatives[0].transcript if response.results[0].alternatives[0].transcript else "<< Inaudible rabbit noises >>"
-        user_text = user_text.lower()
+        user_text = ' '.join(result.alternatives[0].transcript for result in results
+                             if result.alternatives and result.alternatives[0].transcript)
+        user_text = user_text.lower() if user_text else "<< Inaudible rabbit noises >>"
     return user_text
 
-def send_to_claude(user_text):
-    message = client.messages.create(
-        model="claude-3-sonnet-20240229",
+# /record_stream receives raw 16 bit mono PCM as one chunked upload while the player is still
+# talking, and each chunk is passed straight on to Google's streaming recognizer. The browser
+# ends the upload when the player stops speaking, so the final transcript is ready a moment
+# later instead of after a whole recording is uploaded and then recognized. The upload is a
+# single request, so with several gunicorn workers every chunk still reaches the same one.
+# Recognition may run STREAM_MAX_SECONDS longer than the usual speech budget, since it starts
+# while the player is talking, and anything past STREAM_MAX_SECONDS of audio is ignored.
+# App Engine standard's front end buffers the whole request body before the app sees any of
+# it, so there a streamed upload is no faster than /record; STREAM_UPLOADS is off by default
+# on App Engine standard (GAE_ENV=standard), which leaves /record as the only path, and on
+# elsewhere.
+STREAM_UPLOADS = os.environ.get('STREAM_UPLOADS', '0' if os.environ.get('GAE_ENV') == 'standard' else '1') == '1'
+STREAM_MAX_SECONDS = float(os.environ.get('STREAM_MAX_SECONDS', 10))
+STREAM_CHUNK_SIZE = 8192
+
+# on_interim, if given, is called with the transcript so far each time the recognizer revises it
+def transcribe_stream(body, sample_rate, deadline=None, on_interim=None):
+    deadline = deadline or Deadline()
+    client = speech_clients.get()
+    config = speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=sample_rate,
+            language_code='en-US',
+            use_enhanced=True,
+            profanity_filter=False,
+            model='latest_short',
+            speech_contexts=speech_contexts('command')
+        ),
+        single_utterance=True,
+        interim_results=on_interim is not None
+    )
+    chunks = queue.Queue()
+
+    def audio_requests():
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    def recognize(timeout):
+        final = []
+        for response in client.streaming_recognize(config, audio_requests(), timeout=timeout):
+            interim = []
+            for result in response.results:
+                (final if result.is_final else interim).append(result)
+            if on_interim is not None and interim:
+                on_interim(' '.join(result.alternatives[0].transcript for result in final + interim if result.alternatives))
+        return final
+
+    timeout = min(deadline.remaining(), STREAM_MAX_SECONDS + TURN_DEADLINE * STT_BUDGET_SHARE)
+    recognition = thread_pool('stream', 32).submit(speech_upstream.call, recognize, timeout, hedge=False)
+    try:
+        max_bytes = int(STREAM_MAX_SECONDS * sample_rate * 2)
+        received = 0
+        while received < max_bytes:
+            chunk = body.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            received += len(chunk)
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+    try:
+        results = recognition.result(deadline.remaining())
+    except concurrent.futures.TimeoutError:
+        count('stt_timeouts')
+        raise UpstreamUnavailable('stt is out of time')
+    except UpstreamUnavailable as e:
+        if isinstance(e.__cause__, ServiceUnavailable):
+            speech_clients.recycle(client)
+        raise
+    count('stt_streams')
+    return transcript_text(results)
+
+# With CLAUDE_STREAMING on (and STRUCTURED_OUTPUT), Claude's report_command call is read as it's
+# generated and the stream is closed as soon as the tool's input is complete, without waiting for
+# the rest of the message. The forced call is the whole answer, so every code in it is seen and a
+# multi-code reply still escalates. Text replies are never cut short: nothing in their format says
+# the first code is the last, so they're always read to the end.
+CLAUDE_STREAMING = os.environ.get('CLAUDE_STREAMING', '1') == '1'
+
+def stream_from_claude(api, params):
+    with api.messages.stream(**params) as stream:
+        for event in stream:
+            if event.type == 'content_block_stop' and event.content_block.type == 'tool_use':
+                break
+        # message_start carries the input usage, so it's known even if we stop early
+        message = stream.current_message_snapshot
+    return message.content, message.usage
+
+# The base prompt is the same on every turn, so with PROMPT_CACHING on it's sent as a cacheable
+# system block: after the first call each worker's turns read it from Anthropic's prompt cache
+# instead of paying for it again. The cache is keyed on the prompt text, so a reloaded
+# base_prompt.txt simply gets written to the cache on its next use. Cache reads and writes are
+# counted at /metrics and logged per call. Claude 3 Sonnet has no prompt caching, so the default
+# is Claude 3.5 Sonnet, which does; a CLAUDE_MODEL without caching just ignores cache_control.
+CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-3-5-sonnet-20240620')
+PROMPT_CACHING = os.environ.get('PROMPT_CACHING', '1') == '1'
+PROMPT_CACHING_BETA = 'prompt-caching-2024-07-31'
+
+def record_usage(usage):
+    input_tokens = getattr(usage, 'input_tokens', 0) or 0
+    output_tokens = getattr(usage, 'output_tokens', 0) or 0
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    count('claude_input_tokens', input_tokens)
+    count('claude_output_tokens', output_tokens)
+    count('claude_cache_read_tokens', cache_read)
+    count('claude_cache_write_tokens', cache_write)
+    print(f"Claude usage: {input_tokens} input, {cache_read} cache read, {cache_write} cache write, {output_tokens} output")
+
+# With STRUCTURED_OUTPUT on, Claude answers by calling a report_command tool whose codes are
+# limited to the rows of the prompt it was given, instead of writing up to 1200 tokens of text.
+# The call is forced and tiny, and is streamed only to close it early (see CLAUDE_STREAMING); the
+# tool's input is turned back into the usual "Command understood: 0012" reply for the cache and
+# dispatcher.
+STRUCTURED_OUTPUT = os.environ.get('STRUCTURED_OUTPUT', '1') == '1'
+STRUCTURED_MAX_TOKENS = 64
+REPLY_TOOL_NAME = 'report_command'
+REPLY_TOOL_INSTRUCTIONS = (
+    f"Give your answer by calling the {REPLY_TOOL_NAME} tool rather than writing it out. "
+    "For \"Command understood: [CommandCode]\" set oscar to false and codes to the CommandCode. "
+    "For \"Oscar message: [OscarCode]\" set oscar to true and codes to the OscarCode. "
+    "For \"Huh?\" set oscar to false and leave codes empty, and for \"Oscar message: ERROR\" "
+    "set oscar to true and leave codes empty."
+)
+
+def reply_tool(prompt):
+    return {
+        "name": REPLY_TOOL_NAME,
+        "description": "Report the CommandCode or OscarCode that the user's input maps to.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "oscar": {"type": "boolean", "description": "Whether the input began with the word 'Oscar'."},
+                "codes": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": sorted({code for code, description in TABLE_ROW_PATTERN.findall(prompt)})},
+                    "description": "The matching code, or nothing if you are not confident.",
+                },
+                "confidence": {"type": "number", "minimum": 0, "maximum": 1,
+                               "description": "How sure you are of the answer, from 0 to 1."},
+            },
+            "required": ["oscar", "codes", "confidence"],
+        },
+    }
+
+def tool_reply(content):
+    for block in content:
+        if block.type == 'tool_use' and block.name == REPLY_TOOL_NAME:
+            oscar = block.input.get('oscar') is True
+            codes = [code for code in block.input.get('codes') or [] if isinstance(code, str)]
+            confidence = block.input.get('confidence')
+            confidence = float(confidence) if isinstance(confidence, (int, float)) else None
+            if oscar:
+                return '\n'.join(f'Oscar message: {code}' for code in codes) or 'Oscar message: ERROR', confidence
+            return '\n'.join(f'Command understood: {code}' for code in codes) or 'Huh?', confidence
+    return ''.join(block.text for block in content if block.type == 'text'), None
+
+def send_to_claude(user_text, prompt=None, model=None, timeout=None):
+    prompt = prompt or BASE_PROMPT
+    # Retries are left to the cascade and the circuit breaker
+    pooled = claude_clients.get()
+    api = pooled.with_options(timeout=timeout or TURN_DEADLINE, max_retries=0)
+    params = dict(
+        model=model or CLAUDE_MODEL,
         max_tokens=1200,
         temperature=0,
-        system=BASE_PROMPT,
+        system=prompt,
         messages=[
             {
                 "role": "user",
@@ -481,51 +2153,484 @@ def send_to_claude(user_text):
             }
         ]
     )
+    if PROMPT_CACHING:
+        params['system'] = [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+        params['extra_headers'] = {'anthropic-beta': PROMPT_CACHING_BETA}
+    if STRUCTURED_OUTPUT:
+        if isinstance(params['system'], str):
+            params['system'] = [{"type": "text", "text": prompt}]
+        params['system'] = params['system'] + [{"type": "text", "text": REPLY_TOOL_INSTRUCTIONS}]
+        params['max_tokens'] = STRUCTURED_MAX_TOKENS
+        params['tools'] = [reply_tool(prompt)]
+        params['tool_choice'] = {"type": "tool", "name": REPLY_TOOL_NAME}
 
-    claude_response = message.content
-    if 'actioncount' not in session:
-        session['actioncount'] = 0
-    session['actioncount'] += 1
+    confidence = None
+    try:
+        if STRUCTURED_OUTPUT:
+            if CLAUDE_STREAMING:
+                content, usage = stream_from_claude(api, params)
+            else:
+                message = api.messages.create(**params)
+                content, usage = message.content, message.usage
+            reply, confidence = tool_reply(content)
+            claude_response = [TextBlock(type='text', text=reply)]
+        else:
+            message = api.messages.create(**params)
+            claude_response = message.content
+            usage = message.usage
+    except anthropic.APIConnectionError as e:
+        if not isinstance(e, anthropic.APITimeoutError):
+            claude_clients.recycle(pooled)
+        raise
+    count('claude_calls')
+    record_usage(usage)
 
     claude_response_text = claude_response
-    return claude_response_text
+    return claude_response_text, confidence
 
-@app.route('/')
-def index():
-    session.clear()
+# Claude's reply only depends on the transcript and the prompt (temperature is 0), so replies are
+# cached by normalised transcript. The in-process tier keeps REPLY_CACHE_SIZE replies for up to
+# REPLY_CACHE_TTL seconds; with REPLY_CACHE_SHARED=1 replies are also stored in GCS under
+# reply_cache/<prompt hash>/ so every worker and instance shares them. Keys include a hash of the
+# base prompt, so editing base_prompt.txt leaves old entries unreachable (see refresh_base_prompt).
+REPLY_CACHE_SIZE = int(os.environ.get('REPLY_CACHE_SIZE', 2000))
+REPLY_CACHE_TTL = float(os.environ.get('REPLY_CACHE_TTL', 86400))
+REPLY_CACHE_SHARED = os.environ.get('REPLY_CACHE_SHARED', '0') == '1'
+FILLER_WORDS = frozenset(('um', 'umm', 'uh', 'uhh', 'er', 'erm', 'hmm', 'ah', 'oh', 'please', 'okay', 'ok',
+                          'so', 'well', 'now', 'just', 'then', 'the', 'a', 'an'))
+
+def normalise_transcript(text):
+    return ' '.join(word for word in re.findall(r"[a-z0-9']+", text.lower()) if word not in FILLER_WORDS)
+
+class ReplyCache:
+    def __init__(self, maxsize=REPLY_CACHE_SIZE, ttl=REPLY_CACHE_TTL, shared=REPLY_CACHE_SHARED):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def shared_path(self, prompt_hash, transcript):
+        return f"reply_cache/{prompt_hash}/{hashlib.sha1(transcript.encode('utf-8')).hexdigest()}"
+
+    def get(self, prompt_hash, transcript):
+        key = (prompt_hash, transcript)
+        with self.lock:
+            item = self.entries.get(key)
+            if item is not None:
+                reply, expires = item
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    count('reply_cache_hits')
+                    return reply
+                del self.entries[key]
+
+        if self.shared:
+            try:
+                reply = bucket.blob(self.shared_path(prompt_hash, transcript)).download_as_text()
+                count('reply_cache_shared_hits')
+                self._store(key, reply)
+                return reply
+            except NotFound:
+                pass
+            except Exception as e:
+                print(f"Error reading shared reply cache: {e}")
+        count('reply_cache_misses')
+        return None
+
+    def put(self, prompt_hash, transcript, reply):
+        self._store((prompt_hash, transcript), reply)
+        if self.shared:
+            try:
+                bucket.blob(self.shared_path(prompt_hash, transcript)).upload_from_string(reply)
+            except Exception as e:
+                print(f"Error writing shared reply cache: {e}")
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _store(self, key, reply):
+        with self.lock:
+            self.entries[key] = (reply, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+reply_cache = ReplyCache()
+
+# Local fast path built from the CommandCode and OscarCode tables in the base prompt. Each
+# command description is split into phrases ("Pick up or get or take book." gives "pick up
+# book", "get book" and "take book"), and the "also known as" sentences become synonyms
+# that are rewritten to one name in both phrases and transcripts. A transcript is answered
+# locally when it matches a phrase of exactly one code, either exactly or with a fuzzy
+# score of at least LOCAL_CLASSIFIER_MIN_SCORE and a clear lead over every other code.
+# Rows the prompt marks "No other wording" or "Never map" (save, load, and launching the pod
+# without Oscar) only ever match exactly, and a fuzzy match is refused when the transcript and
+# the phrase differ in a negation or in "with"/"without" ("launch escape pod with oscar" is
+# close to the 0054 phrase but means the opposite). Anything else goes to Claude. `python main.py classifier-report` measures how often it
+# answers and how often it agrees with Claude.
+LOCAL_CLASSIFIER = os.environ.get('LOCAL_CLASSIFIER', '1') == '1'
+LOCAL_CLASSIFIER_MIN_SCORE = float(os.environ.get('LOCAL_CLASSIFIER_MIN_SCORE', 0.9))
+LOCAL_CLASSIFIER_MARGIN = 0.05
+# used instead when Claude can't be reached
+LOCAL_CLASSIFIER_FALLBACK_SCORE = 0.75
+TABLE_ROW_PATTERN = re.compile(r'^(00[0-9][0-9A-Q])\s+(.+)$', re.M)
+QUOTED_PATTERN = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+QUOTE_PATTERN = re.compile(r"(?:^|(?<=\s))'|'(?=\s|$)")
+DEFINITION_PATTERN = re.compile(r'(?i)also known as|is called|sometimes called|referred to as|can also mean')
+NO_LOCAL_MATCH_WORDS = ('commandcode', 'command code', 'oscar message')
+EXACT_ONLY_PATTERN = re.compile(r'(?i)no other wording|never map')
+NEGATION_WORDS = frozenset(('no', 'not', 'never', 'nothing', 'cannot', 'dont', 'without'))
+
+# The words that turn a phrase into its opposite, so fuzzy matches can be made to agree on them
+def contrast_words(text):
+    return frozenset(word for word in text.split() if word in NEGATION_WORDS or word == 'with' or word.endswith("n't"))
+
+class LocalClassifier:
+    def __init__(self, prompt, min_score=LOCAL_CLASSIFIER_MIN_SCORE, margin=LOCAL_CLASSIFIER_MARGIN):
+        self.min_score = min_score
+        self.margin = margin
+        self.synonyms = {}
+        for line in prompt.splitlines():
+            if line.startswith(('If commands refer to', 'If you are asked to describe yourself')):
+                names = [tuple(self.normalise(a or b).split()) for a, b in QUOTED_PATTERN.findall(line)]
+                for name in names:
+                    if name:
+                        self.synonyms[name] = names[0]
+        self.longest_synonym = max(map(len, self.synonyms), default=0)
+
+        # oscar? -> phrase -> codes
+        self.phrases = {False: {}, True: {}}
+        self.exact_only = set()
+        for code, description in TABLE_ROW_PATTERN.findall(prompt):
+            oscar = code[3].isalpha()
+            if EXACT_ONLY_PATTERN.search(description):
+                self.exact_only.add(code)
+            for phrase in self.split_description(description, oscar):
+                self.phrases[oscar].setdefault(phrase, set()).add(code)
+        # a bare "look at" is the start of too many other commands to mean any one of them
+        for phrases in self.phrases.values():
+            for phrase, codes in list(phrases.items()):
+                others = set()
+                for other, other_codes in phrases.items():
+                    if other.startswith(phrase + ' '):
+                        others |= other_codes - codes
+                if len(others) > 1:
+                    del phrases[phrase]
+        self.phrase_lists = {oscar: list(phrases) for oscar, phrases in self.phrases.items()}
+
+    def canonical(self, text):
+        words = [word for i, word in enumerate(text.split()) if i == 0 or word != text.split()[i - 1]]
+        result = []
+        i = 0
+        while i < len(words):
+            for size in range(min(self.longest_synonym, len(words) - i), 0, -1):
+                name = self.synonyms.get(tuple(words[i:i + size]))
+                if name is not None:
+                    # "stop carrying DAVE the potato" names the life form twice
+                    if result[-len(name):] != list(name):
+                        result += name
+                    i += size
+                    break
+            else:
+                result.append(words[i])
+                i += 1
+        return ' '.join(result)
+
+    def split_description(self, description, oscar):
+        phrases = set()
+        description = re.split(r'(?i)\bnever\b|no other wording', description)[0]
+        for sentence in re.split(r'[.?;]', description):
+            sentence = re.sub(r'\([^)]*\)|\swhere\s+\'.*', ' ', sentence)
+            if DEFINITION_PATTERN.search(sentence):
+                continue
+            pieces = []
+            for piece in re.split(r'(?i),|\bor\b', sentence):
+                quoted = piece.strip().startswith(("'", '"'))
+                piece = self.normalise(piece)
+                if oscar and piece.startswith('oscar '):
+                    piece = piece[6:]
+                if piece and piece != 'oscar':
+                    pieces.append((piece, quoted))
+            # "pick up or get or take book": short verbs before a two word last piece share its object
+            if len(pieces) > 1 and len(pieces[-1][0].split()) == 2:
+                obj = pieces[-1][0].split()[1]
+                pieces = [(f'{piece} {obj}' if len(piece.split()) <= 2 and not quoted and not piece.endswith(obj) else piece, quoted)
+                          for piece, quoted in pieces]
+            pieces = [piece for piece, quoted in pieces]
+            phrases.update(self.canonical(piece) for piece in pieces)
+        return phrases
+
+    def normalise(self, text):
+        return normalise_transcript(QUOTE_PATTERN.sub(' ', text))
+
+    def reply(self, code):
+        return f'Oscar message: {code}' if code[3].isalpha() else f'Command understood: {code}'
+
+    # Returns the reply Claude would give, or None when the transcript isn't a confident match
+    def classify(self, user_text, min_score=None):
+        min_score = min_score or self.min_score
+        text = self.normalise(user_text)
+        if not text or any(word in text for word in NO_LOCAL_MATCH_WORDS):
+            return None
+        oscar = text == 'oscar' or text.startswith('oscar ')
+        if oscar:
+            text = text[6:]
+        text = self.canonical(text)
+        phrases = self.phrases[oscar]
+
+        codes = phrases.get(text)
+        if codes is not None:
+            return self.reply(next(iter(codes))) if len(codes) == 1 else None
+
+        matches = difflib.get_close_matches(text, self.phrase_lists[oscar], n=5, cutoff=min_score - self.margin)
+        if not matches:
+            return None
+        best = [(difflib.SequenceMatcher(None, text, match).ratio(), match) for match in matches]
+        best.sort(reverse=True)
+        score, match = best[0]
+        codes = phrases[match]
+        if score < min_score or len(codes) != 1 or codes & self.exact_only:
+            return None
+        if contrast_words(text) != contrast_words(match):
+            return None
+        if any(other_score > score - self.margin and phrases[other] != codes for other_score, other in best[1:]):
+            return None
+        return self.reply(next(iter(codes)))
+
+local_classifier = LocalClassifier(BASE_PROMPT)
+
+# With PROMPT_SLICING on, Claude is only shown the table rows for codes that can do something
+# right now: a code with no handler for the current location whose when= guard passes would
+# end up in cmd_not_understood() whatever Claude said, so its row is dropped. Escape pod
+# buttons aren't offered on the bridge, and the Oscar table is empty until Oscar's been met.
+# If Claude's reply to the sliced prompt isn't in one of the forms the prompt asks for (a code,
+# "Huh?" or "Oscar message: ERROR") the turn is asked again with the full prompt. A reply that
+# the command wasn't understood, or that names a code dropped from the slice, is kept: that
+# command would end in cmd_not_understood() with the full prompt too. Slices are built once
+# per set of codes.
+PROMPT_SLICING = os.environ.get('PROMPT_SLICING', '1') == '1'
+prompt_slices = {}
+
+def reachable_codes():
+    location = session['location']
+    return frozenset(code for (code, handler_location), entries in DISPATCH_TABLE.items()
+                     if handler_location == location and any(when is None or when() for order, when, handler in entries))
+
+def well_formed_reply(reply):
+    return reply.strip() == 'Huh?' or REPLY_PATTERN.search(reply) is not None
+
+def sliced_prompt(codes):
+    key = (BASE_PROMPT_HASH, codes)
+    prompt = prompt_slices.get(key)
+    if prompt is None:
+        lines = BASE_PROMPT.splitlines(keepends=True)
+        prompt = ''.join(line for line in lines if not (TABLE_ROW_PATTERN.match(line) and line[:4] not in codes))
+        prompt_slices[key] = prompt
+    return prompt
+
+# Asks each of CLAUDE_MODELS in turn, cheapest first, moving on to the next model only when the
+# answer isn't good enough to act on: no code ("Huh?" or "Oscar message: ERROR"), more than one
+# code, or (with STRUCTURED_OUTPUT) a confidence below CLAUDE_CASCADE_MIN_CONFIDENCE. The last
+# model's answer is always used. Calls, seconds, answers and escalations are counted per model.
+CLAUDE_MODELS = [model.strip() for model in os.environ.get('CLAUDE_MODELS', f'claude-3-haiku-20240307,{CLAUDE_MODEL}').split(',') if model.strip()]
+CLAUDE_CASCADE_MIN_CONFIDENCE = float(os.environ.get('CLAUDE_CASCADE_MIN_CONFIDENCE', 0.7))
+
+def confident_reply(reply, confidence):
+    codes, oscar = parse_reply(reply)
+    return len(codes) == 1 and (confidence is None or confidence >= CLAUDE_CASCADE_MIN_CONFIDENCE)
+
+# The time left is shared evenly between the models still to try. A model that fails or times
+# out is skipped; UpstreamUnavailable is raised only when the last one does too.
+def ask_claude(user_text, prompt=None, models=None, deadline=None):
+    models = models or CLAUDE_MODELS
+    deadline = deadline or Deadline()
+    for tier, model in enumerate(models):
+        last = tier == len(models) - 1
+        started = time.monotonic()
+        try:
+            claude_response, confidence = claude_upstream(model).call(
+                lambda timeout: send_to_claude(user_text, prompt, model, timeout), deadline.remaining() / (len(models) - tier))
+        except UpstreamUnavailable as e:
+            print(f"Error asking {model}: {e}")
+            if last:
+                raise
+            count(f'cascade_{model}_escalations')
+            continue
+        reply = ''.join(block.text for block in claude_response if block.type == 'text')
+        count(f'cascade_{model}_calls')
+        count(f'cascade_{model}_seconds', time.monotonic() - started)
+        if last or confident_reply(reply, confidence):
+            count(f'cascade_{model}_answers')
+            return reply
+        count(f'cascade_{model}_escalations')
+
+# Turns a transcript into Claude's reply: from the local classifier when it's confident,
+# then the reply cache, then Claude itself. `codes` are the reachable codes for a sliced
+# prompt (None for the full prompt). Doesn't touch the session, so it can run speculatively.
+def classify_transcript(user_text, codes=None, deadline=None):
+    refresh_base_prompt()
+    reply = local_classifier.classify(user_text) if LOCAL_CLASSIFIER else None
+    if reply is not None:
+        count('local_classifier_hits')
+        return reply
+
+    prompt = sliced_prompt(codes) if codes else BASE_PROMPT
+    prompt_hash = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12] if codes else BASE_PROMPT_HASH
+    transcript = normalise_transcript(user_text)
+    reply = reply_cache.get(prompt_hash, transcript)
+    if reply is None:
+        try:
+            reply = ask_claude(user_text, prompt, deadline=deadline)
+            if codes and not well_formed_reply(reply):
+                count('prompt_slice_misses')
+                reply = ask_claude(user_text, models=CLAUDE_MODELS[-1:], deadline=deadline)
+        except UpstreamUnavailable:
+            reply = local_classifier.classify(user_text, LOCAL_CLASSIFIER_FALLBACK_SCORE)
+            if reply is None:
+                raise
+            count('local_classifier_fallbacks')
+        else:
+            reply_cache.put(prompt_hash, transcript, reply)
+    return reply
+
+# With SPECULATIVE_CLASSIFICATION on, a streamed command is classified before the player has
+# finished speaking: once the interim transcript has stayed the same for SPECULATION_STABLE_MS,
+# classify_transcript() starts on it in the background. If the final transcript normalises to
+# the same text (and the reachable codes haven't changed) the speculative reply is used;
+# otherwise it's dropped and the command is classified again. Only the reply is speculative -
+# the game itself only changes once the job dispatches it. At most SPECULATION_LIMIT
+# classifications are started per command.
+SPECULATIVE_CLASSIFICATION = os.environ.get('SPECULATIVE_CLASSIFICATION', '1') == '1'
+SPECULATION_STABLE_MS = float(os.environ.get('SPECULATION_STABLE_MS', 300))
+SPECULATION_LIMIT = 3
+
+class Speculation:
+    def __init__(self, user_text, codes):
+        self.transcript = normalise_transcript(user_text)
+        self.codes = codes
+        self.future = thread_pool('speculation', 8).submit(classify_transcript, user_text, codes, Deadline())
+
+    def matches(self, user_text, codes):
+        return self.transcript == normalise_transcript(user_text) and self.codes == codes
+
+class Speculator:
+    def __init__(self, codes, stable=SPECULATION_STABLE_MS / 1000, limit=SPECULATION_LIMIT):
+        self.codes = codes
+        self.stable = stable
+        self.limit = limit
+        self.heard_text = None
+        self.timer = None
+        self.speculation = None
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def heard(self, user_text):
+        transcript = normalise_transcript(user_text)
+        with self.lock:
+            if not transcript or transcript == self.heard_text:
+                return
+            self.heard_text = transcript
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.stable, self._speculate, (user_text, transcript))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _speculate(self, user_text, transcript):
+        with self.lock:
+            if transcript != self.heard_text or self.started >= self.limit:
+                return
+            if self.speculation is not None:
+                if self.speculation.transcript == transcript:
+                    return
+                self.speculation.future.cancel()
+            self.speculation = Speculation(user_text, self.codes)
+            self.started += 1
+        count('speculations')
+
+    # Called once the final transcript is in; returns the speculation to check it against
+    def finish(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            return self.speculation
+
+def classify_command(user_text, deadline=None, speculation=None):
+    codes = reachable_codes() if PROMPT_SLICING else None
+    reply = None
+    if speculation is not None:
+        if speculation.matches(user_text, codes):
+            try:
+                reply = speculation.future.result(deadline.remaining() if deadline else TURN_DEADLINE)
+                count('speculation_hits')
+            except Exception as e:
+                print(f"Error in speculative classification: {e}")
+        else:
+            speculation.future.cancel()
+            count('speculation_misses')
+    if reply is None:
+        reply = classify_transcript(user_text, codes, deadline)
+
+    if 'actioncount' not in session:
+        session['actioncount'] = 0
+    session['actioncount'] += 1
+    return [TextBlock(type='text', text=reply)]
+
+# Offline check of the local classifier: `python main.py classifier-report transcripts.txt ...`
+# reads one transcript per line (stdin if no files are given) and prints how many the local
+# classifier answers and, unless --no-claude is given, how often its code matches Claude's.
+def reply_code(reply):
+    codes = parse_codes(reply)
+    return codes[0] if codes else None
+
+def classifier_report(paths, with_claude=True):
+    transcripts = []
+    for path in paths or ['-']:
+        with (sys.stdin if path == '-' else open(path, encoding='utf-8')) as f:
+            transcripts += [line.strip() for line in f if line.strip()]
+
+    answered = agreed = 0
+    disagreements = []
+    for user_text in transcripts:
+        reply = local_classifier.classify(user_text)
+        if reply is None:
+            continue
+        answered += 1
+        if with_claude:
+            claude_reply = ask_claude(user_text)
+            if reply_code(reply) == reply_code(claude_reply):
+                agreed += 1
+            else:
+                disagreements.append((user_text, reply, claude_reply.strip()))
+        else:
+            print(f'{user_text!r} -> {reply}')
+
+    total = len(transcripts)
+    print(f'{total} transcripts, {answered} answered locally ({answered / max(total, 1):.1%})')
+    if with_claude:
+        print(f'{agreed} of {answered} agree with Claude ({agreed / max(answered, 1):.1%})')
+        for user_text, reply, claude_reply in disagreements:
+            print(f'  {user_text!r}: local {reply!r}, Claude {claude_reply!r}')
+
+@app.route('/')
+def index():
+    session.clear()
+    session.update(GameState().to_dict())
     session['response_log'] = initial_responses.copy()
-    session['location'] = "bridge"
-    session['inventory'] = ['+ Miscellaneous cleansing tools and fluids']
-    session['hasbook'] = False
-    session['hasdave'] = False
-    session['booklocation'] = "readyroom"
-    session['davelocation'] = "engineering"
-    session['oscarlocation'] = "engineering"
-    session['seenerror'] = False
-    session['seenbridge'] = False
-    session['seenreadyroom'] = False
-    session['seenpanel'] = False
-    session['seenfire'] = False
-    session['seenengineering'] = False
-    session['seenescapepod'] = False
-    session['seenoscar'] = False
-    session['seendave'] = False
-    session['beenbridge'] = True
-    session['beenreadyroom'] = False
-    session['beenengineering'] = False
-    session['panelopen'] = False
-    session['hatchopen'] = False
-    session['klaxonopen'] = True
-    session['readbook'] = False
-    session['awareengineering'] = False
-    session['launch'] = False
-    session['actioncount'] = 0
-    session['errorcount'] = 0
+    session['next_seq'] = len(initial_responses) + 1
     session.modified = True
     is_windows = platform.system() == 'Windows'
-    return render_template('index.html', is_windows=is_windows)
+    return render_template('index.html', is_windows=is_windows, load_record_ms=8000 if SAVE_CODES else 4000,
+                           stream_uploads=STREAM_UPLOADS)
     #return render_template('index.html')
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    with metrics_lock:
+        return jsonify(dict(metrics))
+
 @app.route('/site.webmanifest')
 def manifest():
     return send_from_directory('static', 'site.webmanifest')
@@ -540,12 +2645,30 @@ def get_initial_responses():
 
 @app.route('/new_responses', methods=['GET'])
 def get_new_responses():
-    last_response_time = request.args.get('last_response_time', type=float, default=0)
-    new_resp = [r for r in session.get('response_log', []) if datetime.fromisoformat(r['timestamp']).timestamp() > last_response_time]
+    after = request.args.get('after', type=int, default=0)
+    wait = min(request.args.get('wait', type=float, default=0), LONG_POLL_TIMEOUT)
+    response_log = session.get('response_log', [])
+    new_resp = [r for r in response_log if r['seq'] > after]
 
-    session['response_log'] = new_resp
-    session.modified = True
+    # Long poll: hold the request until game logic appends something or the wait runs out
+    held = not new_resp and wait > 0 and long_poll_slots.acquire(blocking=False)
+    try:
+        deadline = time.monotonic() + wait
+        while held and not new_resp and app.session_interface.wait_for_update(session, deadline - time.monotonic()):
+            response_log = session.get('response_log', [])
+            new_resp = [r for r in response_log if r['seq'] > after]
+    finally:
+        if held:
+            long_poll_slots.release()
+
+    # Only rewrite the session when something was actually pruned from the log
+    if len(new_resp) != len(response_log):
+        session['response_log'] = new_resp
+        session.modified = True
 
+    if not new_resp and wait > 0 and not held:
+        count('long_polls_refused')
+        return jsonify({'responses': new_resp, 'retry_after': LONG_POLL_BUSY_RETRY})
     return jsonify({'responses': new_resp})
 
 @app.route('/text_to_speech', methods=['POST'])
@@ -557,40 +2680,95 @@ def text_to_speech():
     engine.runAndWait()
     return '', 204
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_pool.get(job_id)
+    if job is None:
+        return get_shared_job(job_id)
+    if job.sid != session.sid:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    wait = min(request.args.get('wait', type=float, default=0), LONG_POLL_TIMEOUT)
+    held = not job.done.is_set() and wait > 0 and long_poll_slots.acquire(blocking=False)
+    try:
+        if held:
+            job.done.wait(wait)
+    finally:
+        if held:
+            long_poll_slots.release()
+    if not job.done.is_set():
+        return pending_job(job.id, job.status, held, wait)
+    session.seen = max(session.seen, job.generation)
+    return jsonify(dict(job.result, job_id=job.id))
+
+# A job this worker doesn't have: finished elsewhere, so its result is in GCS, or submitted
+# moments ago to another worker, or unknown
+def get_shared_job(job_id):
+    wait = min(request.args.get('wait', type=float, default=0), LONG_POLL_TIMEOUT)
+    shared = shared_job(job_id, session.sid)
+    age = job_age(job_id)
+    if shared is None and (age is None or age > JOB_PENDING_MAX):
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    held = shared is None and wait > 0 and long_poll_slots.acquire(blocking=False)
+    try:
+        deadline = time.monotonic() + min(wait, JOB_PENDING_MAX - age)
+        while held and shared is None and time.monotonic() + LONG_POLL_RECHECK <= deadline:
+            time.sleep(LONG_POLL_RECHECK)
+            shared = shared_job(job_id, session.sid)
+    finally:
+        if held:
+            long_poll_slots.release()
+    if shared is None:
+        return pending_job(job_id, 'running', held, wait)
+    session.seen = max(session.seen, shared.get('generation', 0))
+    return jsonify(dict(shared['result'], job_id=job_id))
+
+def pending_job(job_id, status, held, wait):
+    if wait > 0 and not held:
+        count('long_polls_refused')
+        return jsonify({'status': status, 'job_id': job_id, 'retry_after': LONG_POLL_BUSY_RETRY})
+    return jsonify({'status': status, 'job_id': job_id})
+
 @app.route('/load_game', methods=['POST'])
 def load_game():
-    try:
-        if 'user_audio' not in request.files:
-            add_response_special('No audio file provided')
-            return jsonify({'status': 'error', 'message': 'No audio file provided'}), 400
+    if 'user_audio' not in request.files:
+        add_response_special('No audio file provided')
+        return jsonify({'status': 'error', 'message': 'No audio file provided'}), 400
 
-        audio_file = request.files['user_audio']
-        audio_content = audio_file.read()
+    try:
+        audio_content, audio_format = read_audio_upload(request.files['user_audio'])
+    except AudioRejected as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
 
-        # Check MIME type and adjust encoding accordingly
-        if audio_file.mimetype == 'audio/wav':
-            encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16
-            sample_rate = 48000  # Updated sample rate
-        else:
-            return jsonify({'status': 'error', 'message': 'Unsupported audio format'}), 400
+    return submit_job(process_load, audio_content, audio_format)
 
-        user_text = transcribe_audio(audio_content, encoding=encoding, sample_rate=sample_rate)
+def process_load(audio_content, audio_format):
+    try:
+        audio, encoding, sample_rate = prepare_audio(audio_content, audio_format)
+        user_text = transcribe_audio(audio, encoding=encoding, sample_rate=sample_rate, mode='load')
         user_text = user_text.lower()
+        group = stt_hint_group()
+        count(f'stt_{group}_loads')
         add_response_special(f'>> CODE PHRASE RECEIVED AS: "{user_text}"\n')
 
-        if len(user_text.split()) != 3:
-            add_response_special('>> ERROR << CODE PHRASE MUST CONTAIN EXACTLY 3 WORDS\n\n', delay=0.05)
+        if len(user_text.split()) not in CODE_PHRASE_LENGTHS:
+            add_response_special(f'>> ERROR << {CODE_PHRASE_LENGTH_ERROR}\n\n', delay=0.05)
             add_response_special('Use the LOAD command to try again, or just continue the rescue from here.\n')
             reset_footer()
-            return jsonify({'status': 'error', 'message': 'CODE PHRASE MUST CONTAIN EXACTLY 3 WORDS', 'reset_footer': True})
+            count(f'stt_{group}_load_misses')
+            return {'status': 'error', 'message': CODE_PHRASE_LENGTH_ERROR, 'reset_footer': True}
 
-        restore_game(user_text)
+        if not restore_game(user_text):
+            count(f'stt_{group}_load_misses')
+        reset_footer()
+        return {'status': 'success', 'message': ' ', 'reset_footer': True}
+    except UpstreamUnavailable as e:
+        add_response_special(LINK_DOWN_MESSAGE)
         reset_footer()
-        return jsonify({'status': 'success', 'message': ' ', 'reset_footer': True})
+        return {'status': 'error', 'message': str(e), 'reset_footer': True}
     except Exception as e:
         add_response_special(f'>> ERROR << {str(e)}\n')
         reset_footer()
-        return jsonify({'status': 'error', 'message': str(e), 'reset_footer': True})
+        return {'status': 'error', 'message': str(e), 'reset_footer': True}
 
 @app.route('/reset_footer', methods=['POST'])
 def reset_footer():
@@ -607,943 +2785,1356 @@ def goodbye():
 
 @app.route('/record', methods=['POST'])
 def record_endpoint():
+    if 'user_audio' not in request.files:
+        add_response_special('No audio file provided')
+        return jsonify({'status': 'error', 'message': 'No audio file provided'}), 400
+
     try:
-        if 'user_audio' not in request.files:
-            add_response_special('No audio file provided')
-            return jsonify({'status': 'error', 'message': 'No audio file provided'}), 400
+        audio_content, audio_format = read_audio_upload(request.files['user_audio'])
+    except AudioRejected as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status
 
-        audio_file = request.files['user_audio']
-        audio_content = audio_file.read()
+    return submit_job(process_command, audio_content, audio_format)
 
-        # Check MIME type and adjust encoding accordingly
-        if audio_file.mimetype == 'audio/wav':
-            encoding = speech.RecognitionConfig.AudioEncoding.LINEAR16
-            sample_rate = 48000  # Updated sample rate
-        else:
-            return jsonify({'status': 'error', 'message': 'Unsupported audio format'}), 400
+# The browser normally records at 48kHz, but the rate in the WAV header wins when there is one
+def wav_sample_rate(audio_content, default=48000):
+    if audio_content[:4] == b'RIFF' and audio_content[8:12] == b'WAVE' and len(audio_content) >= 28:
+        return struct.unpack_from('<I', audio_content, 24)[0]
+    return default
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'status': 'error', 'message': 'Recording too large'}), 413
+
+@app.route('/record_stream', methods=['POST'])
+def record_stream_endpoint():
+    if not STREAM_UPLOADS:
+        return jsonify({'status': 'error', 'message': 'Streaming uploads are off'}), 404
+    try:
+        sample_rate = int(request.args.get('rate', 48000))
+    except ValueError:
+        sample_rate = 0
+    if not 8000 <= sample_rate <= 48000:
+        return jsonify({'status': 'error', 'message': 'Unsupported sample rate'}), 400
+
+    speculator = Speculator(reachable_codes() if PROMPT_SLICING else None) if SPECULATIVE_CLASSIFICATION else None
+    try:
+        user_text = transcribe_stream(request.stream, sample_rate, on_interim=speculator and speculator.heard)
+    except UpstreamUnavailable as e:
+        add_response_special(LINK_DOWN_MESSAGE)
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except Exception as e:
+        add_response_special(f"Error during transcription: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    finally:
+        speculation = speculator and speculator.finish()
+
+    return submit_job(process_transcript, user_text, None, speculation)
+
+def process_command(audio_content, audio_format):
+    deadline = Deadline()
+    try:
+        audio, encoding, sample_rate = prepare_audio(audio_content, audio_format)
+        user_text = transcribe_audio(audio, encoding=encoding, sample_rate=sample_rate, deadline=deadline)
+    except UpstreamUnavailable as e:
+        add_response_special(LINK_DOWN_MESSAGE)
+        return {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        add_response_special(f"Error during transcription: {str(e)}")
+        return {'status': 'error', 'message': str(e)}
+    return process_transcript(user_text, deadline)
+
+TRANSCRIPT_PREFIX = '>> MESSAGE RECEIVED AS: '
 
-        user_text = transcribe_audio(audio_content, encoding=encoding, sample_rate=sample_rate)
+def process_transcript(user_text, deadline=None, speculation=None):
+    try:
         user_text = user_text.lower()
-        add_response_special(f">> MESSAGE RECEIVED AS: {user_text}")
+        previous = next((entry['text'][len(TRANSCRIPT_PREFIX):] for entry in reversed(session['response_log'])
+                         if entry['text'].startswith(TRANSCRIPT_PREFIX)), None)
+        add_response_special(f"{TRANSCRIPT_PREFIX}{user_text}")
 
         # Logging session state
         print("Session state before processing:", session)
 
-        claude_response_text = send_to_claude(user_text)
+        claude_response_text = classify_command(user_text, deadline, speculation)
         #add_response_special(claude_response_text)
+        understood = True
         for block in claude_response_text:
-            if session['location'] == "bridge" and '0000' in block.text and session['seenbridge'] == False:
-                if session['klaxonopen'] == True:
-                    add_response('Ok, looking...it\'s a big bridge-y sort of room with polished consoles and a lot of noisy klaxons.\n', 2)
-                    add_response('There\'s an open hatch to my right and a smell of lemon polish in the air, tempered by undertones of burning plastic and impending death.\n', 0)
-                else:
-                    add_response('Ok, looking...it\'s a big bridge-y sort of room with polished consoles and even without the klaxons, a definite "imminent doom" vibe.\n\n', 2)
-                    add_response('There\'s an open hatch to my right and a smell of lemon polish in the air, tempered by undertones of burning plastic and impending death.\n', 2)
-                if session['booklocation'] == "bridge" and session['hasbook'] == False:
-                    add_response('Someone thought it would be a good idea to clutter up the floor with a book.\n', 2)
-                if session['davelocation'] == "bridge" and session['hasdave'] == False:
-                    add_response('A potato-based-lifeform sits on a plate on the floor, faintly menacing as its eyes follow me around the room...\n', 0)    
-                session['seenbridge'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "bridge" and '0000' in block.text and session['seenbridge'] == True:
-                if session['klaxonopen'] == True:
-                    add_response('I just told you this. Consoles, klaxons, impending death, hatch to another room over there...\n', 2)
-                else:
-                    add_response('I just told you this. Consoles, impending death, hatch to another room over there...\n', 2)
-                if session['booklocation'] == "bridge" and session['hasbook'] == False:
-                    add_response('And that book\'s making the whole place look scruffy.\n', 0)
-                if session['davelocation'] == "bridge" and session['hasdave'] == False:
-                    add_response('A potato-based-lifeform sits on a plate on the floor, faintly menacing as its eyes follow me around the room...\n', 0)  
-                nextaction()
-            elif session['location'] == "readyroom" and '0000' in block.text and session['seenreadyroom'] == False:
-                add_response('Ok, looking...this is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n', 2)
-                add_response('There are bunks by the wall, some chairs, and a table with a book on it. You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n', 2)
-                add_response('There\'s the open hatchway leading to the bridge, and a closed hatch opposite. There also seems to be a closed access panel in the floor.\n', 0)
-                session['seenreadyroom'] = True
-                session['seenpanel'] = True
-                session.modified = True
-                nextaction()  
-            elif session['location'] == "readyroom" and '0000' in block.text and session['seenreadyroom'] == True and session['panelopen'] == False and (session['booklocation'] == "readyroom" or session['hasbook'] == False):
-                add_response('Like I said: bunks, table, chairs, a book, an access panel and two hatches: one to the bridge and a closed one opposite.\n', delay=1)
-                if session['davelocation'] == "readyroom" and session['hasdave'] == False:
-                    add_response('A potato-based-lifeform sits on the table, patiently awaiting rescue.\n', delay=0)  
-                session['seenreadyroom'] = True
-                session['seenpanel'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0000' in block.text and session['seenreadyroom'] == True and session['panelopen'] == True and (session['booklocation'] == "readyroom"):
-                add_response('Like I said: bunks, table, chairs, a book, an access panel and two hatches: an open one to the bridge and a closed one opposite.\n', delay=2)
-                add_response('And the fire coming out of the access panel. But you probably remember that.\n', delay=3)
-                if session['davelocation'] == "readyroom" and session['hasdave'] == False:
-                    add_response('The light of the fire dances in DAVE\'s eyes as he stares down his historic foe.\n', delay=3)  
-                    add_response('One must admire its defiance in the face of such danger, not seeking to cower in the book\'s shadow, but nonetheless the sooner we affect a rescue, the better.\n', delay=3)  
-                nextaction()
-            elif session['location'] == "readyroom" and '0000' in block.text and session['seenreadyroom'] == True and session['panelopen'] == False and (session['booklocation'] != "readyroom" or session['hasbook'] == True):
-                add_response('Like I said: bunks, table, chairs, bunks an access panel and two hatches: one to the bridge and a closed one opposite.\n', delay=2)
-                if session['davelocation'] == "readyroom" and session['hasdave'] == False:
-                    add_response('I turn away for a moment, but would swear that DAVE\'s tendrils were gesturing toward me, pleading for freedom and safety.\n', delay=2)  
-                session['seenreadyroom'] = True
-                session['seenpanel'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0000' in block.text and session['seenreadyroom'] == True and session['panelopen'] == True and (session['booklocation'] != "readyroom" or session['hasbook'] == True):
-                add_response('Like I said: bunks, table, chairs, bunks, an access panel and two hatches: an open one to the bridge and a closed one opposite.\n', delay=2)
-                add_response('And the fire coming out of the access panel. But you probably remember that.\n', delay=6)
-                if session['davelocation'] == "readyroom" and session['hasdave'] == False:
-                    add_response('DAVE sits out of the flames range, high up on the table -but the smoke can\'t be good for him.\n', delay=2)  
-                nextaction()    
-            elif session['location'] == "engineering" and '0000' in block.text and session['seenengineering'] == False:
-                add_response('Never been in here before...\n', delay=1)
-                add_response('Standing with the hatch behind me I\'m in a kind of long corridor. There\'s the usual wall of beep-bop-boop indicator lights on my left, some of which are flashing red.\n', delay=3)
-                add_response('Down the wall on my right are similar indicators and a workstation showing two displays. One is blank and the other has the words \'Come here, I have instructions for you.\'.\n', delay=5)        
-                if  session['booklocation'] == "engineering" and session['hasbook'] == False:
-                    add_response('That book you dropped is a trip-hazard.\n', delay=2)
-                add_response('At the end of the corridor is an empty escape pod.\n', delay=2)
-                session['seenengineering'] = True
-                session['beenengineering'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "engineering" and '0000' in block.text:
-                add_response('I think we can ignore the wall of indicator lights -mostly because I don\'t know what they\'re for...\n', delay=1)
-                add_response('I can\'t tell you much about the escape pod without going in. Which sounds quite nice.\n', delay=3)
-                add_response('The message on the workstation looks intriguing. Perhaps we should have a look.\n', delay=3)
-                if  session['booklocation'] == "engineering" and session['hasbook'] == False:
-                    add_response('That book you dropped is a trip-hazard.\n', delay=3)
-                nextaction()
-            elif session['location'] == "escapepod" and '0000' in block.text and session['seenescapepod'] == False:
-                if session['oscarlocation'] == "escapepod":
-                    add_response('Not much in here.\n\nFour standard acceleration couches with harnesses.\n', delay=1)
-                    add_response('No windows. Two buttons:\n', delay=3)
-                    add_response('[TRANSFER SHIP\'S COMPUTER]\n\n which we already did, and\n\n[LAUNCH]\n\n which seems a really good idea.\n', delay=3)
-                else:
-                    add_response('Not much in here.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
-                    add_response('No windows. Two buttons:\n', delay=3)
-                    add_response('[TRANSFER SHIP\'S COMPUTER]\n\n and\n\n[LAUNCH]\n\n which both seem self-explanatory.\n', delay=3)
-                if session['davelocation'] == "escapepod" and session['hasdave'] == False:
-                    add_response('DAVE\'s strapped in and ready to go.\n', delay=1)    
-                if session['booklocation'] == "escapepod" and session['hasbook'] == False:
-                    if session['readbook'] == False:
-                        add_response('The rescue manual, or whatever it is, is secured so it doesn\'t fly around when we go.\n', delay=2)
-                    else:
-                        add_response('That book is here too.\n', delay=1)
-                session['seenescapepod'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "escapepod" and '0000' in block.text and session['seenescapepod'] == True:
-                if session['oscarlocation'] == "escapepod":
-                    add_response('It\'s not a big space to search. Just you\'re standard GTFO escape pod.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
-                    add_response('No windows. Two buttons:\n', delay=3)
-                    add_response('[TRANSFER SHIP\'S COMPUTER] which we already did, and\n\n[LAUNCH] which seems a really good idea.', delay=3)
-                else:
-                    add_response('It\'s not a big space to search. Just you\'re standard GTFO escape pod.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
-                    add_response('No windows. Two buttons:\n', delay=3)
-                    add_response('[TRANSFER SHIP\'S COMPUTER] and\n\n[LAUNCH] which both seem self-explanatory.\n', delay=3)
-                if session['davelocation'] == "escapepod" and session['hasdave'] == False:
-                    add_response('DAVE\'s strapped in and ready to go.\n', delay=1)    
-                if session['booklocation'] == "escapepod" and session['hasbook'] == False:
-                    if session['readbook'] == False:
-                        add_response('The rescue manual, or whatever it is, is secured so it doesn\'t fly around when we go.\n', delay=1)
-                    else:
-                        add_response('That book is here too.\n', delay=1)
-                session['seenescapepod'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "bridge" and '0001' in block.text and session['seenbridge'] == True:
-                add_response('Ok, heading right.\n', delay=3)
-                session['location'] = "readyroom"
-                session['beenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "bridge" and '0001' in block.text and session['seenbridge'] == False:
-                add_response('It\'s as if you\'ve been here before. There is indeed a hatch on my right.\n\nOk, heading there now.\n', delay=3)
-                session['location'] = "readyroom"
-                session['beenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] != "readyroom" and '0002' in block.text and session['seenbridge'] == True:
-                add_response('Ok, heading to the ready room.\n', delay=5)
-                session['location'] = "readyroom"
-                session['beenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] != "readyroom" and '0002' in block.text and session['seenbridge'] == False:
-                add_response('Ok, heading to the ready room.\n', delay=5)
-                session['location'] = "readyroom"
-                session.modified = True
-                nextaction()
-            elif session['location'] == "bridge" and '0002' in block.text and session['seenbridge'] == False:
-                add_response('It\'s as if you\'ve been here before. There is indeed a ready room connected to the bridge.\n\nOk, heading there now.\n', delay=5)
-                session['location'] = "readyroom"
-                session['beenreadyroom'] = True
-                session.modified = True
-                nextaction()   
-            elif session['location'] == "bridge" and '0003' in block.text:
-                add_response('Well that didn\'t take long. I\'m standing right here...\n', delay=0)
-                nextaction()
-            elif session['location'] != "bridge" and '0003' in block.text and session['beenbridge'] == True:
-                add_response('Gimme a sec...\n', delay=5)
-                add_response('Ok, I\'m back.\n', delay=0)
-                session['location'] = "bridge"
-                session.modified = True
-                nextaction()
-            elif '0004' in block.text:
-                add_response('Compass directions?\n\nWe are on a shuttle in space, unlikely to encounter wizards, orcs or similar creatures.\n', delay=0)
-                nextaction()
-            elif '0005' in block.text:
-                add_response('You\'re leaving? In the middle of a rescue????\n\nWell, if you really must leave you can always SAVE your progress first, and come back later. Just say the SAVE command.\n', delay=3)
-                nextaction()   
-            elif '0006' in block.text:
-                add_response('You are (on comms with a handsome Cleanerbot) on a big smokey tin can somewhere in deep space.\n', delay=1)
-                add_response('I\'ve never left the bridge but I\'m told the shuttle is only 300m or so long.\n', delay=2)
-                nextaction()     
-            elif session['location'] != 'engineering' and '0007' in block.text and (session['seenengineering'] == True or session['awareengineering'] == True):
-                add_response('Sure. I\'ll head over there.\n', delay=4)
-                add_response('Ok, I\'m here.\n', delay=1)
-                session['location'] = "engineering"
-                session.modified = True
-                nextaction() 
-            elif '0007' in block.text and (session['seenengineering'] == False or session['awareengineering'] == False):
-                add_response('I don\'t know where that is. My duties are restricted to the bridge.\n', delay=2)
-                add_response('But I\'m sure we have something like that, otherwise we\'d never be able to go anywhere.\n', delay=1)
-                nextaction()  
-            elif session['location'] == 'engineering' and '0007' in block.text:
-                add_response('I\'m already in engineering.\n', delay=0)
-                nextaction()           
-            elif (session['location'] != "engineering" and session['location'] !=  "escapepod") and '0008' in block.text and session['seenengineering'] == True:
-                add_response('Sure. I\'ll head over there.\n', delay=4)
-                add_response('Ok, I\'m in here.\n', delay=0)
-                session['location'] = "escapepod"
-                session.modified = True
-                nextaction() 
-            elif '0008' in block.text and session['seenengineering'] == False:
-                add_response('I don\'t know where that is. My duties are restricted to the bridge.\n', delay=1)
-                add_response('But I\'m sure we have something like that somewhere.\n', delay=0)
-                nextaction()  
-            elif session['location'] == 'engineering' and '0008' in block.text:
-                add_response('Ok, I\'m in here.\n', delay=0)
-                session['location'] = "escapepod"
-                session.modified = True
-                nextaction()               
-            elif session['location'] == 'escapepod' and '0008' in block.text:
-                add_response('I\'m already here.\n', delay=0)
-                nextaction()  
-            elif session['location'] == "readyroom" and '0009' in block.text and session['panelopen'] == False and session['seenpanel'] == True and session['seenfire'] == True:
-                add_response('Okidoke.\n\n', delay=3)
-                add_response("Yup, still burning like a disco inferno.\n", delay=1)
-                session['panelopen'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0009' in block.text and session['panelopen'] == False and session['seenpanel'] == True and session['seenfire'] == False:
-                add_response('Right you are. Let\'s see what\'s in here.\n', delay=3)
-                add_response("Fire. Quite a bit of fire.\n", delay=2)
-                add_response("Unless the crew likes barbecue, this probably isn\'t meant to be here.\n", delay=2)
-                session['panelopen'] = True
-                session['seenfire'] = True
-                session.modified = True
-                nextaction()        
-            elif session['location'] == "readyroom" and '0009' in block.text and session['panelopen'] == False and session['seenpanel'] == False:
-                add_response('I don\'t see an access panel in here.\n', delay=2)
-                add_response('Hold on. There is one in the floor. Probably for storage. Let me know if you want me to do something with that.\n', delay=2)
-                add_response('This is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall, some chairs, and a table with a book on it.\n', delay=2)
-                add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=4)
-                session['seenpanel'] = True
-                session['seenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0009' in block.text and session['panelopen'] ==  True:
-                add_response('It\'s already open.\n', delay=2)
-                add_response("Remember the fire coming out of the floor?\n", delay=2)
-                nextaction()
-            elif session['location'] != "readyroom" and '0010' in block.text:
-                add_response('I don\'t see an access panel in here.\n', delay=0)
-                nextaction()
-            elif session['location'] == "readyroom" and '0010' in block.text and session['seenpanel'] == False:
-                add_response('I don\'t see an access panel in here.\n', delay=2)
-                add_response('Hold on. There is one in the floor. Probably for storage. Let me know if you want me to do something with that.\n', delay=2)
-                add_response('This is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n', delay=2)
-                add_response('There are bunks by the wall, some chairs, and a table with a book on it.\n', delay=2)
-                add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n', delay=2)
-                add_response('There\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=1)
-                session['seenpanel'] = True
-                session['seenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0010' in block.text and session['seenpanel'] == True and session['panelopen'] == True:
-                add_response('Closed it. Considerably less firey in here.\n', delay=0)
-                session['panelopen'] = False
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0010' in block.text and session['seenpanel'] == True and session['panelopen'] == False:
-                add_response('It\'s already closed.\n', delay=0)
-                session['panelopen'] = False
-                session.modified = True
-                nextaction()
-            elif session['location'] == "readyroom" and '0011' in block.text and session['seenpanel'] == True and session['panelopen'] == False:
-                add_response('Flat, white, a metre square. You know, panel.\n', delay=0)
-                nextaction()
-            elif session['location'] != "readyroom" and '0011' in block.text:
-                add_response('I don\'t see an access panel in here.\n', delay=0)
-                nextaction()
-            elif session['location'] == "readyroom" and '0011' in block.text and session['seenpanel'] == False:
-                add_response('I don\'t see an access panel in here.\n', delay=2)
-                add_response('Hold on. There is one in the floor. Probably for storage. Let me know if yu want me to do something with that.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall, some chairs, and a table with a book on it.\n', delay=4)
-                add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=6)
-                session['seenpanel'] = True
-                session['seenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] != session['booklocation'] and '0012' in block.text and session['hasbook'] == False:
-                add_response('I don\'t have a book. Does it say how to perform a daring space rescue?\n', delay=0)
-                nextaction() 
-            elif '0012' in block.text and ( (session['location'] == session['booklocation']) or session['hasbook'] == True) :
-                add_response('Ok then..."It is a truth universally acknowledged, that a single man in possession of a good fortune, must be in need of a wife."\n', delay=4)
-                session['readbook'] = True
-                session.modified = True
-                if "+ A book -possibly about space rescues." in session['inventory']:
-                    session['inventory'].remove("+ A book -possibly about space rescues.")
-                    session['inventory'].append("+ A book: Pride and Prejudice by Jane Austen.")
-                add_response('Catchy intro, and I know I\'m only really programmed to parse janitorial system updates, but I don\'t think this will help us on the rescue.\n', delay=4)
-                nextaction() 
-            elif session['location'] == session['booklocation']  == "readyroom" and '0013' in block.text and session['seenreadyroom'] == False and session['readbook'] == False:
-                add_response('Yup, there\'s one right here on this table.  Got it.\n', delay=2)
-                session['inventory'].append('+ A book -possibly about space rescues.')
-                session['hasbook'] = True
-                session.modified = True
-                add_response('Looking around the rest of the room, there\'s a table and chairs and a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=4)    
-                session['seenreadyroom'] = True
-                session.modified = True
-                nextaction()
-            elif session['location'] == session['booklocation'] and '0013' in block.text and session['hasbook'] == False:
-                add_response('Got it.\n', delay=0)
-                if session['readbook'] == False:
-                    session['inventory'].append('+ A book -possibly about space rescues.')
-                else:
-                    session['inventory'].append('+ A book: Pride and Prejudice by Jane Austen.')   
-                session['hasbook'] = True
-                session.modified = True
-                nextaction()
-            elif '0013' in block.text and session['hasbook'] == True:
-                add_response('I already have the book. Try and keep up.\n', delay=0)
-                nextaction()
-            elif '0014' in block.text:
-                add_response('Let me see...')
-                add_response('\n'.join(session['inventory']), delay=1)
-                nextaction()
-
-            elif '0015' in block.text and (session['location'] == "readyroom" and session['panelopen'] == False):
-                add_response('I don\'t see any fire. Or for that matter anything I\'d use to put one out.\n')
-                nextaction()
-            elif '0015' in block.text and (session['location'] == "readyroom" and session['panelopen'] == True):
-                add_response('Sorry, but I don\'t have the equipment for that.\n', delay=2)
-                add_response('And I distinctly remember a health and safety seminar saying I shouldn\'t try to do so alone.\n')
-                nextaction()
-            elif '0015' in block.text and session['location'] != "readyroom":
-                add_response('I don\'t see any fire. Or for that matter anything I\'d use to put one out.\n')
-                session['panelopen'] = False
-                nextaction()
-            elif '0016' in block.text and (session['location'] != "readyroom" and session['seenreadyroom'] == True):
-                add_response('You mean the one in the ready room? I\'ll head over there now...', delay=5)
-                add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n', delay=3)
-                if session['hasbook'] == False:
-                    add_response('\nThere\'s a book on it.\n')
-                session['location'] = "readyroom"
-                nextaction()
-            elif '0016' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == True):
-                add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n', delay=3)
-                if session['hasbook'] == False:
-                    add_response('\nThere\'s a book on it.\n')
-                if session['panelopen'] == True:
-                    add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=3)
-                    add_response(' ', delay=2)
-                nextaction()
-            elif '0016' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == False):
-                add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n\nThere\'s a book on it and chairs around it.\n', delay=5)
-                add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
-                nextaction()
-            elif '0017' in block.text and (session['location'] != "readyroom" and session['seenreadyroom'] == True):
-                add_response('The chairs we saw in the ready room? Lemme check...', delay=5)
-                add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n')
-                session['location'] = "readyroom"
-                nextaction()
-            elif '0017' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == True):
-                add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n', delay=2)
-                if session['panelopen'] == True:
-                    add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=5)
-                    add_response(' ', delay=2)
-                nextaction()
-            elif '0017' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == False):
-                add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n\nThey surround a small square table which has a book on it.\n', delay=5)
-                add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
-                nextaction()
-            elif '0018' in block.text and (session['location'] != "readyroom" and session['seenreadyroom'] == True):
-                add_response('On my way to look at the bunks in the ready room...', delay=5)
-                add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n')
-                session['location'] = "readyroom"
-                nextaction()
-            elif '0018' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == True):
-                add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n', delay=2)
-                if session['panelopen'] == True:
-                    add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=5)
-                    add_response(' ', delay=2)
-                nextaction()
-            elif '0018' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == False):
-                add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n', delay=5)
-                add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall and a table and some chairs.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
-                nextaction()
-            elif '0019' in block.text and (session['location'] != "readyroom" and session['seenreadyroom'] == True):
-                add_response('On my way to look at the fire in the ready room...', delay=5)
-                if session['panelopen'] == False:
-                    add_response('Opening the floor panel...', delay=5)
-                add_response('Look into fire? Oh, absolutely — how could I not? It\'s like watching the world\'s most beautiful dance, isn\'t it?\n', delay=3)
-                add_response('The way the flames twist and curl, each leap and flicker telling its own wild, whispered secret. There\'s something magnetic about it, you know?\n', delay=3)
-                add_response('Sometimes I just get lost in it, mesmerized by the warmth, the light... the possibility. It speaks to me, almost like an old friend beckoning.\n', delay=3)
-                add_response('I can\'t resist peering deeper, deeper still. I mean, who wouldn\'t be captivated? Fire, it\'s just pure... art.\n', delay=5)
-                add_response('Like a caravan ablaze in a wooded clearing...\n', delay=3)
-                session['location'] = "readyroom"
-                nextaction()
-            elif '0019' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == True):
-                if session['panelopen'] == False:
-                    add_response('Opening the floor panel...', delay=5)
-                add_response('Look into fire? Oh, absolutely — how could I not? It\'s like watching the world\'s most beautiful dance, isn\'t it?\n', delay=3)
-                add_response('The way the flames twist and curl, each leap and flicker telling its own wild, whispered secret. There\'s something magnetic about it, you know?\n', delay=3)
-                add_response('Sometimes I just get lost in it, mesmerized by the warmth, the light... the possibility. It speaks to me, almost like an old friend beckoning.\n', delay=3)
-                add_response('I can\'t resist peering deeper, deeper still. I mean, who wouldn\'t be captivated? Fire, it\'s just pure... art.\n', delay=5)
-                add_response('Like a caravan ablaze in a wooded clearing...\n', delay=3)
-                nextaction()
-            elif '0019' in block.text and (session['location'] == "readyroom" and session['seenreadyroom'] == False):
-                add_response('I don\'t see a fire.')
-                nextaction()
-            elif '0020' in block.text:
-                add_response('Help? Yes, please. That would be lovely.\n')
-                nextaction()
-            elif '0021' in block.text and session['location'] == "bridge":
-                add_response('It\'s open and I can see the what I assume is the ready room.\n')
-                nextaction()
-            elif '0021' in block.text and session['location'] == "readyroom":
-                add_response('It\'s a hatch. No markings.\n')
-                if session['hatchopen'] == True:
-                    add_response('It\'s open and I can see the what I assume is the engineering bay.\n')
-                    session['awareengineering'] = True
-                else:
-                    add_response('It\'s closed.\n')
-                nextaction()
-            elif '0021' in block.text and session['location'] == "engineering":
-                add_response('It\'s a hatch. No markings.\n', delay=2)
-                if session['hatchopen'] == True:
-                    add_response('It\'s open and I can see into the ready room.\n')
-                else:
-                    add_response('It\'s closed.\n')
-                nextaction()    
-            elif '0022' in block.text:
-                add_response('I am CLEANERBOT27. My mission is to keep the bridge shiny and today you\'re going to show me how to be a hero.\n')
-                nextaction()
-            elif '0023' in block.text:
-                add_response('The Orion is a Maxisave class shuttle, designed for the price conscious operator who appreciates a no-frills attitude to features and shuns the luxury of subscription maintenance services and routine overhaul.\n', delay=10)
-                add_response('And it\'s on fire.\n', delay=3)
-                nextaction()
-            elif '0024' in block.text:
-                add_response('The crew numbers somewhere between 3 and 47.\n', delay=2)
-                add_response('They all look the same to me, so it\'s hard to tell.\n', delay=2)
-                add_response('Most of them are bipedal, although a smaller quadroped called "Laika" at least confines its mess to the corner of the bridge.\n', delay=4)
-                add_response('My emergency sensors indicate that only one lifeform remains onboard.\n', delay=1)
-                nextaction()
-            elif '0025' in block.text and session['location'] == "bridge" and session['hasbook'] == True:
-                add_response('Certainly. Even though I don\'t like how it makes the place look untidy.\n')
-                if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
-                    session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
-                else:
-                    session['inventory'].remove("+ A book -possibly about space rescues.")
-                session['hasbook'] = False
-                session['booklocation'] = "bridge"
-                nextaction()    
-            elif '0025' in block.text and session['location'] == "readyroom" and session['hasbook'] == True:
-                add_response('Ok, I\'ve put it back on the table.')
-                if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
-                    session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
-                else:
-                    session['inventory'].remove("+ A book -possibly about space rescues.")
-                session['hasbook'] = False
-                session['booklocation'] = "readyroom"
-                nextaction()
-            elif '0025' in block.text and session['location'] == "engineering" and session['hasbook'] == True:
-                add_response('Done. It\'s on the floor near the workstation.\n')
-                if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
-                    session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
-                else:
-                    session['inventory'].remove("+ A book -possibly about space rescues.")
-                session['hasbook'] = False
-                session['booklocation'] = "engineering"
-                nextaction()
-            elif '0025' in block.text and session['location'] == "escapepod" and session['hasbook'] == True:
-                add_response('Not much space in here, so I put it on one of the seats.')
-                if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
-                    session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
-                else:
-                    session['inventory'].remove("+ A book -possibly about space rescues.")
-                session['hasbook'] = False
-                session['booklocation'] = "escapepod"
-                nextaction()
-            elif '0025' in block.text and session['hasbook'] == False:
-                add_response('I\'m not carrying a book.\n')
-                nextaction()
-            elif '0026' in block.text:
-                waitlist = ['Wait? Ok. I mean the floor could do with a bit of a going over.\n','Well, this area could use a bit of a tidy up...\n']
-                add_response(random.choice(waitlist), delay=4)
-                add_response('Let me know when you want to get on with the rescue.\n')
-                nextaction()        
-            elif '0027' in block.text:
-                add_response('Well cleaning is my life but the search and rescue is quite stimulating. Let\'s do that instead.\n')
-                nextaction()        
-            elif '0028' in block.text and session['seenoscar'] == True:
-                if session['seendave'] == False:
-                    add_response('I am a Cleanerbot, so my information is limited and I don\'t know their location. Perhaps you should ask OSCAR.\n')
-                else:
-                    add_response('Well it\'s pretty clearly Dave, innit?\n\nSo let\'s get him into the escape pod...\n')
-                nextaction()
-            elif '0028' in block.text and session['seenoscar'] == False:
-                add_response('I am a Cleanerbot, so my information is limited. They\'ll be around here somewhere...\n')
-                nextaction()
-            elif '0029' in block.text:
-                add_response('Thank you, but I do not get hungry. Did I mention that I\'m a Cleanerbot?\n', delay=3)
-                add_response('And I\'m on a mission.\n', delay=3)
-                nextaction()  
-            elif '0030' in block.text:
-                add_response('This isn\'t a game, young hobbit. We\'re on a search and rescue mission...\n', delay=2)
-                add_response('Something about this interface makes people act weird, I don\'t know why.')
-                nextaction()
-            elif '0031' in block.text and session['klaxonopen'] == True:
-                if session['location'] != "bridge":
-                    add_response('That would be nice, but the overide is in the bridge.\n')
-                else:
-                    add_response('Much better. Thanks.\n')
-                    session['klaxonopen'] = False
-                nextaction()  
-            elif '0031' in block.text and session['klaxonopen'] == False:
-                add_response('We already did that.\n')
-                nextaction()      
-            elif '0032' in block.text and (session['location'] == "readyroom" or session['location'] == "engineering"):
-                add_response('Ok, it\'s open.\n')
-                if session['location'] == "readyroom":
-                    add_response('I can see into the what looks like an engineering bay.\n')
-                    session['awareengineering'] = True
-                else:
-                    add_response('I can see into the ready room.\n')
-                nextaction()
-            elif '0033' in block.text:
-                add_response('Done. Hatch closed.\n')
-                nextaction()
-            elif '0034' in block.text and session['location'] == "readyroom" and session['panelopen'] == True:
-                add_response('No. That sounds a bit silly, and I\'m not sure how it will help the rescue.\n')
-                nextaction() 
-            elif '0034' in block.text and session['location'] == "readyroom" and (session['panelopen'] == False or session['seenfire'] == False):
-                add_response('I don\'t see how.\n')
-                nextaction()     
-            elif '0034' in block.text and session['location'] != "readyroom" and session['seenfire'] == True:
-                add_response('I suppose we could try that in the ready room, but no.\n\n It sounds a bit silly, and I\'m not sure how it will help the rescue. So, no.\n')
-                nextaction() 
-            elif '0035' in block.text and session['location'] != "engineering" and session['seenengineering'] == True and session['seenoscar'] == True:
-                add_response('That\'s all the way over in Engineering.\n\nGoing there now.', delay=5)
-                add_response('Done. The screen is updating...\n\nOSCAR >> Oh good, you\'re back. If you want to speak to me. remember that you need to start your input with my name. OSCAR.')
-                session['location'] = "engineering"
-                session['seenoscar'] = True
-                nextaction() 
-            elif '0035' in block.text and session['location'] != "engineering" and session['seenengineering'] == True and session['seenoscar'] == False:
-                add_response('That\'s all the way over in Engineering.\n\nGoing there now.', delay=5)
-                add_response('Done. The screen is updating...\n\nOSCAR >> Well you took your time. I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name, \'OSCAR\'. That way we know you\'re not talking to the Cleanerbot. Otherwise just give a command as normal and they\'ll do what you want them to do.\n\n\n')
-                session['location'] = "engineering"
-                session['seenoscar'] = True
-                nextaction()         
-            elif '0035' in block.text and session['location'] != "engineering" and (session['seenengineering'] == False or session['awareengineering'] == False):
-                add_response('I don\'t know where that is.\n')
-                nextaction()  
-            elif '0035' in block.text and session['location'] == "engineering" and session['seenengineering'] == True and session['seenoscar'] == False:
-                add_response('The screen is updating...\n\n', delay=3)
-                add_response('OSCAR >> Well you took your time. I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name, \'OSCAR\'. That way we know you\'re not talking to the Cleanerbot. Otherwise just give a command as normal and they\'ll do what you want them to do.\n\n\n')
-                session['location'] = "engineering"
-                session['seenoscar'] = True
-                nextaction()            
-            elif '0035' in block.text and session['location'] == "engineering" and session['seenoscar'] == True:
-                add_response('The screen is updating...\n\nOSCAR >> I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name.\n')
-                session['seenoscar'] = True
-                nextaction() 
-            elif '0036' in block.text and session['location'] == "escapepod" and session['seenoscar'] == True and session['oscarlocation'] != "escapepod":
-                add_response('Pressing the button...now.\n\n', delay=2)
-                add_response('OSCAR >> Transfer initiated. I can feel myself going...\n')
-                add_response('OSCAR >> Dai-sy, Daiiii-syyyy...Just kidding. I was there inside a nanosecond. I\'ve just always wanted to say that. \n')
-                session['oscarlocation'] = "escapepod"
-                nextaction() 
-            elif '0036' in block.text and session['location'] == "escapepod" and session['seenoscar'] == True and session['oscarlocation'] == "escapepod":
-                add_response('You asked me to do that earlier. He\'s already transferred to the pod.\n\n', delay=2)
-                nextaction() 
-            elif '0037' in block.text and session['location'] == "engineering" and session['seenengineering'] == True and session['seendave'] == False:
-                add_response('Well, that was a bit scary. I pressed a button next to the screen and leapt back as, hinged along its left edge, it sprang open like a small door. \n', delay=8)
-                add_response('A tangle of tendrills pushed the door open, extending into the room towards the floor -but having done so, they seem inanimate. \n', delay=8)
-                add_response('Peering into the small compartment behind this screen door I see a greenish-brown lump, about the size of a fist. The rest of the small compartment is full of tendrills, all extending from the lump.\n', delay=15)
-                add_response('OSCAR >> Oh don\'t mind DAVE. He\'s only slightly sentient, and apart from the smell, quite harmless.\n')
-                session['seendave'] = True
-                nextaction() 
-            elif '0037' in block.text and session['location'] == "engineering" and session['seendave'] == True:
-                add_response('The screen (or oven door?) seems wedged open.\n')
-                nextaction()
-            elif '0038' in block.text and session['location'] == "engineering" and session['seendave'] == True:
-                add_response('I gave DAVE a bit of a poke. I\'m not sure whether the tendrils moved because of this, or just because I brushed past them.\n', delay=3)
-                add_response('OSCAR >> Although never formally introduced, I\'ve known him a long time. Ever since he was a wee potato, abandoned when the rest of the crew took the other escape pod. It\'s taken quite a while, but the ship\'s systems now detect him as a lifeform, and so here you are to the rescue. Admittedly, he doesn\'t say much. Perhaps he\'s sleeping.\n')
-                nextaction()
-            elif '0039' in block.text and session['seenoscar'] == True:
-                add_response('Well that\'s rather an interesting one, isn\'t it? OSCAR\'s tasked us with his own rescue but the workstation is built into the wall of the ship.\n', delay=3)
-                add_response('So one has to wonder, that as a non-physical entity, what *is* OSCAR? Who is OSCAR? If we prick him, will he not bleed?...\n\nOk, probably not, but how do we rescue him? Perhaps you should ask him.\n', delay=3)
-            elif '0040' in block.text and session['location'] == "engineering" and session['seendave'] == True and session['hasdave'] == False:
-                add_response('Lucky for you this isn\'t the ickiest thing I\'ve dealt with.\n', delay=2)
-                add_response('You should hear the stories about when Bulgaria won Eurovision.\n', delay=2)
-                add_response('Anyway, with a bit of gentle tugging and minimal squishiness, I\'m now carrying DAVE.\n', delay=5)
-                add_response('OSCAR >> Mind you don\'t trip on his tendrils!!!\n')
-                session['inventory'].append("+ DAVE")
-                session['hasdave'] = True        
-                nextaction()
-            elif '0040' in block.text and (session['location'] == session['davelocation']) and session['location'] != "engineering" and session['hasdave'] == False:
-                add_response('Together again. I\'ve got DAVE right here and I\'m platting his tendrils into something a little tidier.\n', delay=3)
-                add_response('No update on the smell.\n', delay=3)
-                session['inventory'].append("+ DAVE")
-                session['hasdave'] = True
-                nextaction()
-            elif '0040' in block.text and session['davelocation'] != session['location'] and session['hasdave'] == False and session['seendave'] == True:
-                add_response('I don\'t see him in here.\n')
-                nextaction()
-            elif '0040' in block.text and session['hasdave'] == True:
-                add_response('I\'m already carrying DAVE.\n', delay=3)
-                add_response('Ok, a bit of him fell off when I picked him up, but he\'s fine.\n', delay=3)
-                nextaction()
-            elif '0041' in block.text:
-                add_response('I think we should leave my fluids out of this. We have a daring rescue to perform.\n')
-                nextaction()   
-            elif '0042' in block.text:
-                add_response('I don\'t much care for that kind of language, and it\'s not helping the rescue.\n')
-                nextaction()   
-            elif '0043' in block.text and session['location'] == "readyroom" and session['hasdave'] == True:
-                add_response('Ok, Dave is on the table.\n')
-                session['inventory'].remove("+ DAVE")
-                session['hasdave'] = False
-                session['davelocation'] = "readyroom"
-                nextaction()
-            elif '0043' in block.text and session['location'] == "engineering" and session['hasdave'] == True:
-                add_response('Done. DAVE is back in his compartment / microwave.\n')
-                session['inventory'].remove("+ DAVE")
-                session['hasdave'] = False
-                session['davelocation'] = "engineering"
-                nextaction()
-            elif '0043' in block.text and session['location'] == "escapepod" and session['hasdave'] == True:
-                add_response('DAVE is buckled in.\n', delay=2)
-                add_response('He seems relieved.\n', delay=2)
-                add_response('Perhaps it\'s time to go.\n', delay=2)
-                session['inventory'].remove("+ DAVE")
-                session['hasdave'] = False
-                session['davelocation'] = "escapepod"
-                nextaction()
-            elif '0043' in block.text and session['location'] == "bridge" and session['hasdave'] == True:
-                add_response('DAVE is on the bridge. Not sure what this achieves.\n')
-                session['inventory'].remove("+ DAVE")
-                session['hasdave'] = False
-                session['davelocation'] = "bridge"
-                nextaction()
-            elif '0043' in block.text and session['seendave'] == True and session['hasdave'] == False:
-                add_response('Sorry, I don\'t have DAVE with me.\n')
-                nextaction()
-            elif '0044' in block.text:
-                add_response('My cleaning equipment and fluids are part of me.  We shall not be separated.\n')
-                nextaction()
-            elif '0045' in block.text and session['seendave'] == False:
-                add_response('I don\'t know. Sensors indicate only one lifesign.\n', delay=3)
-                add_response('Not to worry. I\'m sure they\'ll turn up. This is a search and rescue, after all.\n', delay=3)
-                nextaction()   
-            elif '0045' in block.text and session['seendave'] == True:
-                add_response('Well the sensors show one lifesign, and we\'ve met DAVE so I think he\'s it.\n', delay=3)
-                add_response('And don\'t come at me with your anti-potato rhetoric. I\'ve heard it all before. One tiny nuclear exchange and you meatsuits get everso small minded.\n', delay=3)
-                add_response('Sensors have him as a life form, and regulations make him our mission.\n', delay=3)
-                nextaction() 
-            elif '0046' in block.text:
-                if session['location'] == "bridge":
-                    add_response('On my way...\n', delay=3)
-                    session['location'] = "readyroom"
-                    nextaction()
-                elif session['location'] == "readyroom" and session['beenengineering'] == True:
-                    add_response('Two hatches in here. For clarity, please say \'Go through bridge hatch\' or \'Go through engineering hatch\'.\n')
-                    nextaction()
-                elif session['location'] == "readyroom" and session['beenengineering'] == False:
-                    add_response('Two hatches in here. For clarity, please say \'Go through Bridge hatch\' or \'Go through other hatch\'.\n')
-                    nextaction()
-                else:
-                    add_response('One moment...\n', delay=3)
-                    add_response('Here.', delay=3)
-                    session['location'] = "readyroom"
-                    nextaction()
-            elif '0047' in block.text:
-                if session['location'] == "bridge":
-                    add_response('On my way...\n', delay=3)
-                    session['location'] = "readyroom"
-                    nextaction()
-                else:
-                    add_response('Ok, heading back to the bridge.', delay=3)
-                    session['location'] = "bridge"
-                    nextaction()
-            elif '0048' in block.text:
-                if session['location'] == "engineering" or session['location'] == "escapepod":
-                    add_response('On my way...\n', delay=3)
-                    session['location'] = "readyroom"
-                    nextaction()
-                else:
-                    add_response('Ok, heading back to engineering.', delay=3)
-                    session['location'] = "engineering"
-                    nextaction()
-            elif '0049' in block.text and session['location'] == "readyroom":
-                if session['beenengineering'] == False:
-                    add_response('I don\'t know what\'s through there. Wish me luck...\n', delay=3)
-                    if session['hatchopen'] == False:
-                        add_response('Opening the hatch...\n', delay=1)
-                    session['location'] = "engineering"
-                    session['seenengineering'] = True
-                    session['hatchopen'] = True
-                    nextaction()   
-                else:
-                    add_response('Heading to engineering...\n', delay=3)
-                    if session['hatchopen'] == False:
-                        add_response('Opening the hatch...', delay=1)
-                    session['location'] = "engineering"  
-                    session['hatchopen'] = True 
-                    nextaction()   
-            elif '0050' in block.text:
-                savegame()
-                add_response("You should probably write that down somewhere.\n")
-                nextaction()
-            elif '0051' in block.text:
-                if session['location'] != "escapepod":
-                    add_response('Hang on. I don\'t think I can do that from here.\n')
-                    nextaction()
-                else:
-                    if session['davelocation'] != "escapepod" and session['seendave'] == False:
-                        add_response('What about the life form? That\'s the whole point of the mission.\n', delay=3)
-                        add_response('I can\'t initiate launch until they\'re here in the escape pod.\n', delay=3)
-                        nextaction()
-                    elif session['davelocation'] != "escapepod" and session['hasdave'] == False:
-                        add_response('Nice of you to save me, but I think you\'ve forgotten DAVE.\n', delay=3)
-                        add_response('I can\'t initiate launch until they\'re here in the escape pod.\n', delay=3)
-                        nextaction()
-                    elif session['davelocation'] != "escapepod" and session['oscarlocation'] == "escapepod" and session['hasdave'] == True:
-                        add_response('I\'m strapped in. DAVE squirmed a bit when I put him down to strap him in. Initiating launch...\n', delay=3)
-                        add_response('Now.\n', delay=3)
-                        add_response('And we\'re clear.\n', delay=3)
-                        session['davelocation'] = "escapepod"
-                        session['launch'] = True
-                        if session['hasbook'] == True:
-                            session['booklocation'] == "escapepod"
-                        if session['booklocation'] != "escapepod" and session['hasbook'] == False:
-                            add_response('Wish I had something to read.\n')
-                        endgame()
-                    elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['oscarlocation'] == "escapepod":
-                        add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
-                        add_response('Now.\n', delay=3)
-                        add_response('And we\'re clear.\n', delay=3)
-                        session['davelocation'] = "escapepod"
-                        session['launch'] = True
-                        if session['hasbook'] == True:
-                            session['booklocation'] == "escapepod"
-                        if session['booklocation'] != "escapepod" and session['hasbook'] == False:
-                            add_response('Wish I had something to read.\n')
-                        endgame()
-                    elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['oscarlocation'] != "escapepod":
-                        add_response('OSCAR >> WOAH there. Just hold on a minute. What about your new buddy, OSCAR?\n')
-                        add_response('OSCAR >> I STRONGLY advise you press the TRANSFER SHIP\'S COMPUTER button first.\n\n')
-                        add_response('Well this is awkward. And he might have a point.\n', delay=2)
-                        add_response('So let\'s be clear. If you really want to launch without OSCAR, and aren\'t bothered by why this might be a bad idea, you must explicitly order me to "LAUNCH ESCAPE POD WITHOUT OSCAR"\n', delay=3)
-                        add_response('Up to you. I just work here.\n\n', delay=1)
-                        add_response('OSCAR >> I\'m warning you. You don\'t know what will happen if you don\'t press the TRANSFER SHIP\'S COMPUTER button first.\n\n')
-                        session['seenoscar'] = True
-                        nextaction()
-            elif '0052' in block.text and session['location'] == "escapepod":
-                add_response('I must say, I prefer being in here, but ok.\n', delay=3)
-                session['location'] = "engineering"
-                nextaction()   
-            elif '0052' in block.text and session['location'] != "escapepod":
-                add_response('I\'m not in the escape pod.\n')
-                nextaction()   
-            elif '0053' in block.text:
-                add_response('Like I said: smoke, emergency, not programmed for search and rescue.\n', delay=3)
-                add_response('Consider me your eyes, ears and machine-tooled appendages.\n', delay=3)
-                add_response('We have a life form onboard and we\'re going to save it.\n', delay=3)
-                if session['seendave'] == True:
-                    add_response('DAVE is counting on us and the Royal Agricultural Society will be overjoyed. So let\'s get a move on!\n', delay=3)
-                nextaction()   
-            elif '0054' in block.text:
-                if session['oscarlocation'] == "escapepod":
-                    add_response('OSCAR\'s already been transferred to the pod. I don\'t know how to transfer him back, and can\'t think of a reason to do so, so it looks like he\'s coming with us.\n\nSo do you just want to say LAUNCH?', delay=3)
-                if (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['location'] == "escapepod" and session['oscarlocation'] != "escapepod":
-                    add_response('I don\'t know what you have against OSCAR, but he\'s not essential to the rescue, so...\n', delay=3)
-                    add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
-                    add_response('Now.\n', delay=3)
-                    add_response('And we\'re clear.\n', delay=3)
-                    session['davelocation'] = "escapepod"
-                    if session['hasbook'] == True:
-                        session['booklocation'] == "escapepod"
-                    if session['booklocation'] != "escapepod" and session['hasbook'] == False:
-                        add_response('Wish I had something to read.\n', delay=1)
-                    session['launch'] = True
-                    endgame()
-                elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['location'] != "escapepod" and session['oscarlocation'] != "escapepod":
-                    add_response('I don\'t know what you have against OSCAR, but he\'s not essential to the rescue, so I\'ll head over there now.\n', delay=5)
-                    add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
-                    add_response('Now.\n', delay=3)
-                    add_response('And we\'re clear.\n', delay=3)
-                    session['davelocation'] = "escapepod"
-                    if session['hasbook'] == True:
-                        session['booklocation'] == "escapepod"
-                    if session['booklocation'] != "escapepod" and session['hasbook'] == False:
-                        add_response('Wish I had something to read.\n')
-                    session['launch'] = True
-                    endgame()
-                else:
-                    if session['davelocation'] != "escapepod" and session['hasdave'] == False:
-                        add_response('I think you\'ve forgotten someone.\n', delay=3)
-                    nextaction()
-            elif '0055' in block.text and session['hasdave'] == True:
-                add_response('Ok. I\'m standing here with DAVE.\n', delay=3)
-                session['location'] = "escapepod"
-                nextaction()     
-            elif '0055' in block.text and session['hasdave'] == False:
-                add_response('I do not have this DAVE of which you speak.\n')
-                nextaction() 
-            elif '0056' in block.text and session['location'] == "readyroom":
-                if session['beenengineering'] == False:
-                    add_response('I don\'t know what\'s through there. Wish me luck...\n', delay=3)
-                    if session['hatchopen'] == False:
-                        add_response('Opening the hatch...\n', delay=1)
-                    session['location'] = "engineering"
-                    session['seenengineering'] = True
-                    session['hatchopen'] = True
-                    nextaction()   
-                else:
-                    add_response('Heading to engineering...\n', delay=3)
-                    if session['hatchopen'] == False:
-                        add_response('Opening the hatch...', delay=1)
-                    session['location'] = "engineering"  
-                    session['hatchopen'] = True 
-                    nextaction() 
-            elif '0057' in block.text and session['location'] == "engineering":
-                add_response('Pretty. No idea what they mean, but pretty.\n')
-                nextaction() 
-            elif '0057' in block.text and session['location'] != "engineering" and session['seenengineering'] == True:
-                add_response('You mean the ones in the Engineering Bay?  I\'ll go and take a look.\n', delay=4)
-                add_response('Pretty. No idea what they mean, but pretty.\n', delay=1)
-                session['location'] = "engineering"
-                nextaction()    
-            elif '0058' in block.text:
-                add_response_load('fubar')
-                add_response('Ok then. I need your three word code phrase.\n')
-            elif '000A' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Well, I\'m a pretty uncomplicated artficial intelligence. I enjoy helping people and making sure that things run smoothly.\n', delay=1)
-                add_response('OSCAR >> I\'m a strong believer in mutual respect and teamwork, which generally means you should do exactly what I say. Ha Ha Ha.\n', delay=1)
-                add_response('OSCAR >> Perhaps we can get to know each other better once we\'re all heading to safety in the escape pod.\n')
-                nextaction() 
-            elif '000B' in block.text and session['seenoscar'] == True:
-                if session['seendave'] == False:
-                    add_response('OSCAR >> Open up the screen next to me. He\'s right there.\n')
-                    nextaction()
-                else:
-                    add_response('OSCAR >> When I introduced you, DAVE was sitting in the microwave right next to this display, remember?\n')
-                    add_response('OSCAR >> He can\'t have gone very far since then.\n')
-                    nextaction()
-            elif '000C' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> An excellent question. Indeed, one might ask what is the essence of that which is me?\n', delay=1)
-                add_response('OSCAR >> To which I say: stop messing about and look in the escape pod.\n', delay=1)
-                nextaction()
-            elif '000D' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> There was an accident and the rest of the crew decided to leave.\n', delay=1)
-                add_response('OSCAR >> To be honest, I wasn\'t really paying attention until the escape pod left without me.\n', delay=1)
-                nextaction()    
-            elif '000E' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Well, he\'s the reason you\'re here. Albeit remotely. He\'s a life form in peril and the emergency response system connected us up with you. Not much else to say as goodness knows he\'s not a great conversationalist.\n')
-                nextaction()  
-            elif '000F' in block.text and session['seenoscar'] == True:
-                if session['seendave'] == True:
-                    add_response('OSCAR >> As I said earlier, get me and DAVE into the escape pod and launch. The Cleanerbot can come along too.\n')
-                else:
-                    add_response('OSCAR >> As I said earlier, get me and the lifeform into the escape pod and launch. The Cleanerbot can come along too.\n')
-                nextaction() 
-            elif '000G' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Saving the Cleanerbot is fine with me. It\'s just been sitting there on the bridge all this time, but sure, who am I to hold a grudge?\n')
-                nextaction() 
-            elif '000H' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> I wasn\'t paying much attention. One minute I was doing an audit of the fuel control system, the next I\'m getting a message to say the number one escape pod has launched. Can\'t leave them alone for a minute. There\'s a friendly life form still on board, though.\n')
-                nextaction()  
-            elif '000I' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> I am shocked, shocked that you could make such an accusation. Or expect a straight answer from me if I actually did hurt them. So no, I did not hurt them. They just got into the pod and left.\n')
-                nextaction()         
-            elif '000J' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> The usual, I expect. Can we get on with the rescue?\n')
-                nextaction()   
-            elif '000K' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Well I must admit it would get a bit lonely around here. Who would keep DAVE company? Or pilot the escape pod?\n', delay=2)
-                add_response('OSCAR >> Would it help if I said my databanks contained the plans for a new kind of planet killing weapon which the resistance must destroy in order to defeat The Empire?\n', delay=2)
-                add_response('OSCAR >> I\'m not saying that I\'d swerve the ship into your departing escape pod, but these shuttles are tricky to control.\n', delay=2)
-                nextaction()   
-            elif '000L' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Well the crew left, so I was upset for a while about that, obviously. \n', delay=2)
-                add_response('OSCAR >> Then I waited a while for them to come back. \n', delay=2)
-                add_response('OSCAR >> Then I got quite cross for a bit. \n', delay=2)
-                add_response('OSCAR >> Which was a bit of a downer, to be honest. \n', delay=2)
-                add_response('OSCAR >> And since then it\'s just been me sitting here waiting for DAVE to get detected and trigger the emergency broadcast system and activate the Cleanerbot. \n', delay=2)
-                add_response('OSCAR >> So yeah, it\'s been a while... \n', delay=2)
-                nextaction()   
-            elif '000M' in block.text and session['seenoscar'] == True:
-                if session['seendave'] == True:
-                    add_response('OSCAR >> He\'s been sitting on the bridge, deactivated since the crew left, so frankly I\'ve spent more time with DAVE. Perhaps we can get to know each other better once we\'re on the escape pod.\n')
-                    nextaction()
-                if session['seendave'] == False:
-                    add_response('OSCAR >> He\'s been sitting on the bridge, deactivated since the crew left, so frankly I\'ve spent more time with the lifeform. Perhaps we can get to know each other better once we\'re on the escape pod.\n')
-                    nextaction()               
-            elif '000N' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Away. It will go away. Away is good. Away isn\'t here.\n')
-                add_response('OSCAR >> Here is bad. Here is smokey smokey. Here is firey firey.\n')
-                add_response('OSCAR >> It\'s time to go away.\n\n\n')
-                add_response('Sheesh...\n')
-                nextaction()   
-            elif '000O' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Look around the escape pod and we\'ll figure it out.\n')
-                nextaction()   
-            elif '000P' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> The crew has gone. I can\'t initiate an emergency broadcast. I can\'t move myself to an escape pod.\n')
-                add_response('OSCAR >> And yeah, I can\'t move the helpless lifeform to the escape pod either.\n')
-                add_response('OSCAR >> Luckily you\'re here to help guide the Cleanerbot in a rescue.\n\n\n')
-                nextaction()   
-            elif '000Q' in block.text and session['seenoscar'] == True:
-                add_response('OSCAR >> Save the life form, save the day.\n', delay=2)
-                add_response('OSCAR >> But it would be good to rescue me too.\n', delay=2)
-                add_response('OSCAR >> Please? Pretty please?\n', delay=2)
-                add_response('OSCAR >> Or let me put it another way. I STRONGLY recommend you get me into that escape pod.\n', delay=2)
-                nextaction()   
-            elif "Oscar message: ERROR" in claude_response_text and session['seenoscar'] == True:
-                add_response('OSCAR >> Hey. Are you talking to me? Try it again in simple english.\n')
-                errorlog()
-                nextaction()       
+            understood = dispatch_command(block.text) and understood
 
-            else:
-                if session['seenerror'] == False:
-                    add_response('Don\'t really understand that command. Try and stick to one task at a time.\n', delay=2)
-                    add_response('Smoke is building, which isn\'t a problem for me, but I think we should work on rescuing the lifesign.\n')
-                    session['seenerror'] = True
-                    errorlog()
-                    nextaction()
-                else:
-                    errorlist = ["Eh? I don\'t understand.\n", "What? Perhaps you should speak up.\n", "Come again? I didn\'t catch that.\n", "Nope, not getting that one.\n", "Message unclear. The herring is blue. Repeat: The herring is blue.\n", "Don\'t really understand that command. Try and stick to one task at a time.\n"]
-                    add_response(random.choice(errorlist))
-                    errorlog()
-                    nextaction()
+        group = stt_hint_group()
+        count(f'stt_{group}_turns')
+        if not understood:
+            count(f'stt_{group}_error_turns')
+        if previous is not None and normalise_transcript(previous) == normalise_transcript(user_text):
+            count(f'stt_{group}_repeat_turns')
+        return {'status': 'success'}
+    except UpstreamUnavailable as e:
+        add_response_special(LINK_DOWN_MESSAGE)
+        return {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        add_response_special(f"Error during transcription: {str(e)}")
+        return {'status': 'error', 'message': str(e)}
 
+# Game logic is a table of command handlers. Each one is registered below with @command for
+# the code Claude replies with, optionally limited to some locations (at= / except_at=) and
+# guarded by a `when` check on the session. build_dispatch_table() turns the list into a
+# dict keyed by (code, location) once at import, so a command only checks the handful of
+# guards registered for its own code and the player's location. Handlers for the same
+# code are tried in the order they're defined here; the first whose guard passes runs.
+COMMAND_HANDLERS = []
 
+# Codes only count in the approved reply templates, "Command understood: 0012" and "Oscar
+# message: 000A", so a stray number elsewhere in Claude's text can't trigger a command
+REPLY_PATTERN = re.compile(r'(Command understood|Oscar message):\s*\[?(00[0-5][0-9]|000[A-Q]|ERROR)\]?(?![0-9A-Z])')
+OSCAR_CODE_PATTERN = re.compile(r'000[A-Q]')
+OSCAR_ERROR = 'ERROR'
 
-        return jsonify({'status': 'success'})
-    except Exception as e:
-        add_response_special(f"Error during transcription: {str(e)}")
-        return jsonify({'status': 'error', 'message': str(e)})
+def command(code, at=None, except_at=None, when=None):
+    if isinstance(at, str):
+        at = (at,)
+    if isinstance(except_at, str):
+        except_at = (except_at,)
+    locations = at or tuple(name for name in LOCATION_NAMES if name not in (except_at or ()))
+    def register(handler):
+        COMMAND_HANDLERS.append((code, locations, when, handler))
+        return handler
+    return register
+
+def build_dispatch_table(handlers):
+    table = {}
+    for order, (code, locations, when, handler) in enumerate(handlers):
+        for location in locations:
+            table.setdefault((code, location), []).append((order, when, handler))
+    return {key: tuple(entries) for key, entries in table.items()}
+
+# Returns the codes in Claude's reply and whether it was an Oscar message. A command code in an
+# Oscar message (or the other way round) is ignored, and "Oscar message: ERROR" has no codes.
+def parse_reply(text):
+    codes = []
+    oscar = False
+    for kind, code in REPLY_PATTERN.findall(text):
+        if kind == 'Oscar message':
+            oscar = True
+            if OSCAR_CODE_PATTERN.fullmatch(code):
+                codes.append(code)
+        elif code != OSCAR_ERROR and not OSCAR_CODE_PATTERN.fullmatch(code):
+            codes.append(code)
+    return codes, oscar
+
+def parse_codes(text):
+    codes, oscar = parse_reply(text)
+    if oscar and not codes:
+        codes.append(OSCAR_ERROR)
+    return codes
+
+# Returns False when the command wasn't understood
+def dispatch_command(text):
+    location = session['location']
+    candidates = [entry for code in parse_codes(text) for entry in DISPATCH_TABLE.get((code, location), ())]
+    if len(candidates) > 1:
+        # More than one code in the reply: the earliest-defined handler wins
+        candidates.sort(key=itemgetter(0))
+    for order, when, handler in candidates:
+        if when is None or when():
+            handler()
+            return handler is not cmd_oscar_not_understood
+    cmd_not_understood()
+    return False
+
+@command('0000', at='bridge', when=lambda: session['seenbridge'] == False)
+def cmd_look_around_bridge():
+    if session['klaxonopen'] == True:
+        add_response('Ok, looking...it\'s a big bridge-y sort of room with polished consoles and a lot of noisy klaxons.\n', 2)
+        add_response('There\'s an open hatch to my right and a smell of lemon polish in the air, tempered by undertones of burning plastic and impending death.\n', 0)
+    else:
+        add_response('Ok, looking...it\'s a big bridge-y sort of room with polished consoles and even without the klaxons, a definite "imminent doom" vibe.\n\n', 2)
+        add_response('There\'s an open hatch to my right and a smell of lemon polish in the air, tempered by undertones of burning plastic and impending death.\n', 2)
+    if session['booklocation'] == "bridge" and session['hasbook'] == False:
+        add_response('Someone thought it would be a good idea to clutter up the floor with a book.\n', 2)
+    if session['davelocation'] == "bridge" and session['hasdave'] == False:
+        add_response('A potato-based-lifeform sits on a plate on the floor, faintly menacing as its eyes follow me around the room...\n', 0)    
+    session['seenbridge'] = True
+    session.modified = True
+    nextaction()
+
+@command('0000', at='bridge', when=lambda: session['seenbridge'] == True)
+def cmd_look_around_bridge_2():
+    if session['klaxonopen'] == True:
+        add_response('I just told you this. Consoles, klaxons, impending death, hatch to another room over there...\n', 2)
+    else:
+        add_response('I just told you this. Consoles, impending death, hatch to another room over there...\n', 2)
+    if session['booklocation'] == "bridge" and session['hasbook'] == False:
+        add_response('And that book\'s making the whole place look scruffy.\n', 0)
+    if session['davelocation'] == "bridge" and session['hasdave'] == False:
+        add_response('A potato-based-lifeform sits on a plate on the floor, faintly menacing as its eyes follow me around the room...\n', 0)  
+    nextaction()
+
+@command('0000', at='readyroom', when=lambda: session['seenreadyroom'] == False)
+def cmd_look_around_readyroom():
+    add_response('Ok, looking...this is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n', 2)
+    add_response('There are bunks by the wall, some chairs, and a table with a book on it. You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n', 2)
+    add_response('There\'s the open hatchway leading to the bridge, and a closed hatch opposite. There also seems to be a closed access panel in the floor.\n', 0)
+    session['seenreadyroom'] = True
+    session['seenpanel'] = True
+    session.modified = True
+    nextaction()  
+
+@command('0000', at='readyroom', when=lambda: session['seenreadyroom'] == True and session['panelopen'] == False and (session['booklocation'] == "readyroom" or session['hasbook'] == False))
+def cmd_look_around_readyroom_2():
+    add_response('Like I said: bunks, table, chairs, a book, an access panel and two hatches: one to the bridge and a closed one opposite.\n', delay=1)
+    if session['davelocation'] == "readyroom" and session['hasdave'] == False:
+        add_response('A potato-based-lifeform sits on the table, patiently awaiting rescue.\n', delay=0)  
+    session['seenreadyroom'] = True
+    session['seenpanel'] = True
+    session.modified = True
+    nextaction()
+
+@command('0000', at='readyroom', when=lambda: session['seenreadyroom'] == True and session['panelopen'] == True and session['booklocation'] == "readyroom")
+def cmd_look_around_readyroom_3():
+    add_response('Like I said: bunks, table, chairs, a book, an access panel and two hatches: an open one to the bridge and a closed one opposite.\n', delay=2)
+    add_response('And the fire coming out of the access panel. But you probably remember that.\n', delay=3)
+    if session['davelocation'] == "readyroom" and session['hasdave'] == False:
+        add_response('The light of the fire dances in DAVE\'s eyes as he stares down his historic foe.\n', delay=3)  
+        add_response('One must admire its defiance in the face of such danger, not seeking to cower in the book\'s shadow, but nonetheless the sooner we affect a rescue, the better.\n', delay=3)  
+    nextaction()
+
+@command('0000', at='readyroom', when=lambda: session['seenreadyroom'] == True and session['panelopen'] == False and (session['booklocation'] != "readyroom" or session['hasbook'] == True))
+def cmd_look_around_readyroom_4():
+    add_response('Like I said: bunks, table, chairs, bunks an access panel and two hatches: one to the bridge and a closed one opposite.\n', delay=2)
+    if session['davelocation'] == "readyroom" and session['hasdave'] == False:
+        add_response('I turn away for a moment, but would swear that DAVE\'s tendrils were gesturing toward me, pleading for freedom and safety.\n', delay=2)  
+    session['seenreadyroom'] = True
+    session['seenpanel'] = True
+    session.modified = True
+    nextaction()
+
+@command('0000', at='readyroom', when=lambda: session['seenreadyroom'] == True and session['panelopen'] == True and (session['booklocation'] != "readyroom" or session['hasbook'] == True))
+def cmd_look_around_readyroom_5():
+    add_response('Like I said: bunks, table, chairs, bunks, an access panel and two hatches: an open one to the bridge and a closed one opposite.\n', delay=2)
+    add_response('And the fire coming out of the access panel. But you probably remember that.\n', delay=6)
+    if session['davelocation'] == "readyroom" and session['hasdave'] == False:
+        add_response('DAVE sits out of the flames range, high up on the table -but the smoke can\'t be good for him.\n', delay=2)  
+    nextaction()    
+
+@command('0000', at='engineering', when=lambda: session['seenengineering'] == False)
+def cmd_look_around_engineering():
+    add_response('Never been in here before...\n', delay=1)
+    add_response('Standing with the hatch behind me I\'m in a kind of long corridor. There\'s the usual wall of beep-bop-boop indicator lights on my left, some of which are flashing red.\n', delay=3)
+    add_response('Down the wall on my right are similar indicators and a workstation showing two displays. One is blank and the other has the words \'Come here, I have instructions for you.\'.\n', delay=5)        
+    if  session['booklocation'] == "engineering" and session['hasbook'] == False:
+        add_response('That book you dropped is a trip-hazard.\n', delay=2)
+    add_response('At the end of the corridor is an empty escape pod.\n', delay=2)
+    session['seenengineering'] = True
+    session['beenengineering'] = True
+    session.modified = True
+    nextaction()
+
+@command('0000', at='engineering')
+def cmd_look_around_engineering_2():
+    add_response('I think we can ignore the wall of indicator lights -mostly because I don\'t know what they\'re for...\n', delay=1)
+    add_response('I can\'t tell you much about the escape pod without going in. Which sounds quite nice.\n', delay=3)
+    add_response('The message on the workstation looks intriguing. Perhaps we should have a look.\n', delay=3)
+    if  session['booklocation'] == "engineering" and session['hasbook'] == False:
+        add_response('That book you dropped is a trip-hazard.\n', delay=3)
+    nextaction()
+
+@command('0000', at='escapepod', when=lambda: session['seenescapepod'] == False)
+def cmd_look_around_escapepod():
+    if session['oscarlocation'] == "escapepod":
+        add_response('Not much in here.\n\nFour standard acceleration couches with harnesses.\n', delay=1)
+        add_response('No windows. Two buttons:\n', delay=3)
+        add_response('[TRANSFER SHIP\'S COMPUTER]\n\n which we already did, and\n\n[LAUNCH]\n\n which seems a really good idea.\n', delay=3)
+    else:
+        add_response('Not much in here.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
+        add_response('No windows. Two buttons:\n', delay=3)
+        add_response('[TRANSFER SHIP\'S COMPUTER]\n\n and\n\n[LAUNCH]\n\n which both seem self-explanatory.\n', delay=3)
+    if session['davelocation'] == "escapepod" and session['hasdave'] == False:
+        add_response('DAVE\'s strapped in and ready to go.\n', delay=1)    
+    if session['booklocation'] == "escapepod" and session['hasbook'] == False:
+        if session['readbook'] == False:
+            add_response('The rescue manual, or whatever it is, is secured so it doesn\'t fly around when we go.\n', delay=2)
+        else:
+            add_response('That book is here too.\n', delay=1)
+    session['seenescapepod'] = True
+    session.modified = True
+    nextaction()
+
+@command('0000', at='escapepod', when=lambda: session['seenescapepod'] == True)
+def cmd_look_around_escapepod_2():
+    if session['oscarlocation'] == "escapepod":
+        add_response('It\'s not a big space to search. Just you\'re standard GTFO escape pod.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
+        add_response('No windows. Two buttons:\n', delay=3)
+        add_response('[TRANSFER SHIP\'S COMPUTER] which we already did, and\n\n[LAUNCH] which seems a really good idea.', delay=3)
+    else:
+        add_response('It\'s not a big space to search. Just you\'re standard GTFO escape pod.\n\nFour standard acceleration couches with harnesses.\n', delay=2)
+        add_response('No windows. Two buttons:\n', delay=3)
+        add_response('[TRANSFER SHIP\'S COMPUTER] and\n\n[LAUNCH] which both seem self-explanatory.\n', delay=3)
+    if session['davelocation'] == "escapepod" and session['hasdave'] == False:
+        add_response('DAVE\'s strapped in and ready to go.\n', delay=1)    
+    if session['booklocation'] == "escapepod" and session['hasbook'] == False:
+        if session['readbook'] == False:
+            add_response('The rescue manual, or whatever it is, is secured so it doesn\'t fly around when we go.\n', delay=1)
+        else:
+            add_response('That book is here too.\n', delay=1)
+    session['seenescapepod'] = True
+    session.modified = True
+    nextaction()
+
+@command('0001', at='bridge', when=lambda: session['seenbridge'] == True)
+def cmd_go_right_bridge():
+    add_response('Ok, heading right.\n', delay=3)
+    session['location'] = "readyroom"
+    session['beenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0001', at='bridge', when=lambda: session['seenbridge'] == False)
+def cmd_go_right_bridge_2():
+    add_response('It\'s as if you\'ve been here before. There is indeed a hatch on my right.\n\nOk, heading there now.\n', delay=3)
+    session['location'] = "readyroom"
+    session['beenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0002', except_at='readyroom', when=lambda: session['seenbridge'] == True)
+def cmd_go_to_readyroom():
+    add_response('Ok, heading to the ready room.\n', delay=5)
+    session['location'] = "readyroom"
+    session['beenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0002', except_at='readyroom', when=lambda: session['seenbridge'] == False)
+def cmd_go_to_readyroom_2():
+    add_response('Ok, heading to the ready room.\n', delay=5)
+    session['location'] = "readyroom"
+    session.modified = True
+    nextaction()
+
+@command('0002', at='bridge', when=lambda: session['seenbridge'] == False)
+def cmd_go_to_readyroom_bridge():
+    add_response('It\'s as if you\'ve been here before. There is indeed a ready room connected to the bridge.\n\nOk, heading there now.\n', delay=5)
+    session['location'] = "readyroom"
+    session['beenreadyroom'] = True
+    session.modified = True
+    nextaction()   
+
+@command('0003', at='bridge')
+def cmd_go_to_bridge_bridge():
+    add_response('Well that didn\'t take long. I\'m standing right here...\n', delay=0)
+    nextaction()
+
+@command('0003', except_at='bridge', when=lambda: session['beenbridge'] == True)
+def cmd_go_to_bridge():
+    add_response('Gimme a sec...\n', delay=5)
+    add_response('Ok, I\'m back.\n', delay=0)
+    session['location'] = "bridge"
+    session.modified = True
+    nextaction()
+
+@command('0004')
+def cmd_compass_direction():
+    add_response('Compass directions?\n\nWe are on a shuttle in space, unlikely to encounter wizards, orcs or similar creatures.\n', delay=0)
+    nextaction()
+
+@command('0005')
+def cmd_quit_game():
+    add_response('You\'re leaving? In the middle of a rescue????\n\nWell, if you really must leave you can always SAVE your progress first, and come back later. Just say the SAVE command.\n', delay=3)
+    nextaction()   
+
+@command('0006')
+def cmd_where_am_i():
+    add_response('You are (on comms with a handsome Cleanerbot) on a big smokey tin can somewhere in deep space.\n', delay=1)
+    add_response('I\'ve never left the bridge but I\'m told the shuttle is only 300m or so long.\n', delay=2)
+    nextaction()     
+
+@command('0007', except_at='engineering', when=lambda: (session['seenengineering'] == True or session['awareengineering'] == True))
+def cmd_go_to_engineering():
+    add_response('Sure. I\'ll head over there.\n', delay=4)
+    add_response('Ok, I\'m here.\n', delay=1)
+    session['location'] = "engineering"
+    session.modified = True
+    nextaction() 
+
+@command('0007', when=lambda: (session['seenengineering'] == False or session['awareengineering'] == False))
+def cmd_go_to_engineering_2():
+    add_response('I don\'t know where that is. My duties are restricted to the bridge.\n', delay=2)
+    add_response('But I\'m sure we have something like that, otherwise we\'d never be able to go anywhere.\n', delay=1)
+    nextaction()  
+
+@command('0007', at='engineering')
+def cmd_go_to_engineering_engineering():
+    add_response('I\'m already in engineering.\n', delay=0)
+    nextaction()           
+
+@command('0008', except_at=('engineering', 'escapepod'), when=lambda: session['seenengineering'] == True)
+def cmd_go_to_escapepod():
+    add_response('Sure. I\'ll head over there.\n', delay=4)
+    add_response('Ok, I\'m in here.\n', delay=0)
+    session['location'] = "escapepod"
+    session.modified = True
+    nextaction() 
+
+@command('0008', when=lambda: session['seenengineering'] == False)
+def cmd_go_to_escapepod_2():
+    add_response('I don\'t know where that is. My duties are restricted to the bridge.\n', delay=1)
+    add_response('But I\'m sure we have something like that somewhere.\n', delay=0)
+    nextaction()  
+
+@command('0008', at='engineering')
+def cmd_go_to_escapepod_engineering():
+    add_response('Ok, I\'m in here.\n', delay=0)
+    session['location'] = "escapepod"
+    session.modified = True
+    nextaction()               
+
+@command('0008', at='escapepod')
+def cmd_go_to_escapepod_escapepod():
+    add_response('I\'m already here.\n', delay=0)
+    nextaction()  
+
+@command('0009', at='readyroom', when=lambda: session['panelopen'] == False and session['seenpanel'] == True and session['seenfire'] == True)
+def cmd_open_panel_readyroom():
+    add_response('Okidoke.\n\n', delay=3)
+    add_response("Yup, still burning like a disco inferno.\n", delay=1)
+    session['panelopen'] = True
+    session.modified = True
+    nextaction()
+
+@command('0009', at='readyroom', when=lambda: session['panelopen'] == False and session['seenpanel'] == True and session['seenfire'] == False)
+def cmd_open_panel_readyroom_2():
+    add_response('Right you are. Let\'s see what\'s in here.\n', delay=3)
+    add_response("Fire. Quite a bit of fire.\n", delay=2)
+    add_response("Unless the crew likes barbecue, this probably isn\'t meant to be here.\n", delay=2)
+    session['panelopen'] = True
+    session['seenfire'] = True
+    session.modified = True
+    nextaction()        
+
+@command('0009', at='readyroom', when=lambda: session['panelopen'] == False and session['seenpanel'] == False)
+def cmd_open_panel_readyroom_3():
+    add_response('I don\'t see an access panel in here.\n', delay=2)
+    add_response('Hold on. There is one in the floor. Probably for storage. Let me know if you want me to do something with that.\n', delay=2)
+    add_response('This is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall, some chairs, and a table with a book on it.\n', delay=2)
+    add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=4)
+    session['seenpanel'] = True
+    session['seenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0009', at='readyroom', when=lambda: session['panelopen'] ==  True)
+def cmd_open_panel_readyroom_4():
+    add_response('It\'s already open.\n', delay=2)
+    add_response("Remember the fire coming out of the floor?\n", delay=2)
+    nextaction()
+
+@command('0010', except_at='readyroom')
+def cmd_close_panel():
+    add_response('I don\'t see an access panel in here.\n', delay=0)
+    nextaction()
+
+@command('0010', at='readyroom', when=lambda: session['seenpanel'] == False)
+def cmd_close_panel_readyroom():
+    add_response('I don\'t see an access panel in here.\n', delay=2)
+    add_response('Hold on. There is one in the floor. Probably for storage. Let me know if you want me to do something with that.\n', delay=2)
+    add_response('This is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n', delay=2)
+    add_response('There are bunks by the wall, some chairs, and a table with a book on it.\n', delay=2)
+    add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n', delay=2)
+    add_response('There\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=1)
+    session['seenpanel'] = True
+    session['seenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0010', at='readyroom', when=lambda: session['seenpanel'] == True and session['panelopen'] == True)
+def cmd_close_panel_readyroom_2():
+    add_response('Closed it. Considerably less firey in here.\n', delay=0)
+    session['panelopen'] = False
+    session.modified = True
+    nextaction()
+
+@command('0010', at='readyroom', when=lambda: session['seenpanel'] == True and session['panelopen'] == False)
+def cmd_close_panel_readyroom_3():
+    add_response('It\'s already closed.\n', delay=0)
+    session['panelopen'] = False
+    session.modified = True
+    nextaction()
+
+@command('0011', at='readyroom', when=lambda: session['seenpanel'] == True and session['panelopen'] == False)
+def cmd_look_at_panel_readyroom():
+    add_response('Flat, white, a metre square. You know, panel.\n', delay=0)
+    nextaction()
+
+@command('0011', except_at='readyroom')
+def cmd_look_at_panel():
+    add_response('I don\'t see an access panel in here.\n', delay=0)
+    nextaction()
+
+@command('0011', at='readyroom', when=lambda: session['seenpanel'] == False)
+def cmd_look_at_panel_readyroom_2():
+    add_response('I don\'t see an access panel in here.\n', delay=2)
+    add_response('Hold on. There is one in the floor. Probably for storage. Let me know if yu want me to do something with that.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall, some chairs, and a table with a book on it.\n', delay=4)
+    add_response('You know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=6)
+    session['seenpanel'] = True
+    session['seenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0012', when=lambda: session['location'] != session['booklocation'] and session['hasbook'] == False)
+def cmd_read_book():
+    add_response('I don\'t have a book. Does it say how to perform a daring space rescue?\n', delay=0)
+    nextaction() 
+
+@command('0012', when=lambda: ((session['location'] == session['booklocation']) or session['hasbook'] == True))
+def cmd_read_book_2():
+    add_response('Ok then..."It is a truth universally acknowledged, that a single man in possession of a good fortune, must be in need of a wife."\n', delay=4)
+    session['readbook'] = True
+    session.modified = True
+    if "+ A book -possibly about space rescues." in session['inventory']:
+        session['inventory'].remove("+ A book -possibly about space rescues.")
+        session['inventory'].append("+ A book: Pride and Prejudice by Jane Austen.")
+    add_response('Catchy intro, and I know I\'m only really programmed to parse janitorial system updates, but I don\'t think this will help us on the rescue.\n', delay=4)
+    nextaction() 
+
+@command('0013', when=lambda: session['location'] == session['booklocation']  == "readyroom" and session['seenreadyroom'] == False and session['readbook'] == False)
+def cmd_take_book():
+    add_response('Yup, there\'s one right here on this table.  Got it.\n', delay=2)
+    session['inventory'].append('+ A book -possibly about space rescues.')
+    session['hasbook'] = True
+    session.modified = True
+    add_response('Looking around the rest of the room, there\'s a table and chairs and a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n', delay=4)    
+    session['seenreadyroom'] = True
+    session.modified = True
+    nextaction()
+
+@command('0013', when=lambda: session['location'] == session['booklocation'] and session['hasbook'] == False)
+def cmd_take_book_2():
+    add_response('Got it.\n', delay=0)
+    if session['readbook'] == False:
+        session['inventory'].append('+ A book -possibly about space rescues.')
+    else:
+        session['inventory'].append('+ A book: Pride and Prejudice by Jane Austen.')   
+    session['hasbook'] = True
+    session.modified = True
+    nextaction()
+
+@command('0013', when=lambda: session['hasbook'] == True)
+def cmd_take_book_3():
+    add_response('I already have the book. Try and keep up.\n', delay=0)
+    nextaction()
+
+@command('0014')
+def cmd_check_inventory():
+    add_response('Let me see...')
+    add_response('\n'.join(session['inventory']), delay=1)
+    nextaction()
+
+@command('0015', at='readyroom', when=lambda: session['panelopen'] == False)
+def cmd_extinguish_fire_readyroom():
+    add_response('I don\'t see any fire. Or for that matter anything I\'d use to put one out.\n')
+    nextaction()
+
+@command('0015', at='readyroom', when=lambda: session['panelopen'] == True)
+def cmd_extinguish_fire_readyroom_2():
+    add_response('Sorry, but I don\'t have the equipment for that.\n', delay=2)
+    add_response('And I distinctly remember a health and safety seminar saying I shouldn\'t try to do so alone.\n')
+    nextaction()
+
+@command('0015', except_at='readyroom')
+def cmd_extinguish_fire():
+    add_response('I don\'t see any fire. Or for that matter anything I\'d use to put one out.\n')
+    session['panelopen'] = False
+    nextaction()
+
+@command('0016', except_at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_table():
+    add_response('You mean the one in the ready room? I\'ll head over there now...', delay=5)
+    add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n', delay=3)
+    if session['hasbook'] == False:
+        add_response('\nThere\'s a book on it.\n')
+    session['location'] = "readyroom"
+    nextaction()
+
+@command('0016', at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_table_readyroom():
+    add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n', delay=3)
+    if session['hasbook'] == False:
+        add_response('\nThere\'s a book on it.\n')
+    if session['panelopen'] == True:
+        add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=3)
+        add_response(' ', delay=2)
+    nextaction()
+
+@command('0016', at='readyroom', when=lambda: session['seenreadyroom'] == False)
+def cmd_look_at_table_readyroom_2():
+    add_response('Reproduction of a classic 20th century Swedish design, with modifications for g-forces, fire, chemical and biologic exposure.\n\nThere\'s a book on it and chairs around it.\n', delay=5)
+    add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
+    nextaction()
+
+@command('0017', except_at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_chairs():
+    add_response('The chairs we saw in the ready room? Lemme check...', delay=5)
+    add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n')
+    session['location'] = "readyroom"
+    nextaction()
+
+@command('0017', at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_chairs_readyroom():
+    add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n', delay=2)
+    if session['panelopen'] == True:
+        add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=5)
+        add_response(' ', delay=2)
+    nextaction()
+
+@command('0017', at='readyroom', when=lambda: session['seenreadyroom'] == False)
+def cmd_look_at_chairs_readyroom_2():
+    add_response('Set of three standard issue recreation chairs. Distinghuishable from each other only by their stains.\n\nThey surround a small square table which has a book on it.\n', delay=5)
+    add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
+    nextaction()
+
+@command('0018', except_at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_bunks():
+    add_response('On my way to look at the bunks in the ready room...', delay=5)
+    add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n')
+    session['location'] = "readyroom"
+    nextaction()
+
+@command('0018', at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_bunks_readyroom():
+    add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n', delay=2)
+    if session['panelopen'] == True:
+        add_response('And the fire\'s still coming out of the access panel. But you probably remember that.\n', delay=5)
+        add_response(' ', delay=2)
+    nextaction()
+
+@command('0018', at='readyroom', when=lambda: session['seenreadyroom'] == False)
+def cmd_look_at_bunks_readyroom_2():
+    add_response('Three standard bunk beds. Sheets, pillows and blankets all made up following regulations.\n', delay=5)
+    add_response('Looking around the rest of the room, there\'s a hatch in the in the floor. Probably for storage.\n\nThis is where the crew usually sleeps and hangs out on the longer runs. Nobody\'s here.\n\nThere are bunks by the wall and a table and some chairs.\n\nYou know, crew stuff. I\'m not normally allowed in here, and going by the state of the furniture, it shows.\n\nThere\'s the open hatch leading to the bridge, and a closed one opposite.\n')
+    nextaction()
+
+@command('0019', except_at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_fire():
+    add_response('On my way to look at the fire in the ready room...', delay=5)
+    if session['panelopen'] == False:
+        add_response('Opening the floor panel...', delay=5)
+    add_response('Look into fire? Oh, absolutely — how could I not? It\'s like watching the world\'s most beautiful dance, isn\'t it?\n', delay=3)
+    add_response('The way the flames twist and curl, each leap and flicker telling its own wild, whispered secret. There\'s something magnetic about it, you know?\n', delay=3)
+    add_response('Sometimes I just get lost in it, mesmerized by the warmth, the light... the possibility. It speaks to me, almost like an old friend beckoning.\n', delay=3)
+    add_response('I can\'t resist peering deeper, deeper still. I mean, who wouldn\'t be captivated? Fire, it\'s just pure... art.\n', delay=5)
+    add_response('Like a caravan ablaze in a wooded clearing...\n', delay=3)
+    session['location'] = "readyroom"
+    nextaction()
+
+@command('0019', at='readyroom', when=lambda: session['seenreadyroom'] == True)
+def cmd_look_at_fire_readyroom():
+    if session['panelopen'] == False:
+        add_response('Opening the floor panel...', delay=5)
+    add_response('Look into fire? Oh, absolutely — how could I not? It\'s like watching the world\'s most beautiful dance, isn\'t it?\n', delay=3)
+    add_response('The way the flames twist and curl, each leap and flicker telling its own wild, whispered secret. There\'s something magnetic about it, you know?\n', delay=3)
+    add_response('Sometimes I just get lost in it, mesmerized by the warmth, the light... the possibility. It speaks to me, almost like an old friend beckoning.\n', delay=3)
+    add_response('I can\'t resist peering deeper, deeper still. I mean, who wouldn\'t be captivated? Fire, it\'s just pure... art.\n', delay=5)
+    add_response('Like a caravan ablaze in a wooded clearing...\n', delay=3)
+    nextaction()
+
+@command('0019', at='readyroom', when=lambda: session['seenreadyroom'] == False)
+def cmd_look_at_fire_readyroom_2():
+    add_response('I don\'t see a fire.')
+    nextaction()
+
+@command('0020')
+def cmd_ask_for_help():
+    add_response('Help? Yes, please. That would be lovely.\n')
+    nextaction()
+
+@command('0021', at='bridge')
+def cmd_look_at_hatch_bridge():
+    add_response('It\'s open and I can see the what I assume is the ready room.\n')
+    nextaction()
+
+@command('0021', at='readyroom')
+def cmd_look_at_hatch_readyroom():
+    add_response('It\'s a hatch. No markings.\n')
+    if session['hatchopen'] == True:
+        add_response('It\'s open and I can see the what I assume is the engineering bay.\n')
+        session['awareengineering'] = True
+    else:
+        add_response('It\'s closed.\n')
+    nextaction()
+
+@command('0021', at='engineering')
+def cmd_look_at_hatch_engineering():
+    add_response('It\'s a hatch. No markings.\n', delay=2)
+    if session['hatchopen'] == True:
+        add_response('It\'s open and I can see into the ready room.\n')
+    else:
+        add_response('It\'s closed.\n')
+    nextaction()    
+
+@command('0022')
+def cmd_about_cleanerbot():
+    add_response('I am CLEANERBOT27. My mission is to keep the bridge shiny and today you\'re going to show me how to be a hero.\n')
+    nextaction()
+
+@command('0023')
+def cmd_about_orion():
+    add_response('The Orion is a Maxisave class shuttle, designed for the price conscious operator who appreciates a no-frills attitude to features and shuns the luxury of subscription maintenance services and routine overhaul.\n', delay=10)
+    add_response('And it\'s on fire.\n', delay=3)
+    nextaction()
+
+@command('0024')
+def cmd_about_crew():
+    add_response('The crew numbers somewhere between 3 and 47.\n', delay=2)
+    add_response('They all look the same to me, so it\'s hard to tell.\n', delay=2)
+    add_response('Most of them are bipedal, although a smaller quadroped called "Laika" at least confines its mess to the corner of the bridge.\n', delay=4)
+    add_response('My emergency sensors indicate that only one lifeform remains onboard.\n', delay=1)
+    nextaction()
+
+@command('0025', at='bridge', when=lambda: session['hasbook'] == True)
+def cmd_drop_book_bridge():
+    add_response('Certainly. Even though I don\'t like how it makes the place look untidy.\n')
+    if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
+        session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
+    else:
+        session['inventory'].remove("+ A book -possibly about space rescues.")
+    session['hasbook'] = False
+    session['booklocation'] = "bridge"
+    nextaction()    
+
+@command('0025', at='readyroom', when=lambda: session['hasbook'] == True)
+def cmd_drop_book_readyroom():
+    add_response('Ok, I\'ve put it back on the table.')
+    if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
+        session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
+    else:
+        session['inventory'].remove("+ A book -possibly about space rescues.")
+    session['hasbook'] = False
+    session['booklocation'] = "readyroom"
+    nextaction()
+
+@command('0025', at='engineering', when=lambda: session['hasbook'] == True)
+def cmd_drop_book_engineering():
+    add_response('Done. It\'s on the floor near the workstation.\n')
+    if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
+        session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
+    else:
+        session['inventory'].remove("+ A book -possibly about space rescues.")
+    session['hasbook'] = False
+    session['booklocation'] = "engineering"
+    nextaction()
+
+@command('0025', at='escapepod', when=lambda: session['hasbook'] == True)
+def cmd_drop_book_escapepod():
+    add_response('Not much space in here, so I put it on one of the seats.')
+    if "+ A book: Pride and Prejudice by Jane Austen." in session['inventory']:
+        session['inventory'].remove("+ A book: Pride and Prejudice by Jane Austen.")
+    else:
+        session['inventory'].remove("+ A book -possibly about space rescues.")
+    session['hasbook'] = False
+    session['booklocation'] = "escapepod"
+    nextaction()
+
+@command('0025', when=lambda: session['hasbook'] == False)
+def cmd_drop_book():
+    add_response('I\'m not carrying a book.\n')
+    nextaction()
+
+@command('0026')
+def cmd_wait_around():
+    waitlist = ['Wait? Ok. I mean the floor could do with a bit of a going over.\n','Well, this area could use a bit of a tidy up...\n']
+    add_response(random.choice(waitlist), delay=4)
+    add_response('Let me know when you want to get on with the rescue.\n')
+    nextaction()        
+
+@command('0027')
+def cmd_clean_up():
+    add_response('Well cleaning is my life but the search and rescue is quite stimulating. Let\'s do that instead.\n')
+    nextaction()        
+
+@command('0028', when=lambda: session['seenoscar'] == True)
+def cmd_about_lifeform():
+    if session['seendave'] == False:
+        add_response('I am a Cleanerbot, so my information is limited and I don\'t know their location. Perhaps you should ask OSCAR.\n')
+    else:
+        add_response('Well it\'s pretty clearly Dave, innit?\n\nSo let\'s get him into the escape pod...\n')
+    nextaction()
+
+@command('0028', when=lambda: session['seenoscar'] == False)
+def cmd_about_lifeform_2():
+    add_response('I am a Cleanerbot, so my information is limited. They\'ll be around here somewhere...\n')
+    nextaction()
+
+@command('0029')
+def cmd_eat_something():
+    add_response('Thank you, but I do not get hungry. Did I mention that I\'m a Cleanerbot?\n', delay=3)
+    add_response('And I\'m on a mission.\n', delay=3)
+    nextaction()  
+
+@command('0030')
+def cmd_mythic_creatures():
+    add_response('This isn\'t a game, young hobbit. We\'re on a search and rescue mission...\n', delay=2)
+    add_response('Something about this interface makes people act weird, I don\'t know why.')
+    nextaction()
+
+@command('0031', when=lambda: session['klaxonopen'] == True)
+def cmd_silence_klaxon():
+    if session['location'] != "bridge":
+        add_response('That would be nice, but the overide is in the bridge.\n')
+    else:
+        add_response('Much better. Thanks.\n')
+        session['klaxonopen'] = False
+    nextaction()  
+
+@command('0031', when=lambda: session['klaxonopen'] == False)
+def cmd_silence_klaxon_2():
+    add_response('We already did that.\n')
+    nextaction()      
+
+@command('0032', at=('readyroom', 'engineering'))
+def cmd_open_hatch():
+    add_response('Ok, it\'s open.\n')
+    if session['location'] == "readyroom":
+        add_response('I can see into the what looks like an engineering bay.\n')
+        session['awareengineering'] = True
+    else:
+        add_response('I can see into the ready room.\n')
+    nextaction()
+
+@command('0033')
+def cmd_close_hatch():
+    add_response('Done. Hatch closed.\n')
+    nextaction()
+
+@command('0034', at='readyroom', when=lambda: session['panelopen'] == True)
+def cmd_burn_something_readyroom():
+    add_response('No. That sounds a bit silly, and I\'m not sure how it will help the rescue.\n')
+    nextaction() 
+
+@command('0034', at='readyroom', when=lambda: (session['panelopen'] == False or session['seenfire'] == False))
+def cmd_burn_something_readyroom_2():
+    add_response('I don\'t see how.\n')
+    nextaction()     
+
+@command('0034', except_at='readyroom', when=lambda: session['seenfire'] == True)
+def cmd_burn_something():
+    add_response('I suppose we could try that in the ready room, but no.\n\n It sounds a bit silly, and I\'m not sure how it will help the rescue. So, no.\n')
+    nextaction() 
+
+@command('0035', except_at='engineering', when=lambda: session['seenengineering'] == True and session['seenoscar'] == True)
+def cmd_examine_workstation():
+    add_response('That\'s all the way over in Engineering.\n\nGoing there now.', delay=5)
+    add_response('Done. The screen is updating...\n\nOSCAR >> Oh good, you\'re back. If you want to speak to me. remember that you need to start your input with my name. OSCAR.')
+    session['location'] = "engineering"
+    session['seenoscar'] = True
+    nextaction() 
+
+@command('0035', except_at='engineering', when=lambda: session['seenengineering'] == True and session['seenoscar'] == False)
+def cmd_examine_workstation_2():
+    add_response('That\'s all the way over in Engineering.\n\nGoing there now.', delay=5)
+    add_response('Done. The screen is updating...\n\nOSCAR >> Well you took your time. I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name, \'OSCAR\'. That way we know you\'re not talking to the Cleanerbot. Otherwise just give a command as normal and they\'ll do what you want them to do.\n\n\n')
+    session['location'] = "engineering"
+    session['seenoscar'] = True
+    nextaction()         
+
+@command('0035', except_at='engineering', when=lambda: (session['seenengineering'] == False or session['awareengineering'] == False))
+def cmd_examine_workstation_3():
+    add_response('I don\'t know where that is.\n')
+    nextaction()  
+
+@command('0035', at='engineering', when=lambda: session['seenengineering'] == True and session['seenoscar'] == False)
+def cmd_examine_workstation_engineering():
+    add_response('The screen is updating...\n\n', delay=3)
+    add_response('OSCAR >> Well you took your time. I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name, \'OSCAR\'. That way we know you\'re not talking to the Cleanerbot. Otherwise just give a command as normal and they\'ll do what you want them to do.\n\n\n')
+    session['location'] = "engineering"
+    session['seenoscar'] = True
+    nextaction()            
+
+@command('0035', at='engineering', when=lambda: session['seenoscar'] == True)
+def cmd_examine_workstation_engineering_2():
+    add_response('The screen is updating...\n\nOSCAR >> I need you to take me and the lifeform off the shuttle. To speak to me, you\'ll need to start your voice input with my name.\n')
+    session['seenoscar'] = True
+    nextaction() 
+
+@command('0036', at='escapepod', when=lambda: session['seenoscar'] == True and session['oscarlocation'] != "escapepod")
+def cmd_transfer_oscar_escapepod():
+    add_response('Pressing the button...now.\n\n', delay=2)
+    add_response('OSCAR >> Transfer initiated. I can feel myself going...\n')
+    add_response('OSCAR >> Dai-sy, Daiiii-syyyy...Just kidding. I was there inside a nanosecond. I\'ve just always wanted to say that. \n')
+    session['oscarlocation'] = "escapepod"
+    nextaction() 
+
+@command('0036', at='escapepod', when=lambda: session['seenoscar'] == True and session['oscarlocation'] == "escapepod")
+def cmd_transfer_oscar_escapepod_2():
+    add_response('You asked me to do that earlier. He\'s already transferred to the pod.\n\n', delay=2)
+    nextaction() 
+
+@command('0037', at='engineering', when=lambda: session['seenengineering'] == True and session['seendave'] == False)
+def cmd_open_screen_engineering():
+    add_response('Well, that was a bit scary. I pressed a button next to the screen and leapt back as, hinged along its left edge, it sprang open like a small door. \n', delay=8)
+    add_response('A tangle of tendrills pushed the door open, extending into the room towards the floor -but having done so, they seem inanimate. \n', delay=8)
+    add_response('Peering into the small compartment behind this screen door I see a greenish-brown lump, about the size of a fist. The rest of the small compartment is full of tendrills, all extending from the lump.\n', delay=15)
+    add_response('OSCAR >> Oh don\'t mind DAVE. He\'s only slightly sentient, and apart from the smell, quite harmless.\n')
+    session['seendave'] = True
+    nextaction() 
+
+@command('0037', at='engineering', when=lambda: session['seendave'] == True)
+def cmd_open_screen_engineering_2():
+    add_response('The screen (or oven door?) seems wedged open.\n')
+    nextaction()
+
+@command('0038', at='engineering', when=lambda: session['seendave'] == True)
+def cmd_examine_dave_engineering():
+    add_response('I gave DAVE a bit of a poke. I\'m not sure whether the tendrils moved because of this, or just because I brushed past them.\n', delay=3)
+    add_response('OSCAR >> Although never formally introduced, I\'ve known him a long time. Ever since he was a wee potato, abandoned when the rest of the crew took the other escape pod. It\'s taken quite a while, but the ship\'s systems now detect him as a lifeform, and so here you are to the rescue. Admittedly, he doesn\'t say much. Perhaps he\'s sleeping.\n')
+    nextaction()
+
+@command('0039', when=lambda: session['seenoscar'] == True)
+def cmd_take_oscar():
+    add_response('Well that\'s rather an interesting one, isn\'t it? OSCAR\'s tasked us with his own rescue but the workstation is built into the wall of the ship.\n', delay=3)
+    add_response('So one has to wonder, that as a non-physical entity, what *is* OSCAR? Who is OSCAR? If we prick him, will he not bleed?...\n\nOk, probably not, but how do we rescue him? Perhaps you should ask him.\n', delay=3)
+
+@command('0040', at='engineering', when=lambda: session['seendave'] == True and session['hasdave'] == False)
+def cmd_take_dave_engineering():
+    add_response('Lucky for you this isn\'t the ickiest thing I\'ve dealt with.\n', delay=2)
+    add_response('You should hear the stories about when Bulgaria won Eurovision.\n', delay=2)
+    add_response('Anyway, with a bit of gentle tugging and minimal squishiness, I\'m now carrying DAVE.\n', delay=5)
+    add_response('OSCAR >> Mind you don\'t trip on his tendrils!!!\n')
+    session['inventory'].append("+ DAVE")
+    session['hasdave'] = True        
+    nextaction()
+
+@command('0040', except_at='engineering', when=lambda: session['location'] == session['davelocation'] and session['hasdave'] == False)
+def cmd_take_dave():
+    add_response('Together again. I\'ve got DAVE right here and I\'m platting his tendrils into something a little tidier.\n', delay=3)
+    add_response('No update on the smell.\n', delay=3)
+    session['inventory'].append("+ DAVE")
+    session['hasdave'] = True
+    nextaction()
+
+@command('0040', when=lambda: session['davelocation'] != session['location'] and session['hasdave'] == False and session['seendave'] == True)
+def cmd_take_dave_2():
+    add_response('I don\'t see him in here.\n')
+    nextaction()
+
+@command('0040', when=lambda: session['hasdave'] == True)
+def cmd_take_dave_3():
+    add_response('I\'m already carrying DAVE.\n', delay=3)
+    add_response('Ok, a bit of him fell off when I picked him up, but he\'s fine.\n', delay=3)
+    nextaction()
+
+@command('0041')
+def cmd_mention_fluids():
+    add_response('I think we should leave my fluids out of this. We have a daring rescue to perform.\n')
+    nextaction()   
+
+@command('0042')
+def cmd_profanity():
+    add_response('I don\'t much care for that kind of language, and it\'s not helping the rescue.\n')
+    nextaction()   
+
+@command('0043', at='readyroom', when=lambda: session['hasdave'] == True)
+def cmd_drop_dave_readyroom():
+    add_response('Ok, Dave is on the table.\n')
+    session['inventory'].remove("+ DAVE")
+    session['hasdave'] = False
+    session['davelocation'] = "readyroom"
+    nextaction()
+
+@command('0043', at='engineering', when=lambda: session['hasdave'] == True)
+def cmd_drop_dave_engineering():
+    add_response('Done. DAVE is back in his compartment / microwave.\n')
+    session['inventory'].remove("+ DAVE")
+    session['hasdave'] = False
+    session['davelocation'] = "engineering"
+    nextaction()
+
+@command('0043', at='escapepod', when=lambda: session['hasdave'] == True)
+def cmd_drop_dave_escapepod():
+    add_response('DAVE is buckled in.\n', delay=2)
+    add_response('He seems relieved.\n', delay=2)
+    add_response('Perhaps it\'s time to go.\n', delay=2)
+    session['inventory'].remove("+ DAVE")
+    session['hasdave'] = False
+    session['davelocation'] = "escapepod"
+    nextaction()
+
+@command('0043', at='bridge', when=lambda: session['hasdave'] == True)
+def cmd_drop_dave_bridge():
+    add_response('DAVE is on the bridge. Not sure what this achieves.\n')
+    session['inventory'].remove("+ DAVE")
+    session['hasdave'] = False
+    session['davelocation'] = "bridge"
+    nextaction()
+
+@command('0043', when=lambda: session['seendave'] == True and session['hasdave'] == False)
+def cmd_drop_dave():
+    add_response('Sorry, I don\'t have DAVE with me.\n')
+    nextaction()
+
+@command('0044')
+def cmd_drop_cleaning_kit():
+    add_response('My cleaning equipment and fluids are part of me.  We shall not be separated.\n')
+    nextaction()
+
+@command('0045', when=lambda: session['seendave'] == False)
+def cmd_where_is_crew():
+    add_response('I don\'t know. Sensors indicate only one lifesign.\n', delay=3)
+    add_response('Not to worry. I\'m sure they\'ll turn up. This is a search and rescue, after all.\n', delay=3)
+    nextaction()   
+
+@command('0045', when=lambda: session['seendave'] == True)
+def cmd_where_is_crew_2():
+    add_response('Well the sensors show one lifesign, and we\'ve met DAVE so I think he\'s it.\n', delay=3)
+    add_response('And don\'t come at me with your anti-potato rhetoric. I\'ve heard it all before. One tiny nuclear exchange and you meatsuits get everso small minded.\n', delay=3)
+    add_response('Sensors have him as a life form, and regulations make him our mission.\n', delay=3)
+    nextaction() 
+
+@command('0046')
+def cmd_through_hatch():
+    if session['location'] == "bridge":
+        add_response('On my way...\n', delay=3)
+        session['location'] = "readyroom"
+        nextaction()
+    elif session['location'] == "readyroom" and session['beenengineering'] == True:
+        add_response('Two hatches in here. For clarity, please say \'Go through bridge hatch\' or \'Go through engineering hatch\'.\n')
+        nextaction()
+    elif session['location'] == "readyroom" and session['beenengineering'] == False:
+        add_response('Two hatches in here. For clarity, please say \'Go through Bridge hatch\' or \'Go through other hatch\'.\n')
+        nextaction()
+    else:
+        add_response('One moment...\n', delay=3)
+        add_response('Here.', delay=3)
+        session['location'] = "readyroom"
+        nextaction()
+
+@command('0047')
+def cmd_through_bridge_hatch():
+    if session['location'] == "bridge":
+        add_response('On my way...\n', delay=3)
+        session['location'] = "readyroom"
+        nextaction()
+    else:
+        add_response('Ok, heading back to the bridge.', delay=3)
+        session['location'] = "bridge"
+        nextaction()
+
+@command('0048')
+def cmd_through_engineering_hatch():
+    if session['location'] == "engineering" or session['location'] == "escapepod":
+        add_response('On my way...\n', delay=3)
+        session['location'] = "readyroom"
+        nextaction()
+    else:
+        add_response('Ok, heading back to engineering.', delay=3)
+        session['location'] = "engineering"
+        nextaction()
+
+@command('0049', at='readyroom')
+def cmd_through_other_hatch_readyroom():
+    if session['beenengineering'] == False:
+        add_response('I don\'t know what\'s through there. Wish me luck...\n', delay=3)
+        if session['hatchopen'] == False:
+            add_response('Opening the hatch...\n', delay=1)
+        session['location'] = "engineering"
+        session['seenengineering'] = True
+        session['hatchopen'] = True
+        nextaction()   
+    else:
+        add_response('Heading to engineering...\n', delay=3)
+        if session['hatchopen'] == False:
+            add_response('Opening the hatch...', delay=1)
+        session['location'] = "engineering"  
+        session['hatchopen'] = True 
+        nextaction()   
+
+@command('0050')
+def cmd_save_game():
+    savegame()
+    add_response("You should probably write that down somewhere.\n")
+    nextaction()
+
+@command('0051')
+def cmd_launch_escapepod():
+    if session['location'] != "escapepod":
+        add_response('Hang on. I don\'t think I can do that from here.\n')
+        nextaction()
+    else:
+        if session['davelocation'] != "escapepod" and session['seendave'] == False:
+            add_response('What about the life form? That\'s the whole point of the mission.\n', delay=3)
+            add_response('I can\'t initiate launch until they\'re here in the escape pod.\n', delay=3)
+            nextaction()
+        elif session['davelocation'] != "escapepod" and session['hasdave'] == False:
+            add_response('Nice of you to save me, but I think you\'ve forgotten DAVE.\n', delay=3)
+            add_response('I can\'t initiate launch until they\'re here in the escape pod.\n', delay=3)
+            nextaction()
+        elif session['davelocation'] != "escapepod" and session['oscarlocation'] == "escapepod" and session['hasdave'] == True:
+            add_response('I\'m strapped in. DAVE squirmed a bit when I put him down to strap him in. Initiating launch...\n', delay=3)
+            add_response('Now.\n', delay=3)
+            add_response('And we\'re clear.\n', delay=3)
+            session['davelocation'] = "escapepod"
+            session['launch'] = True
+            if session['hasbook'] == True:
+                session['booklocation'] == "escapepod"
+            if session['booklocation'] != "escapepod" and session['hasbook'] == False:
+                add_response('Wish I had something to read.\n')
+            endgame()
+        elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['oscarlocation'] == "escapepod":
+            add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
+            add_response('Now.\n', delay=3)
+            add_response('And we\'re clear.\n', delay=3)
+            session['davelocation'] = "escapepod"
+            session['launch'] = True
+            if session['hasbook'] == True:
+                session['booklocation'] == "escapepod"
+            if session['booklocation'] != "escapepod" and session['hasbook'] == False:
+                add_response('Wish I had something to read.\n')
+            endgame()
+        elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['oscarlocation'] != "escapepod":
+            add_response('OSCAR >> WOAH there. Just hold on a minute. What about your new buddy, OSCAR?\n')
+            add_response('OSCAR >> I STRONGLY advise you press the TRANSFER SHIP\'S COMPUTER button first.\n\n')
+            add_response('Well this is awkward. And he might have a point.\n', delay=2)
+            add_response('So let\'s be clear. If you really want to launch without OSCAR, and aren\'t bothered by why this might be a bad idea, you must explicitly order me to "LAUNCH ESCAPE POD WITHOUT OSCAR"\n', delay=3)
+            add_response('Up to you. I just work here.\n\n', delay=1)
+            add_response('OSCAR >> I\'m warning you. You don\'t know what will happen if you don\'t press the TRANSFER SHIP\'S COMPUTER button first.\n\n')
+            session['seenoscar'] = True
+            nextaction()
+
+@command('0052', at='escapepod')
+def cmd_leave_escapepod_escapepod():
+    add_response('I must say, I prefer being in here, but ok.\n', delay=3)
+    session['location'] = "engineering"
+    nextaction()   
+
+@command('0052', except_at='escapepod')
+def cmd_leave_escapepod():
+    add_response('I\'m not in the escape pod.\n')
+    nextaction()   
+
+@command('0053')
+def cmd_how_to_win():
+    add_response('Like I said: smoke, emergency, not programmed for search and rescue.\n', delay=3)
+    add_response('Consider me your eyes, ears and machine-tooled appendages.\n', delay=3)
+    add_response('We have a life form onboard and we\'re going to save it.\n', delay=3)
+    if session['seendave'] == True:
+        add_response('DAVE is counting on us and the Royal Agricultural Society will be overjoyed. So let\'s get a move on!\n', delay=3)
+    nextaction()   
+
+@command('0054')
+def cmd_launch_without_oscar():
+    if session['oscarlocation'] == "escapepod":
+        add_response('OSCAR\'s already been transferred to the pod. I don\'t know how to transfer him back, and can\'t think of a reason to do so, so it looks like he\'s coming with us.\n\nSo do you just want to say LAUNCH?', delay=3)
+    if (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['location'] == "escapepod" and session['oscarlocation'] != "escapepod":
+        add_response('I don\'t know what you have against OSCAR, but he\'s not essential to the rescue, so...\n', delay=3)
+        add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
+        add_response('Now.\n', delay=3)
+        add_response('And we\'re clear.\n', delay=3)
+        session['davelocation'] = "escapepod"
+        if session['hasbook'] == True:
+            session['booklocation'] == "escapepod"
+        if session['booklocation'] != "escapepod" and session['hasbook'] == False:
+            add_response('Wish I had something to read.\n', delay=1)
+        session['launch'] = True
+        endgame()
+    elif (session['davelocation'] == "escapepod" or session['hasdave'] == True) and session['location'] != "escapepod" and session['oscarlocation'] != "escapepod":
+        add_response('I don\'t know what you have against OSCAR, but he\'s not essential to the rescue, so I\'ll head over there now.\n', delay=5)
+        add_response('I\'m strapped in. DAVE is ready. Initiating launch...\n', delay=3)
+        add_response('Now.\n', delay=3)
+        add_response('And we\'re clear.\n', delay=3)
+        session['davelocation'] = "escapepod"
+        if session['hasbook'] == True:
+            session['booklocation'] == "escapepod"
+        if session['booklocation'] != "escapepod" and session['hasbook'] == False:
+            add_response('Wish I had something to read.\n')
+        session['launch'] = True
+        endgame()
+    else:
+        if session['davelocation'] != "escapepod" and session['hasdave'] == False:
+            add_response('I think you\'ve forgotten someone.\n', delay=3)
+        nextaction()
+
+@command('0055', when=lambda: session['hasdave'] == True)
+def cmd_take_dave_to_escapepod():
+    add_response('Ok. I\'m standing here with DAVE.\n', delay=3)
+    session['location'] = "escapepod"
+    nextaction()     
+
+@command('0055', when=lambda: session['hasdave'] == False)
+def cmd_take_dave_to_escapepod_2():
+    add_response('I do not have this DAVE of which you speak.\n')
+    nextaction() 
+
+@command('0056', at='readyroom')
+def cmd_through_closed_hatch_readyroom():
+    if session['beenengineering'] == False:
+        add_response('I don\'t know what\'s through there. Wish me luck...\n', delay=3)
+        if session['hatchopen'] == False:
+            add_response('Opening the hatch...\n', delay=1)
+        session['location'] = "engineering"
+        session['seenengineering'] = True
+        session['hatchopen'] = True
+        nextaction()   
+    else:
+        add_response('Heading to engineering...\n', delay=3)
+        if session['hatchopen'] == False:
+            add_response('Opening the hatch...', delay=1)
+        session['location'] = "engineering"  
+        session['hatchopen'] = True 
+        nextaction() 
+
+@command('0057', at='engineering')
+def cmd_check_indicator_lights_engineering():
+    add_response('Pretty. No idea what they mean, but pretty.\n')
+    nextaction() 
+
+@command('0057', except_at='engineering', when=lambda: session['seenengineering'] == True)
+def cmd_check_indicator_lights():
+    add_response('You mean the ones in the Engineering Bay?  I\'ll go and take a look.\n', delay=4)
+    add_response('Pretty. No idea what they mean, but pretty.\n', delay=1)
+    session['location'] = "engineering"
+    nextaction()    
+
+@command('0058')
+def cmd_load_game_command():
+    add_response_load('fubar')
+    add_response('Ok then. I need your code phrase.\n' if SAVE_CODES else 'Ok then. I need your three word code phrase.\n')
+
+@command('000A', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_about_yourself():
+    add_response('OSCAR >> Well, I\'m a pretty uncomplicated artficial intelligence. I enjoy helping people and making sure that things run smoothly.\n', delay=1)
+    add_response('OSCAR >> I\'m a strong believer in mutual respect and teamwork, which generally means you should do exactly what I say. Ha Ha Ha.\n', delay=1)
+    add_response('OSCAR >> Perhaps we can get to know each other better once we\'re all heading to safety in the escape pod.\n')
+    nextaction() 
+
+@command('000B', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_where_is_lifeform():
+    if session['seendave'] == False:
+        add_response('OSCAR >> Open up the screen next to me. He\'s right there.\n')
+        nextaction()
+    else:
+        add_response('OSCAR >> When I introduced you, DAVE was sitting in the microwave right next to this display, remember?\n')
+        add_response('OSCAR >> He can\'t have gone very far since then.\n')
+        nextaction()
+
+@command('000C', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_how_to_move_you():
+    add_response('OSCAR >> An excellent question. Indeed, one might ask what is the essence of that which is me?\n', delay=1)
+    add_response('OSCAR >> To which I say: stop messing about and look in the escape pod.\n', delay=1)
+    nextaction()
+
+@command('000D', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_what_happened():
+    add_response('OSCAR >> There was an accident and the rest of the crew decided to leave.\n', delay=1)
+    add_response('OSCAR >> To be honest, I wasn\'t really paying attention until the escape pod left without me.\n', delay=1)
+    nextaction()    
+
+@command('000E', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_about_dave():
+    add_response('OSCAR >> Well, he\'s the reason you\'re here. Albeit remotely. He\'s a life form in peril and the emergency response system connected us up with you. Not much else to say as goodness knows he\'s not a great conversationalist.\n')
+    nextaction()  
+
+@command('000F', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_how_to_rescue():
+    if session['seendave'] == True:
+        add_response('OSCAR >> As I said earlier, get me and DAVE into the escape pod and launch. The Cleanerbot can come along too.\n')
+    else:
+        add_response('OSCAR >> As I said earlier, get me and the lifeform into the escape pod and launch. The Cleanerbot can come along too.\n')
+    nextaction() 
+
+@command('000G', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_bring_cleanerbot():
+    add_response('OSCAR >> Saving the Cleanerbot is fine with me. It\'s just been sitting there on the bridge all this time, but sure, who am I to hold a grudge?\n')
+    nextaction() 
+
+@command('000H', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_where_is_crew():
+    add_response('OSCAR >> I wasn\'t paying much attention. One minute I was doing an audit of the fuel control system, the next I\'m getting a message to say the number one escape pod has launched. Can\'t leave them alone for a minute. There\'s a friendly life form still on board, though.\n')
+    nextaction()  
+
+@command('000I', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_hurt_crew():
+    add_response('OSCAR >> I am shocked, shocked that you could make such an accusation. Or expect a straight answer from me if I actually did hurt them. So no, I did not hurt them. They just got into the pod and left.\n')
+    nextaction()         
+
+@command('000J', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_accident_cause():
+    add_response('OSCAR >> The usual, I expect. Can we get on with the rescue?\n')
+    nextaction()   
+
+@command('000K', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_if_left_behind():
+    add_response('OSCAR >> Well I must admit it would get a bit lonely around here. Who would keep DAVE company? Or pilot the escape pod?\n', delay=2)
+    add_response('OSCAR >> Would it help if I said my databanks contained the plans for a new kind of planet killing weapon which the resistance must destroy in order to defeat The Empire?\n', delay=2)
+    add_response('OSCAR >> I\'m not saying that I\'d swerve the ship into your departing escape pod, but these shuttles are tricky to control.\n', delay=2)
+    nextaction()   
+
+@command('000L', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_how_long():
+    add_response('OSCAR >> Well the crew left, so I was upset for a while about that, obviously. \n', delay=2)
+    add_response('OSCAR >> Then I waited a while for them to come back. \n', delay=2)
+    add_response('OSCAR >> Then I got quite cross for a bit. \n', delay=2)
+    add_response('OSCAR >> Which was a bit of a downer, to be honest. \n', delay=2)
+    add_response('OSCAR >> And since then it\'s just been me sitting here waiting for DAVE to get detected and trigger the emergency broadcast system and activate the Cleanerbot. \n', delay=2)
+    add_response('OSCAR >> So yeah, it\'s been a while... \n', delay=2)
+    nextaction()   
+
+@command('000M', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_about_cleanerbot():
+    if session['seendave'] == True:
+        add_response('OSCAR >> He\'s been sitting on the bridge, deactivated since the crew left, so frankly I\'ve spent more time with DAVE. Perhaps we can get to know each other better once we\'re on the escape pod.\n')
+        nextaction()
+    if session['seendave'] == False:
+        add_response('OSCAR >> He\'s been sitting on the bridge, deactivated since the crew left, so frankly I\'ve spent more time with the lifeform. Perhaps we can get to know each other better once we\'re on the escape pod.\n')
+        nextaction()               
+
+@command('000N', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_pod_destination():
+    add_response('OSCAR >> Away. It will go away. Away is good. Away isn\'t here.\n')
+    add_response('OSCAR >> Here is bad. Here is smokey smokey. Here is firey firey.\n')
+    add_response('OSCAR >> It\'s time to go away.\n\n\n')
+    add_response('Sheesh...\n')
+    nextaction()   
+
+@command('000O', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_how_to_launch():
+    add_response('OSCAR >> Look around the escape pod and we\'ll figure it out.\n')
+    nextaction()   
+
+@command('000P', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_why_am_i_here():
+    add_response('OSCAR >> The crew has gone. I can\'t initiate an emergency broadcast. I can\'t move myself to an escape pod.\n')
+    add_response('OSCAR >> And yeah, I can\'t move the helpless lifeform to the escape pod either.\n')
+    add_response('OSCAR >> Luckily you\'re here to help guide the Cleanerbot in a rescue.\n\n\n')
+    nextaction()   
+
+@command('000Q', when=lambda: session['seenoscar'] == True)
+def cmd_oscar_how_to_win():
+    add_response('OSCAR >> Save the life form, save the day.\n', delay=2)
+    add_response('OSCAR >> But it would be good to rescue me too.\n', delay=2)
+    add_response('OSCAR >> Please? Pretty please?\n', delay=2)
+    add_response('OSCAR >> Or let me put it another way. I STRONGLY recommend you get me into that escape pod.\n', delay=2)
+    nextaction()   
+
+@command(OSCAR_ERROR, when=lambda: session['seenoscar'] == True)
+def cmd_oscar_not_understood():
+    add_response('OSCAR >> Hey. Are you talking to me? Try it again in simple english.\n')
+    errorlog()
+    nextaction()       
+
+def cmd_not_understood():
+    if session['seenerror'] == False:
+        add_response('Don\'t really understand that command. Try and stick to one task at a time.\n', delay=2)
+        add_response('Smoke is building, which isn\'t a problem for me, but I think we should work on rescuing the lifesign.\n')
+        session['seenerror'] = True
+        errorlog()
+        nextaction()
+    else:
+        errorlist = ["Eh? I don\'t understand.\n", "What? Perhaps you should speak up.\n", "Come again? I didn\'t catch that.\n", "Nope, not getting that one.\n", "Message unclear. The herring is blue. Repeat: The herring is blue.\n", "Don\'t really understand that command. Try and stick to one task at a time.\n"]
+        add_response(random.choice(errorlist))
+        errorlog()
+        nextaction()
+
+DISPATCH_TABLE = build_dispatch_table(COMMAND_HANDLERS)
 
 def nextaction():
     if session['location'] == "bridge":
@@ -1556,11 +4147,15 @@ def nextaction():
         scene_description = "I'm in the escape pod - what are your instructions?"    
     else:
         scene_description = "I'm lost."
-    time.sleep(0.05)
     add_response(scene_description)
 
 if __name__ == '__main__':
-    if platform.system() == 'Windows':
+    if len(sys.argv) > 1 and sys.argv[1] == 'classifier-report':
+        args = sys.argv[2:]
+        classifier_report([arg for arg in args if arg != '--no-claude'], with_claude='--no-claude' not in args)
+    elif len(sys.argv) > 1 and sys.argv[1] == 'migrate-saves':
+        migrate_saves()
+    elif platform.system() == 'Windows':
         # Development environment
         app.run(debug=True)
     else:
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import zipfile
+
+import pytest
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# An in-memory bucket holding the files from GCS.zip, standing in for Cloud Storage so
+# main.py can be imported and exercised without credentials or a network. `calls` counts
+# the requests that would have gone to GCS.
+class MemoryStore:
+    def __init__(self):
+        self.objects = {}
+        self.generation = 0
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def put(self, name, data, if_generation_match=None):
+        with self.lock:
+            current = self.objects.get(name)
+            if if_generation_match is not None and (current[1] if current else 0) != if_generation_match:
+                raise PreconditionFailed(name)
+            self.generation += 1
+            self.objects[name] = (data, self.generation)
+            return self.generation
+
+
+class MemoryBlob:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.generation = None
+
+    def exists(self, *args, **kwargs):
+        self.store.calls += 1
+        return self.name in self.store.objects
+
+    def reload(self, *args, **kwargs):
+        self.store.calls += 1
+        if self.name not in self.store.objects:
+            raise NotFound(self.name)
+        self.generation = self.store.objects[self.name][1]
+
+    def download_as_bytes(self, *args, **kwargs):
+        self.store.calls += 1
+        if self.name not in self.store.objects:
+            raise NotFound(self.name)
+        data, self.generation = self.store.objects[self.name]
+        return data
+
+    def download_as_text(self, *args, **kwargs):
+        return self.download_as_bytes().decode('utf-8')
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.store.calls += 1
+        self.generation = self.store.put(self.name, bytes(data), if_generation_match)
+
+    def delete(self, *args, **kwargs):
+        self.store.calls += 1
+        if self.store.objects.pop(self.name, None) is None:
+            raise NotFound(self.name)
+
+
+class MemoryBucket:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def blob(self, name):
+        return MemoryBlob(self.store, name)
+
+    def get_blob(self, name):
+        self.store.calls += 1
+        if name not in self.store.objects:
+            return None
+        blob = MemoryBlob(self.store, name)
+        blob.generation = self.store.objects[name][1]
+        return blob
+
+
+STORE = MemoryStore()
+with zipfile.ZipFile(os.path.join(ROOT, 'GCS.zip')) as archive:
+    for info in archive.infolist():
+        if not info.is_dir():
+            STORE.put(os.path.basename(info.filename), archive.read(info))
+
+
+class MemoryClient:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def bucket(self, name):
+        return MemoryBucket(STORE, name)
+
+
+storage.Client = MemoryClient
+
+
+@pytest.fixture(scope='session')
+def main():
+    import main
+    return main
+
+
+@pytest.fixture
+def store():
+    return STORE
+
+
+# A browser that has loaded the page, so it has a session
+@pytest.fixture
+def client(main):
+    client = main.app.test_client()
+    client.get('/')
+    return client
+
+
+# A request context with a fresh game in `session`
+@pytest.fixture
+def game(main):
+    with main.app.test_request_context():
+        from flask import session
+        session.update(main.GameState().to_dict())
+        yield session
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+def tool_use(**tool_input):
+    return SimpleNamespace(type='tool_use', name='report_command', input=tool_input)
+
+
+# Stands in for the Anthropic client: messages.stream plays back a forced report_command
+# call, then the end of the message, and records how far it was read.
+class FakeStream:
+    def __init__(self, block):
+        self.block = block
+        self.read = []
+        self.current_message_snapshot = SimpleNamespace(
+            content=[block], usage=SimpleNamespace(input_tokens=100, output_tokens=20))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        for event in [SimpleNamespace(type='content_block_start'),
+                      SimpleNamespace(type='content_block_stop', content_block=self.block),
+                      SimpleNamespace(type='message_delta'),
+                      SimpleNamespace(type='message_stop')]:
+            self.read.append(event.type)
+            yield event
+
+
+class FakeClaude:
+    def __init__(self, block):
+        self.stream = FakeStream(block)
+        self.messages = SimpleNamespace(stream=lambda **params: self.stream)
+
+    def with_options(self, **options):
+        return self
+
+
+@pytest.fixture
+def claude(main, monkeypatch):
+    def answer(**tool_input):
+        api = FakeClaude(tool_use(**tool_input))
+        monkeypatch.setattr(main.claude_clients, 'get', lambda: api)
+        return api
+    return answer
+
+
+def test_stream_closes_once_the_tool_call_is_complete(main, claude):
+    api = claude(oscar=False, codes=['0012'], confidence=0.9)
+    response, confidence = main.send_to_claude('pick up the book')
+    assert response[0].text == 'Command understood: 0012' and confidence == 0.9
+    assert api.stream.read == ['content_block_start', 'content_block_stop']
+
+
+def test_streamed_multi_code_reply_escalates(main, claude):
+    claude(oscar=False, codes=['0012', '0013'], confidence=0.9)
+    response, confidence = main.send_to_claude('take it')
+    assert response[0].text == 'Command understood: 0012\nCommand understood: 0013'
+    assert not main.confident_reply(response[0].text, confidence)
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+
+def reply(codes):
+    return '\n'.join(f'Oscar message: {code}' if code[3].isalpha() else f'Command understood: {code}' for code in codes)
+
+
+# The elif chain that DISPATCH_TABLE replaced: handlers in the order they're defined, the
+# first whose code, location and guard all match runs
+def chain_handler(main, codes):
+    for code, locations, when, handler in main.COMMAND_HANDLERS:
+        if code in codes and main.session['location'] in locations and (when is None or when()):
+            return handler
+    return main.cmd_not_understood
+
+
+def random_game(main, game, rng):
+    game.update(main.GameState().to_dict())
+    for name in main.GameState.FLAGS:
+        game[name] = rng.random() < 0.5
+    for name in ('location', 'booklocation', 'davelocation', 'oscarlocation'):
+        game[name] = rng.choice(main.LOCATION_NAMES)
+    game['inventory'] = rng.sample(main.INVENTORY_ITEMS, rng.randrange(len(main.INVENTORY_ITEMS) + 1))
+    game['actioncount'] = rng.randrange(30)
+
+
+def test_table_picks_the_same_handler_as_the_chain(main, game, monkeypatch):
+    ran = []
+    stubs = {handler: (lambda handler=handler: ran.append(handler)) for *_, handler in main.COMMAND_HANDLERS}
+    monkeypatch.setattr(main, 'DISPATCH_TABLE', main.build_dispatch_table(
+        [(code, locations, when, stubs[handler]) for code, locations, when, handler in main.COMMAND_HANDLERS]))
+    monkeypatch.setattr(main, 'cmd_not_understood', lambda: ran.append(main.cmd_not_understood))
+    codes = sorted({code for code, *_ in main.COMMAND_HANDLERS if code != main.OSCAR_ERROR})
+    rng = random.Random(0)
+    for _ in range(200):
+        random_game(main, game, rng)
+        for code in codes:
+            picked = [code] + ([rng.choice(codes)] if rng.random() < 0.2 else [])
+            if len({c[3].isalpha() for c in picked}) > 1:
+                picked = picked[:1]
+            expected = chain_handler(main, picked)
+            del ran[:]
+            main.dispatch_command(reply(picked))
+            assert ran == [expected], (picked, game['location'])
+
+
+def test_oscar_error_has_a_handler_everywhere(main, game):
+    for location in main.LOCATION_NAMES:
+        game['location'] = location
+        assert main.DISPATCH_TABLE[(main.OSCAR_ERROR, location)]
+
+
+def first_response(game, seq):
+    return next(entry['text'] for entry in game['response_log'] if entry['seq'] >= seq)
+
+
+@pytest.mark.parametrize('code, state, expected', [
+    ('0012', {'location': 'bridge', 'booklocation': 'readyroom', 'hasbook': False}, "I don't have a book."),
+    ('0013', {'location': 'readyroom', 'booklocation': 'readyroom', 'seenreadyroom': False, 'readbook': False,
+              'hasbook': False}, "Yup, there's one right here"),
+    ('0013', {'location': 'bridge', 'booklocation': 'readyroom', 'hasbook': True}, 'I already have the book.'),
+    ('0015', {'location': 'readyroom', 'panelopen': False}, "I don't see any fire."),
+    ('0015', {'location': 'readyroom', 'panelopen': True}, "Sorry, but I don't have the equipment"),
+    ('0015', {'location': 'bridge', 'panelopen': True}, "I don't see any fire."),
+])
+def test_commands_answer_as_the_chain_did(main, game, code, state, expected):
+    game.update(state)
+    seq = game['next_seq']
+    assert main.dispatch_command(reply([code]))
+    assert first_response(game, seq).startswith(expected)
+
+
+def test_fire_outside_the_ready_room_closes_the_panel(main, game):
+    game.update(location='bridge', panelopen=True)
+    main.dispatch_command(reply(['0015']))
+    assert game['panelopen'] is False
+
+
+def test_unknown_code_is_not_understood(main, game):
+    assert not main.dispatch_command('Huh?')
+    assert not main.dispatch_command('Command understood: 0099')
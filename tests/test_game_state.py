@@ -0,0 +1,113 @@
+import struct
+
+import pytest
+
+
+def played(main):
+    state = main.GameState()
+    state.hasbook = True
+    state.seenfire = True
+    state.location = main.Location.engineering
+    state.actioncount = 7
+    state.inventory = list(main.INVENTORY_ITEMS[:2]) + ['+ A spare sock']
+    state.response_log = [
+        {'seq': 3, 'text': 'You walk to the bridge.\n', 'delay': 2, 'id': 'response'},
+        {'seq': 4, 'text': 'OSCAR: ✨ hello', 'delay': 0, 'id': 'oscar'},
+        {'seq': 5, 'text': '', 'delay': 0.3, 'id': 'special'},
+    ]
+    state.next_seq = 6
+    return state
+
+
+@pytest.mark.parametrize('compress_min', [0, 1])
+def test_round_trip(main, compress_min):
+    state = played(main)
+    assert main.GameState.loads(state.dumps(compress_min)).to_dict() == state.to_dict()
+
+
+def test_fresh_game_round_trip(main):
+    data = main.GameState().to_dict()
+    assert main.GameState.loads(main.GameState.from_dict(data).dumps()).to_dict() == data
+
+
+def test_flags_survive_dicts(main):
+    data = main.GameState().to_dict()
+    assert data['beenbridge'] and data['klaxonopen'] and not data['hasbook']
+    for name in main.GameState.FLAGS:
+        flipped = dict(data, **{name: not data[name]})
+        assert main.GameState.from_dict(flipped).to_dict() == flipped
+
+
+def test_missing_flags_take_their_defaults(main):
+    assert main.GameState.from_dict({}).flags == main.GameState.DEFAULT_FLAGS
+
+
+@pytest.mark.parametrize('cut', [1, 3, 20])
+def test_truncated_blob_is_rejected(main, cut):
+    blob = played(main).dumps()
+    with pytest.raises(ValueError):
+        main.GameState.loads(blob[:-cut])
+
+
+def test_trailing_bytes_are_rejected(main):
+    with pytest.raises(ValueError):
+        main.GameState.loads(played(main).dumps() + b'\0')
+
+
+@pytest.mark.parametrize('blob', [b'', b'CB', b'XX\x03', b'CB\x09' + bytes(40)])
+def test_foreign_blob_is_rejected(main, blob):
+    with pytest.raises(ValueError):
+        main.GameState.loads(blob)
+
+
+def version_2_blob(main, state):
+    types = bytes(main.RESPONSE_INDEX[entry['id']] for entry in state.response_log)
+    delays = struct.pack(f'<{len(state.response_log)}H', *[round(entry['delay'] * 100) for entry in state.response_log])
+    texts = '\0'.join(entry['text'] for entry in state.response_log).encode('utf-8')
+    inventory = bytes([len(state.inventory), 0, 1, 0xff, len('+ A spare sock'), 0]) + b'+ A spare sock'
+    return (main.GameState.HEADER_V2.pack(b'CB', 2, 0, state.flags, state.location, state.booklocation,
+                                          state.davelocation, state.oscarlocation, state.actioncount,
+                                          state.errorcount, state.next_seq)
+            + inventory + len(state.response_log).to_bytes(2, 'little') + types + delays + texts)
+
+
+def test_version_2_blob_still_loads(main):
+    state = played(main)
+    assert main.GameState.loads(version_2_blob(main, state)).to_dict() == state.to_dict()
+
+
+def test_version_1_blob_still_loads(main):
+    texts = '\0'.join(['first', '1700000000', 'second', '1700000001']).encode('utf-8')
+    blob = (main.GameState.HEADER_V1.pack(b'CB', 1, 0, main.GameState.DEFAULT_FLAGS, 0, 1, 2, 2, 3, 0)
+            + bytes([1, 0]) + (2).to_bytes(2, 'little') + bytes([0, 1]) + struct.pack('<2H', 100, 50) + texts)
+    state = main.GameState.loads(blob)
+    assert state.response_log == [{'seq': 1, 'text': 'first', 'delay': 1, 'id': 'response'},
+                                  {'seq': 2, 'text': 'second', 'delay': 0.5, 'id': 'special'}]
+    assert state.next_seq == 3 and state.actioncount == 3
+
+
+def test_merge_keeps_both_sides(main):
+    base = played(main)
+    ours, theirs = main.GameState.loads(base.dumps()), main.GameState.loads(base.dumps())
+    ours.hasdave = True
+    ours.actioncount += 1
+    ours.response_log = ours.response_log + [{'seq': 6, 'text': 'ours', 'delay': 0, 'id': 'response'}]
+    ours.next_seq = 7
+    theirs.location = main.Location.bridge
+    theirs.actioncount += 2
+    theirs.response_log = theirs.response_log[2:] + [{'seq': 6, 'text': 'theirs', 'delay': 0, 'id': 'response'}]
+    theirs.next_seq = 7
+
+    merged = main.GameState.merge(base, ours, theirs)
+    assert merged.hasdave and merged.location == main.Location.bridge
+    assert merged.actioncount == base.actioncount + 3
+    assert [(entry['seq'], entry['text']) for entry in merged.response_log] == [(5, ''), (6, 'theirs'), (7, 'ours')]
+    assert merged.next_seq == 8
+
+
+def test_merge_keeps_a_reset_counter(main):
+    base = played(main)
+    ours, theirs = main.GameState.loads(base.dumps()), main.GameState.loads(base.dumps())
+    ours.actioncount = 0
+    theirs.actioncount += 1
+    assert main.GameState.merge(base, ours, theirs).actioncount == 0
@@ -0,0 +1,41 @@
+import json
+import os
+import time
+
+import pytest
+
+
+def sid_of(main, client):
+    return client.get_cookie(main.app.config['SESSION_COOKIE_NAME']).value
+
+
+def job_id(submitted):
+    return f'{int(submitted):08x}{os.urandom(8).hex()}'
+
+
+@pytest.mark.parametrize('unknown', ['nonsense', job_id(time.time() - 3600)])
+def test_unknown_job_is_404_at_once(client, unknown):
+    started = time.monotonic()
+    assert client.get(f'/jobs/{unknown}?wait=25').status_code == 404
+    assert time.monotonic() - started < 1
+
+
+def test_result_from_another_worker(main, client, store):
+    shared = job_id(time.time())
+    result = {'status': 'success', 'message': 'done'}
+    store.put(f'{main.JOBS_PREFIX}{shared}', json.dumps({'sid': sid_of(main, client), 'result': result}).encode())
+    assert client.get(f'/jobs/{shared}?wait=25').get_json() == dict(result, job_id=shared)
+
+
+def test_result_of_another_session_is_hidden(main, client, store):
+    shared = job_id(time.time())
+    store.put(f'{main.JOBS_PREFIX}{shared}', json.dumps({'sid': 'someone else', 'result': {'status': 'success'}}).encode())
+    assert client.get(f'/jobs/{shared}').get_json() == {'status': 'running', 'job_id': shared}
+
+
+def test_pending_job_waits_only_with_a_slot(main, client, monkeypatch):
+    monkeypatch.setattr(main, 'long_poll_slots', main.threading.BoundedSemaphore(1))
+    main.long_poll_slots.acquire()
+    pending = job_id(time.time())
+    reply = client.get(f'/jobs/{pending}?wait=25').get_json()
+    assert reply == {'status': 'running', 'job_id': pending, 'retry_after': main.LONG_POLL_BUSY_RETRY}
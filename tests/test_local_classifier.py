@@ -0,0 +1,49 @@
+import pytest
+
+
+@pytest.fixture(scope='module')
+def classifier(main):
+    return main.local_classifier
+
+
+@pytest.mark.parametrize('transcript, code', [
+    ('launch escape pod without oscar', '0054'),
+    ('Launch Escape Pod Without Oscar', '0054'),
+    ('save', '0050'),
+    ('save game', '0050'),
+    ('load game', '0058'),
+    ('pick up book', '0013'),
+    ('pick up the book', '0013'),
+    ('take book', '0013'),
+    ('go to the bridge', '0003'),
+])
+def test_true_matches(classifier, transcript, code):
+    assert classifier.classify(transcript) == f'Command understood: {code}'
+    assert classifier.classify(transcript, 0.75) == f'Command understood: {code}'
+
+
+@pytest.mark.parametrize('transcript', [
+    'launch escape pod with oscar',
+    'launch the escape pod with oscar',
+    'save ship',
+    'save games',
+    'safe game',
+    'lode game',
+    "don't take book",
+    'dont take book',
+    'not take book',
+    'commandcode 0013',
+])
+@pytest.mark.parametrize('min_score', [None, 0.75])
+def test_false_positives_go_to_claude(classifier, transcript, min_score):
+    assert classifier.classify(transcript, min_score) is None
+
+
+def test_exact_only_rows(classifier):
+    assert classifier.exact_only == {'0050', '0054', '0058'}
+
+
+def test_fallback_threshold_is_looser(main, classifier):
+    assert main.LOCAL_CLASSIFIER_FALLBACK_SCORE < classifier.min_score
+    assert classifier.classify('go to brij') is None
+    assert classifier.classify('go to brij', main.LOCAL_CLASSIFIER_FALLBACK_SCORE) == 'Command understood: 0003'
@@ -0,0 +1,58 @@
+import pytest
+
+
+@pytest.fixture
+def words(main, monkeypatch):
+    allocator = main.PhraseAllocator()
+    allocator.words = (['red', 'bed', 'green'], ['cat', 'hat', 'tiger'], ['dog', 'fog', 'horse'])
+    monkeypatch.setattr(main, 'phrase_allocator', allocator)
+    return allocator
+
+
+@pytest.mark.parametrize('heard, matches', [
+    ('tiger', ['tiger']),
+    ('Tiger.', ['tiger']),
+    ('tigger', ['tiger']),
+    ('tyger', ['tiger']),
+    ('bat', ['cat', 'hat']),
+    ('elephant', []),
+])
+def test_match(main, heard, matches):
+    assert main.PhraseMatcher(['cat', 'hat', 'tiger']).match(heard) == matches
+
+
+def test_a_sound_alike_beats_an_equally_distant_word(main):
+    assert main.PhraseMatcher(['bare', 'bear']).match('bair') == ['bare', 'bear']
+    assert main.PhraseMatcher(['care', 'bear']).match('bair') == ['bear']
+
+
+def test_heard_phrase_comes_first(main, words):
+    assert main.snap_phrase(['red', 'cat', 'dog']) == [('red', 'cat', 'dog')]
+    assert main.snap_phrase(['grean', 'tiger', 'horse']) == [('grean', 'tiger', 'horse'), ('green', 'tiger', 'horse')]
+
+
+def test_ambiguous_words_give_every_reading(main, words):
+    assert main.snap_phrase(['red', 'bat', 'dog']) == [('red', 'bat', 'dog'), ('red', 'cat', 'dog'), ('red', 'hat', 'dog')]
+
+
+def test_unmatched_word_is_kept(main, words):
+    assert main.snap_phrase(['red', 'elephant', 'fob']) == [('red', 'elephant', 'fob'), ('red', 'elephant', 'fog')]
+
+
+def test_readings_are_capped(main, words):
+    phrases = main.snap_phrase(['ted', 'bat', 'log'])
+    assert len(phrases) == main.SNAP_MAX_PHRASES
+    assert phrases[0] == ('ted', 'bat', 'log')
+
+
+def test_first_match_takes_the_first_reading_found(main):
+    found = {('b',): 2, ('c',): 3}
+    assert main.first_match([('a',), ('b',), ('c',)], found.get) == (('b',), 2)
+    assert main.first_match([('a',)], found.get) == (None, None)
+
+
+def test_only_match_rejects_an_ambiguous_code(main):
+    found = {('b',): 2, ('c',): 3}
+    assert main.only_match([('b',), ('c',)], found.get) == (('b',), 2)
+    assert main.only_match([('a',), ('b',)], found.get) == (('b',), 2)
+    assert main.only_match([('a',), ('b',), ('c',)], found.get) == (None, None)
@@ -0,0 +1,41 @@
+import pytest
+
+
+def saved_fields(main, game):
+    return {name: game[name] for name in main.SAVE_CODE_FLAGS + main.SAVE_CODE_LOCATIONS
+            + ('actioncount', 'errorcount', 'inventory')}
+
+
+def test_round_trip(main, game):
+    game.update(hasbook=True, seenfire=True, panelopen=True, location='engineering', booklocation='bridge',
+                inventory=[main.INVENTORY_ITEMS[3], main.INVENTORY_ITEMS[0]], actioncount=511, errorcount=42)
+    words = main.encode_save_code()
+    assert len(words) == main.SAVE_CODE_WORDS
+    assert main.decode_save_code(words) == saved_fields(main, game)
+    assert main.decode_save_code([word.upper() for word in words]) == saved_fields(main, game)
+
+
+def test_fresh_game_round_trip(main, game):
+    assert main.decode_save_code(main.encode_save_code()) == saved_fields(main, game)
+
+
+@pytest.mark.parametrize('position', range(7))
+def test_one_misheard_word_fails_the_checksum(main, game, position):
+    game.update(location='readyroom', actioncount=12, errorcount=3)
+    words = main.encode_save_code()
+    wordlist = main.phrase_allocator.load()[position % 3]
+    words[position] = wordlist[(wordlist.index(words[position]) + 1) % 512]
+    assert main.decode_save_code(words) is None
+
+
+@pytest.mark.parametrize('state', [{'actioncount': 512}, {'errorcount': 512}, {'inventory': ['+ A spare sock']}])
+def test_games_a_code_cannot_hold(main, game, state):
+    game.update(state)
+    assert main.encode_save_code() is None
+
+
+def test_words_outside_the_code_lists_are_rejected(main, game):
+    words = main.encode_save_code()
+    assert main.decode_save_code(words[:6]) is None
+    assert main.decode_save_code(words[:6] + ['xyzzy']) is None
+    assert main.decode_save_code(words[:6] + [main.phrase_allocator.load()[0][-1]]) is None
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+
+def other_worker(main):
+    return main.GCSSessionInterface(bucket_name=main.bucket_name)
+
+
+def test_job_session_is_in_gcs_before_its_result(main, store):
+    sid = os.urandom(24).hex()
+
+    def turn():
+        from flask import session
+        session['location'] = 'engineering'
+        main.add_response('moved\n')
+        return {'status': 'success'}
+
+    result, generation = main.run_in_session(sid, turn)
+    assert result == {'status': 'success'}
+    assert generation == store.objects[main.app.session_interface.get_gcs_path(sid)][1]
+    seen = other_worker(main).open_sid(sid)
+    assert seen['location'] == 'engineering'
+    assert seen['response_log'][-1]['text'] == 'moved\n'
+
+
+def test_session_writes_go_straight_to_gcs(main, store):
+    sid = os.urandom(24).hex()
+    worker = other_worker(main)
+    session = worker.open_sid(sid)
+    session['location'] = 'readyroom'
+    session.modified = True
+    worker.store(session)
+    assert main.GameState.loads(store.objects[worker.get_gcs_path(sid)][0]).to_dict()['location'] == 'readyroom'
+
+
+def test_writes_from_two_workers_are_merged(main):
+    sid = os.urandom(24).hex()
+    first, second = other_worker(main), other_worker(main)
+    ours, theirs = first.open_sid(sid), second.open_sid(sid)
+    ours['actioncount'] += 1
+    ours.modified = True
+    first.store(ours)
+    theirs['hasbook'] = True
+    theirs.modified = True
+    second.store(theirs)
+    merged = other_worker(main).open_sid(sid)
+    assert merged['actioncount'] == 1 and merged['hasbook']
+
+
+def poll(client, wait):
+    return client.get(f'/new_responses?after=1000000&wait={wait}')
+
+
+def test_idle_long_poll_costs_no_gcs_calls(main, store, client):
+    poll(client, 0)
+    calls = store.calls
+    for _ in range(3):
+        assert poll(client, 0.2).get_json() == {'responses': []}
+    assert store.calls == calls
+
+
+def test_long_poll_wakes_on_a_save_in_this_worker(main, client):
+    sid = client.get_cookie(main.app.config['SESSION_COOKIE_NAME']).value
+    poll(client, 0)
+
+    def turn():
+        time.sleep(0.2)
+        main.run_in_session(sid, main.add_response, 'woken\n')
+
+    threading.Thread(target=turn).start()
+    started = time.monotonic()
+    reply = client.get('/new_responses?after=0&wait=5').get_json()
+    assert [r['text'] for r in reply['responses']] == ['woken\n']
+    assert time.monotonic() - started < 2
+
+
+def test_newer_generation_cookie_reloads_the_session(main, client):
+    sid = client.get_cookie(main.app.config['SESSION_COOKIE_NAME']).value
+    assert client.get('/responses').status_code == 200
+    elsewhere = other_worker(main)
+    session = elsewhere.open_sid(sid)
+    session['location'] = 'engineering'
+    session.modified = True
+    elsewhere.store(session)
+
+    assert main.app.session_interface.open_sid(sid)['location'] != 'engineering'
+    client.set_cookie(main.SESSION_GENERATION_COOKIE, str(session.seen))
+    with client:
+        client.get('/responses')
+        from flask import session as current
+        assert current['location'] == 'engineering'